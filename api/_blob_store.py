@@ -0,0 +1,146 @@
+"""
+Blob storage for generated images.
+
+Two interchangeable backends:
+
+- LocalBlobStore (local dev). Files under BLOB_DIR, default /tmp/blobs,
+  served by /api/blob. Each deployed function has its own /tmp, so /api/blob
+  can't see what /api/image wrote there: this is only a stand-in for a
+  single machine.
+- VercelBlobStore (production). Vercel Blob over its REST API, used when
+  BLOB_READ_WRITE_TOKEN is set. URLs point at the blob CDN.
+
+Names are content hashes (e.g. images/<sha256>.png), so a stored blob never
+changes: it can be cached by browsers forever and is never uploaded twice.
+get_blob_store() picks the backend; blob_urls_enabled() says whether its
+URLs can be handed to browsers.
+"""
+import os
+import re
+import shutil
+import threading
+from pathlib import Path
+
+import requests
+
+
+BLOB_DIR = os.environ.get('BLOB_DIR', '/tmp/blobs')
+
+BLOB_API_URL = 'https://blob.vercel-storage.com'
+
+# Seconds browsers and the CDN may cache a blob; names never get new content
+BLOB_MAX_AGE = 365 * 86400
+
+BLOB_NAME_RE = re.compile(r'^[a-z]+/[0-9a-f]{16,64}\.(png|jpg|webp)$')
+
+CONTENT_TYPES = {'png': 'image/png', 'jpg': 'image/jpeg', 'webp': 'image/webp'}
+
+
+def _rewind(content):
+    if not isinstance(content, bytes):
+        content.seek(0)
+    return content
+
+
+class LocalBlobStore:
+    """Blobs as files on the local filesystem, served by /api/blob."""
+
+    def __init__(self, root=BLOB_DIR):
+        self.root = Path(root)
+
+    def path(self, name):
+        """Filesystem path of a blob, or None for names that aren't blob names."""
+        if not BLOB_NAME_RE.match(name or ''):
+            return None
+        return self.root / name
+
+    def url(self, name):
+        return f'/api/blob?name={name}'
+
+    def put(self, name, content, content_type):
+        """Store bytes or a binary file object under name. Returns its URL."""
+        path = self.path(name)
+        if path is None:
+            raise ValueError(f'Invalid blob name: {name}')
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            temp_path = path.with_name(f'{path.name}.{os.getpid()}.{threading.get_ident()}.tmp')
+            with open(temp_path, 'wb') as f:
+                content = _rewind(content)
+                if isinstance(content, bytes):
+                    f.write(content)
+                else:
+                    shutil.copyfileobj(content, f)
+            temp_path.replace(path)
+        return self.url(name)
+
+
+class VercelBlobStore:
+    """Blobs in Vercel Blob via its REST API."""
+
+    def __init__(self, token):
+        self._session = requests.Session()
+        self._session.headers['Authorization'] = f'Bearer {token}'
+        self._session.headers['x-api-version'] = '7'
+        self._urls = {}  # name -> URL of blobs already uploaded from this instance
+        self._lock = threading.Lock()
+
+    def put(self, name, content, content_type):
+        """Store bytes or a binary file object under name. Returns its URL."""
+        with self._lock:
+            if name in self._urls:
+                return self._urls[name]
+        response = self._session.put(
+            f'{BLOB_API_URL}/{name}',
+            data=_rewind(content),
+            headers={
+                'x-content-type': content_type,
+                'x-add-random-suffix': '0',
+                'x-allow-overwrite': '1',
+                'x-cache-control-max-age': str(BLOB_MAX_AGE),
+            },
+            timeout=(3.05, 60)
+        )
+        response.raise_for_status()
+        url = response.json()['url']
+        with self._lock:
+            self._urls[name] = url
+        return url
+
+
+def read_blob(url):
+    """Bytes of a stored blob, given the URL put() returned for it."""
+    if url.startswith('/api/blob?name='):
+        path = LocalBlobStore(os.environ.get('BLOB_DIR', BLOB_DIR)).path(url.split('=', 1)[1])
+        if path is None:
+            raise ValueError(f'Invalid blob URL: {url}')
+        return path.read_bytes()
+    response = requests.get(url, timeout=(3.05, 60))
+    response.raise_for_status()
+    return response.content
+
+
+def blob_urls_enabled():
+    """True when stored blobs are reachable from any instance.
+
+    That is Vercel Blob, or the local store when BLOB_DIR is set explicitly
+    (local dev, where every function shares one filesystem).
+    """
+    return bool(os.environ.get('BLOB_READ_WRITE_TOKEN') or os.environ.get('BLOB_DIR'))
+
+
+_store = None
+_store_guard = threading.Lock()
+
+
+def get_blob_store():
+    """The configured store for this process: Vercel Blob when its token is set, else local files."""
+    global _store
+    with _store_guard:
+        if _store is None:
+            token = os.environ.get('BLOB_READ_WRITE_TOKEN')
+            if token:
+                _store = VercelBlobStore(token)
+            else:
+                _store = LocalBlobStore(os.environ.get('BLOB_DIR', BLOB_DIR))
+        return _store
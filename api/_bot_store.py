@@ -0,0 +1,276 @@
+"""
+Persistent reply bot storage: per-user settings, the replied-to set, reply
+logs and search watermarks.
+
+Two interchangeable backends:
+
+- SQLiteBotStore (local dev and execution/reply_worker.py). BOT_STORE_DB picks
+  the file, default /tmp/reply_bot.sqlite3. A UNIQUE (user, post, author)
+  index makes "already replied to this author on this post?" a single index
+  probe, and makes a duplicate insert fail, even with tens of thousands of
+  logged replies.
+- KVBotStore (production). This is Vercel KV / Upstash Redis over its REST
+  API, used when KV_REST_API_URL and KV_REST_API_TOKEN are set. The replied-to
+  authors of each post are a Redis set, so membership is O(1) and SADD
+  doubles as an atomic "claim".
+
+Serverless /tmp is per instance and not durable, so deployments should
+configure KV. get_bot_store() picks the backend.
+
+To reply at most once per author even with concurrent requests, claim the
+author with claim_reply() before posting, then either record_reply(...,
+claimed=True) or release_reply() if the post failed. Store failures raise
+one of STORE_ERRORS.
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+
+import requests
+
+from _reply_bot import DEFAULT_SETTINGS
+
+
+BOT_STORE_DB = os.environ.get('BOT_STORE_DB', '/tmp/reply_bot.sqlite3')
+
+# Reply log entries kept per user
+LOG_LIMIT = 1000
+
+# What either backend raises when the store itself fails
+STORE_ERRORS = (sqlite3.Error, requests.RequestException)
+
+
+def _default_settings():
+    settings = json.loads(json.dumps(DEFAULT_SETTINGS))
+    settings.pop('stats', None)
+    return settings
+
+
+class SQLiteBotStore:
+    """Bot storage in one SQLite file."""
+
+    def __init__(self, path=BOT_STORE_DB):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS bot_settings ('
+                'user_id TEXT PRIMARY KEY, settings TEXT NOT NULL, updated_at REAL)'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS reply_log ('
+                'id INTEGER PRIMARY KEY AUTOINCREMENT, user_id TEXT NOT NULL, post_id TEXT NOT NULL, '
+                'author_id TEXT NOT NULL, author_name TEXT, reply_to_id TEXT, reply_id TEXT, '
+                'reply_text TEXT, created_at REAL NOT NULL)'
+            )
+            self._conn.execute(
+                'CREATE UNIQUE INDEX IF NOT EXISTS reply_log_author ON reply_log (user_id, post_id, author_id)'
+            )
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS watermarks ('
+                'user_id TEXT, post_id TEXT, since_id TEXT, PRIMARY KEY (user_id, post_id))'
+            )
+
+    def get_settings(self, user_id):
+        with self._lock:
+            row = self._conn.execute('SELECT settings FROM bot_settings WHERE user_id = ?', (user_id,)).fetchone()
+        settings = _default_settings()
+        if row:
+            settings.update(json.loads(row[0]))
+        return settings
+
+    def save_settings(self, user_id, settings):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO bot_settings (user_id, settings, updated_at) VALUES (?, ?, ?)',
+                (user_id, json.dumps(settings), time.time())
+            )
+
+    def has_replied(self, user_id, post_id, author_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT 1 FROM reply_log WHERE user_id = ? AND post_id = ? AND author_id = ?',
+                (user_id, str(post_id), str(author_id))
+            ).fetchone()
+        return row is not None
+
+    def claim_reply(self, user_id, post_id, author_id):
+        """Reserve this author on this post. Returns False if already replied to (or claimed)."""
+        try:
+            with self._lock, self._conn:
+                self._conn.execute(
+                    'INSERT INTO reply_log (user_id, post_id, author_id, created_at) VALUES (?, ?, ?, ?)',
+                    (user_id, str(post_id), str(author_id), time.time())
+                )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def release_reply(self, user_id, post_id, author_id):
+        """Drop a claim whose reply was never sent."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                'DELETE FROM reply_log WHERE user_id = ? AND post_id = ? AND author_id = ? AND reply_text IS NULL',
+                (user_id, str(post_id), str(author_id))
+            )
+
+    def record_reply(self, user_id, entry, claimed=False):
+        """Log a reply. Returns False if this author was already replied to on this post.
+
+        claimed: the author was reserved with claim_reply(); fill in that entry.
+        """
+        values = (entry.get('author_name'), entry.get('reply_to_id'), entry.get('reply_id'),
+                  entry.get('reply_text'), entry.get('created_at') or time.time(),
+                  user_id, str(entry['post_id']), str(entry['author_id']))
+        try:
+            with self._lock, self._conn:
+                if claimed:
+                    self._conn.execute(
+                        'UPDATE reply_log SET author_name = ?, reply_to_id = ?, reply_id = ?, reply_text = ?, '
+                        'created_at = ? WHERE user_id = ? AND post_id = ? AND author_id = ?',
+                        values
+                    )
+                else:
+                    self._conn.execute(
+                        'INSERT INTO reply_log (author_name, reply_to_id, reply_id, reply_text, created_at, '
+                        'user_id, post_id, author_id) VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                        values
+                    )
+        except sqlite3.IntegrityError:
+            return False
+        return True
+
+    def reply_count(self, user_id, post_id):
+        with self._lock:
+            return self._conn.execute(
+                'SELECT COUNT(*) FROM reply_log WHERE user_id = ? AND post_id = ?', (user_id, str(post_id))
+            ).fetchone()[0]
+
+    def replies_sent(self, user_id):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM reply_log WHERE user_id = ?', (user_id,)).fetchone()[0]
+
+    def recent_replies(self, user_id, limit=50):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT post_id, author_id, author_name, reply_to_id, reply_id, reply_text, created_at '
+                'FROM reply_log WHERE user_id = ? ORDER BY id DESC LIMIT ?',
+                (user_id, int(limit))
+            ).fetchall()
+        keys = ('post_id', 'author_id', 'author_name', 'reply_to_id', 'reply_id', 'reply_text', 'created_at')
+        return [dict(zip(keys, row)) for row in rows]
+
+    def get_watermark(self, user_id, post_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT since_id FROM watermarks WHERE user_id = ? AND post_id = ?', (user_id, str(post_id))
+            ).fetchone()
+        return row[0] if row else None
+
+    def set_watermark(self, user_id, post_id, since_id):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO watermarks (user_id, post_id, since_id) VALUES (?, ?, ?)',
+                (user_id, str(post_id), str(since_id))
+            )
+
+
+class KVBotStore:
+    """Bot storage in Vercel KV / Upstash Redis via its REST API.
+
+    Keys per user:
+        bot:{uid}:settings          JSON string
+        bot:{uid}:replied:{post}    set of author ids
+        bot:{uid}:sent              counter
+        bot:{uid}:log               list of JSON entries, newest first, trimmed to LOG_LIMIT
+        bot:{uid}:watermarks        hash post id -> since_id
+    """
+
+    def __init__(self, url, token):
+        self.url = url.rstrip('/')
+        self._session = requests.Session()
+        self._session.headers['Authorization'] = f'Bearer {token}'
+
+    def _command(self, *args):
+        response = self._session.post(self.url, json=[str(a) for a in args], timeout=(3.05, 10))
+        response.raise_for_status()
+        return response.json().get('result')
+
+    def _pipeline(self, *commands):
+        response = self._session.post(
+            f'{self.url}/pipeline', json=[[str(a) for a in c] for c in commands], timeout=(3.05, 10)
+        )
+        response.raise_for_status()
+        return [item.get('result') for item in response.json()]
+
+    def get_settings(self, user_id):
+        raw = self._command('GET', f'bot:{user_id}:settings')
+        settings = _default_settings()
+        if raw:
+            settings.update(json.loads(raw))
+        return settings
+
+    def save_settings(self, user_id, settings):
+        self._command('SET', f'bot:{user_id}:settings', json.dumps(settings))
+
+    def has_replied(self, user_id, post_id, author_id):
+        return bool(self._command('SISMEMBER', f'bot:{user_id}:replied:{post_id}', author_id))
+
+    def claim_reply(self, user_id, post_id, author_id):
+        """Reserve this author on this post. Returns False if already replied to (or claimed)."""
+        return bool(self._command('SADD', f'bot:{user_id}:replied:{post_id}', author_id))
+
+    def release_reply(self, user_id, post_id, author_id):
+        """Drop a claim whose reply was never sent."""
+        self._command('SREM', f'bot:{user_id}:replied:{post_id}', author_id)
+
+    def record_reply(self, user_id, entry, claimed=False):
+        """Log a reply. Returns False if this author was already replied to on this post.
+
+        claimed: the author was reserved with claim_reply(); only log it.
+        """
+        if not claimed and not self.claim_reply(user_id, entry['post_id'], entry['author_id']):
+            return False
+        entry = dict(entry, created_at=entry.get('created_at') or time.time())
+        self._pipeline(
+            ['INCR', f'bot:{user_id}:sent'],
+            ['LPUSH', f'bot:{user_id}:log', json.dumps(entry)],
+            ['LTRIM', f'bot:{user_id}:log', 0, LOG_LIMIT - 1],
+        )
+        return True
+
+    def reply_count(self, user_id, post_id):
+        return int(self._command('SCARD', f'bot:{user_id}:replied:{post_id}') or 0)
+
+    def replies_sent(self, user_id):
+        return int(self._command('GET', f'bot:{user_id}:sent') or 0)
+
+    def recent_replies(self, user_id, limit=50):
+        return [json.loads(raw) for raw in self._command('LRANGE', f'bot:{user_id}:log', 0, int(limit) - 1) or []]
+
+    def get_watermark(self, user_id, post_id):
+        return self._command('HGET', f'bot:{user_id}:watermarks', post_id)
+
+    def set_watermark(self, user_id, post_id, since_id):
+        self._command('HSET', f'bot:{user_id}:watermarks', post_id, since_id)
+
+
+_store = None
+_store_guard = threading.Lock()
+
+
+def get_bot_store():
+    """The configured store for this process: KV when its env vars are set, else SQLite."""
+    global _store
+    with _store_guard:
+        if _store is None:
+            kv_url = os.environ.get('KV_REST_API_URL')
+            kv_token = os.environ.get('KV_REST_API_TOKEN')
+            if kv_url and kv_token:
+                _store = KVBotStore(kv_url, kv_token)
+            else:
+                _store = SQLiteBotStore(os.environ.get('BOT_STORE_DB', BOT_STORE_DB))
+        return _store
@@ -0,0 +1,102 @@
+"""
+Follower/post count snapshots of competitor accounts.
+
+Every time /api/competitor-lookup fetches a handle, its public_metrics are
+recorded here (at most once per SNAPSHOT_INTERVAL per handle), building a
+history that growth_30d and post_frequency are computed from.
+
+SQLite at COMPETITOR_DB (default /tmp/competitors.sqlite3), falling back to
+memory if the file can't be opened.
+"""
+import os
+import time
+import sqlite3
+import threading
+
+
+COMPETITOR_DB = os.environ.get('COMPETITOR_DB', '/tmp/competitors.sqlite3')
+
+# One snapshot per handle per this many seconds
+SNAPSHOT_INTERVAL = int(os.environ.get('COMPETITOR_SNAPSHOT_INTERVAL', 6 * 3600))
+
+GROWTH_DAYS = 30
+DAY = 86400
+
+
+class CompetitorStore:
+    """SQLite-backed public_metrics history per lowercase username."""
+
+    def __init__(self, path=COMPETITOR_DB):
+        self._lock = threading.RLock()
+        try:
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+            self._init_schema()
+        except sqlite3.Error:
+            self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+            self._init_schema()
+
+    def _init_schema(self):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS snapshots ('
+                'username TEXT NOT NULL, taken_at REAL NOT NULL, followers INTEGER, following INTEGER, '
+                'tweets INTEGER, listed INTEGER)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS snapshots_user ON snapshots (username, taken_at)')
+
+    def record(self, username, metrics, now=None):
+        """Snapshot public_metrics unless the last snapshot is under SNAPSHOT_INTERVAL old."""
+        now = now or time.time()
+        username = username.lower()
+        with self._lock, self._conn:
+            last = self._conn.execute(
+                'SELECT MAX(taken_at) FROM snapshots WHERE username = ?', (username,)
+            ).fetchone()[0]
+            if last is not None and now - last < SNAPSHOT_INTERVAL:
+                return False
+            self._conn.execute(
+                'INSERT INTO snapshots VALUES (?, ?, ?, ?, ?, ?)',
+                (username, now, metrics.get('followers_count'), metrics.get('following_count'),
+                 metrics.get('tweet_count'), metrics.get('listed_count'))
+            )
+        return True
+
+    def history(self, username, days=GROWTH_DAYS, now=None):
+        """Snapshots of the last `days` days, oldest first, as (taken_at, followers, tweets)."""
+        now = now or time.time()
+        with self._lock:
+            return self._conn.execute(
+                'SELECT taken_at, followers, tweets FROM snapshots WHERE username = ? AND taken_at >= ? '
+                'ORDER BY taken_at',
+                (username.lower(), now - days * DAY)
+            ).fetchall()
+
+    def trends(self, username, now=None):
+        """Return (growth_pct, tweets_per_day) over the snapshot history, None where unknown."""
+        history = self.history(username, now=now)
+        if len(history) < 2:
+            return None, None
+        (first_at, first_followers, first_tweets), (last_at, last_followers, last_tweets) = history[0], history[-1]
+
+        growth = None
+        if first_followers:
+            growth = (last_followers - first_followers) / first_followers * 100
+
+        per_day = None
+        span_days = (last_at - first_at) / DAY
+        if span_days >= 1 and first_tweets is not None and last_tweets is not None:
+            per_day = max(0, last_tweets - first_tweets) / span_days
+        return growth, per_day
+
+
+_store = None
+_store_guard = threading.Lock()
+
+
+def get_competitor_store():
+    """The CompetitorStore for this warm instance, opened on first use."""
+    global _store
+    with _store_guard:
+        if _store is None:
+            _store = CompetitorStore()
+        return _store
@@ -0,0 +1,149 @@
+"""
+Response cache for /api/generate.
+
+Two tiers, both keyed by the normalized request parameters (platform, tone,
+type, variations) plus the prompt:
+
+- exact: the prompt after lowercasing and whitespace folding, in an LRU with
+  a TTL,
+- near-duplicate: a MinHash signature of the prompt's character 5-grams,
+  indexed with LSH bands, so "GM post about coffee" and "gm post about
+  coffee!" share one completion. A candidate is used when its estimated
+  Jaccard similarity reaches GENERATION_CACHE_SIMILARITY (0 disables the
+  tier).
+
+The cache lives in memory per warm instance. Callers pass a bypass flag
+(the "regenerate" button) to skip lookups; the fresh result replaces the entry.
+"""
+import os
+import re
+import json
+import time
+import random
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+GENERATION_CACHE_TTL = int(os.environ.get('GENERATION_CACHE_TTL', 3600))
+GENERATION_CACHE_SIZE = int(os.environ.get('GENERATION_CACHE_SIZE', 256))
+GENERATION_CACHE_SIMILARITY = float(os.environ.get('GENERATION_CACHE_SIMILARITY', 0.9))
+
+SHINGLE_SIZE = 5
+NUM_PERM = 64
+BANDS = 16  # 16 bands of 4 rows: pairs above ~0.75 similarity almost always share a band
+MAX_PROMPT_CHARS = 4000
+
+EXACT = 'exact'
+SIMILAR = 'similar'
+
+_MERSENNE_PRIME = (1 << 61) - 1
+_rng = random.Random(1)
+_PERMUTATIONS = [(_rng.randrange(1, _MERSENNE_PRIME), _rng.randrange(0, _MERSENNE_PRIME)) for _ in range(NUM_PERM)]
+
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_prompt(prompt):
+    return _WHITESPACE.sub(' ', (prompt or '').lower()).strip()
+
+
+def minhash(text):
+    """MinHash signature of the text's character shingles."""
+    text = text[:MAX_PROMPT_CHARS]
+    shingles = {text[i:i + SHINGLE_SIZE] for i in range(max(1, len(text) - SHINGLE_SIZE + 1))}
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), 'big') for s in shingles]
+    return tuple(min((a * h + b) % _MERSENNE_PRIME for h in hashes) for a, b in _PERMUTATIONS)
+
+
+def similarity(sig_a, sig_b):
+    """Estimated Jaccard similarity of two signatures."""
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / len(sig_a)
+
+
+class GenerationCache:
+    """LRU + TTL cache of generation payloads with an optional MinHash tier."""
+
+    def __init__(self, ttl=GENERATION_CACHE_TTL, max_entries=GENERATION_CACHE_SIZE,
+                 min_similarity=GENERATION_CACHE_SIMILARITY):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.min_similarity = min_similarity
+        self._entries = OrderedDict()   # key -> (value, stored_at, signature, band_keys)
+        self._bands = {}                # band key -> set of entry keys
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(params, prompt):
+        raw = json.dumps([list(params), prompt], ensure_ascii=False)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    @staticmethod
+    def _band_keys(params, signature):
+        rows = NUM_PERM // BANDS
+        scope = json.dumps(list(params))
+        return [f'{scope}:{i}:{hash(signature[i * rows:(i + 1) * rows])}' for i in range(BANDS)]
+
+    def _drop(self, key):
+        _, _, _, band_keys = self._entries.pop(key)
+        for band_key in band_keys:
+            members = self._bands.get(band_key)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del self._bands[band_key]
+
+    def get(self, params, prompt):
+        """Return (value, EXACT or SIMILAR), or (None, None) on a miss."""
+        prompt = normalize_prompt(prompt)
+        key = self._key(params, prompt)
+        now = time.time()
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if now - entry[1] < self.ttl:
+                    self._entries.move_to_end(key)
+                    return entry[0], EXACT
+                self._drop(key)
+
+        if not self.min_similarity:
+            return None, None
+
+        signature = minhash(prompt)
+        with self._lock:
+            candidates = set()
+            for band_key in self._band_keys(params, signature):
+                candidates.update(self._bands.get(band_key, ()))
+
+            best, best_score = None, self.min_similarity
+            for candidate in candidates:
+                value, stored_at, candidate_signature, _ = self._entries[candidate]
+                if now - stored_at >= self.ttl:
+                    continue
+                score = similarity(signature, candidate_signature)
+                if score >= best_score:
+                    best, best_score = candidate, score
+            if best is None:
+                return None, None
+            self._entries.move_to_end(best)
+            return self._entries[best][0], SIMILAR
+
+    def set(self, params, prompt, value):
+        prompt = normalize_prompt(prompt)
+        key = self._key(params, prompt)
+        signature = minhash(prompt) if self.min_similarity else None
+        band_keys = self._band_keys(params, signature) if signature else []
+
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = (value, time.time(), signature, band_keys)
+            for band_key in band_keys:
+                self._bands.setdefault(band_key, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._drop(next(iter(self._entries)))
+
+
+# Created once per warm instance
+generation_cache = GenerationCache()
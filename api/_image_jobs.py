@@ -0,0 +1,283 @@
+"""
+Async image generation jobs for /api/image.
+
+A submitted job gets an id right away and is rendered by
+execution/image_worker.py, a long-running worker outside the serverless
+functions, so the submitting request returns in milliseconds and browsers
+poll for the result instead of each holding a connection open for up to
+two minutes. Identical requests submitted while a job for them is queued or
+running join that job instead of starting another render.
+
+Jobs carry only plain values (the final prompt, size, quality and the
+reference image's blob URL), so whichever process claims one can render it.
+Records and the queue live in one of two interchangeable stores, like the
+reply bot's (see _bot_store.py):
+
+- SQLiteJobStore (local dev). IMAGE_JOB_DB picks the file, default
+  /tmp/image_jobs.sqlite3; the API and the worker must share it.
+- KVJobStore (production). This is Vercel KV / Upstash Redis over its REST
+  API, used when KV_REST_API_URL and KV_REST_API_TOKEN are set, so any
+  instance can answer a poll. SET NX on the request key claims it for a job.
+
+The worker writes a heartbeat every poll. jobs_enabled() is only true while
+one is fresh and the blob store is shared, so without a running worker
+/api/image keeps generating synchronously. A job still queued or running
+after JOB_TIMEOUT is reported as failed and no longer joined.
+"""
+import os
+import json
+import time
+import secrets
+import sqlite3
+import threading
+
+import requests
+
+from _blob_store import blob_urls_enabled
+
+
+IMAGE_JOB_DB = os.environ.get('IMAGE_JOB_DB', '/tmp/image_jobs.sqlite3')
+
+# Seconds. Longer than the 120 s OpenAI timeout plus storing the result
+JOB_TIMEOUT = 180
+# Finished jobs are kept this long for polling
+JOB_TTL = 3600
+# A worker that hasn't checked in for this long is presumed gone
+HEARTBEAT_TTL = 30
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+ACTIVE = (QUEUED, RUNNING)
+
+
+def _new_job(key, params, now):
+    return {
+        'id': secrets.token_urlsafe(12), 'key': key, 'status': QUEUED, 'params': params,
+        'created_at': now, 'updated_at': now, 'result': None, 'error': None,
+    }
+
+
+def _expire(job, now):
+    """Report a job whose worker never finished as failed."""
+    if job and job['status'] in ACTIVE and now - job['created_at'] > JOB_TIMEOUT:
+        job.update(status=FAILED, error='Image generation timed out')
+    return job
+
+
+class SQLiteJobStore:
+    """Job records and the queue in one SQLite file."""
+
+    def __init__(self, path=IMAGE_JOB_DB):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        with self._lock, self._conn:
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS image_jobs ('
+                'id TEXT PRIMARY KEY, key TEXT NOT NULL, status TEXT NOT NULL, created_at REAL NOT NULL, '
+                'updated_at REAL NOT NULL, result TEXT, error TEXT, params TEXT)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS image_jobs_key ON image_jobs (key, created_at)')
+            self._conn.execute('CREATE INDEX IF NOT EXISTS image_jobs_status ON image_jobs (status, created_at)')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS image_worker (id INTEGER PRIMARY KEY CHECK (id = 1), seen_at REAL)'
+            )
+
+    _COLUMNS = 'id, key, status, created_at, updated_at, result, error, params'
+
+    @staticmethod
+    def _row_to_job(row):
+        job_id, key, status, created_at, updated_at, result, error, params = row
+        return {
+            'id': job_id, 'key': key, 'status': status, 'params': json.loads(params) if params else None,
+            'created_at': created_at, 'updated_at': updated_at,
+            'result': json.loads(result) if result else None, 'error': error,
+        }
+
+    def create(self, key, params):
+        """Return (job, created): the active job for key, or a new queued one."""
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM image_jobs WHERE created_at < ?', (now - JOB_TTL,))
+            row = self._conn.execute(
+                f'SELECT {self._COLUMNS} FROM image_jobs WHERE key = ? AND status IN (?, ?) AND created_at > ? '
+                'ORDER BY created_at DESC LIMIT 1',
+                (key, *ACTIVE, now - JOB_TIMEOUT)
+            ).fetchone()
+            if row:
+                return self._row_to_job(row), False
+            job = _new_job(key, params, now)
+            self._conn.execute(
+                f'INSERT INTO image_jobs ({self._COLUMNS}) VALUES (?, ?, ?, ?, ?, NULL, NULL, ?)',
+                (job['id'], key, QUEUED, now, now, json.dumps(params))
+            )
+        return job, True
+
+    def claim(self):
+        """Mark the oldest queued job running and return it, or None."""
+        now = time.time()
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                f'SELECT {self._COLUMNS} FROM image_jobs WHERE status = ? AND created_at > ? '
+                'ORDER BY created_at LIMIT 1',
+                (QUEUED, now - JOB_TIMEOUT)
+            ).fetchone()
+            if not row:
+                return None
+            # Another worker process may have claimed it in between
+            claimed = self._conn.execute(
+                'UPDATE image_jobs SET status = ?, updated_at = ? WHERE id = ? AND status = ?',
+                (RUNNING, now, row[0], QUEUED)
+            ).rowcount
+        if not claimed:
+            return None
+        job = self._row_to_job(row)
+        job.update(status=RUNNING, updated_at=now)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            row = self._conn.execute(
+                f'SELECT {self._COLUMNS} FROM image_jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        return _expire(self._row_to_job(row), time.time()) if row else None
+
+    def update(self, job_id, status, result=None, error=None):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'UPDATE image_jobs SET status = ?, updated_at = ?, result = ?, error = ? WHERE id = ?',
+                (status, time.time(), json.dumps(result) if result is not None else None, error, job_id)
+            )
+
+    def heartbeat(self):
+        with self._lock, self._conn:
+            self._conn.execute('INSERT OR REPLACE INTO image_worker VALUES (1, ?)', (time.time(),))
+
+    def worker_alive(self):
+        with self._lock:
+            row = self._conn.execute('SELECT seen_at FROM image_worker WHERE id = 1').fetchone()
+        return bool(row) and time.time() - row[0] < HEARTBEAT_TTL
+
+
+class KVJobStore:
+    """Job records and the queue in Vercel KV / Upstash Redis via its REST API.
+
+    Keys:
+        image-job:{id}          JSON job record, expiring after JOB_TTL
+        image-job-key:{key}     id of the active job for a request key, expiring after JOB_TIMEOUT
+        image-jobs:queue        list of queued job ids, oldest at the right
+        image-worker:heartbeat  set by the worker, expiring after HEARTBEAT_TTL
+    """
+
+    def __init__(self, url, token):
+        self.url = url.rstrip('/')
+        self._session = requests.Session()
+        self._session.headers['Authorization'] = f'Bearer {token}'
+
+    def _command(self, *args):
+        response = self._session.post(self.url, json=[str(a) for a in args], timeout=(3.05, 10))
+        response.raise_for_status()
+        return response.json().get('result')
+
+    def _save(self, job):
+        self._command('SET', f"image-job:{job['id']}", json.dumps(job), 'EX', JOB_TTL)
+
+    def create(self, key, params):
+        """Return (job, created): the active job for key, or a new queued one."""
+        job = _new_job(key, params, time.time())
+        claimed = self._command('SET', f'image-job-key:{key}', job['id'], 'NX', 'EX', JOB_TIMEOUT)
+        if not claimed:
+            existing = self.get(self._command('GET', f'image-job-key:{key}') or '')
+            if existing and existing['status'] in ACTIVE:
+                return existing, False
+            # The claim outlived its job; take it over
+            self._command('SET', f'image-job-key:{key}', job['id'], 'EX', JOB_TIMEOUT)
+        self._save(job)
+        self._command('LPUSH', 'image-jobs:queue', job['id'])
+        return job, True
+
+    def claim(self):
+        """Mark the oldest queued job running and return it, or None."""
+        while True:
+            job_id = self._command('RPOP', 'image-jobs:queue')
+            if not job_id:
+                return None
+            job = self.get(job_id)
+            if job and job['status'] == QUEUED:
+                job.update(status=RUNNING, updated_at=time.time())
+                self._save(job)
+                return job
+
+    def get(self, job_id):
+        raw = self._command('GET', f'image-job:{job_id}') if job_id else None
+        return _expire(json.loads(raw), time.time()) if raw else None
+
+    def update(self, job_id, status, result=None, error=None):
+        job = self.get(job_id)
+        if job is None:
+            return
+        job.update(status=status, updated_at=time.time(), result=result, error=error)
+        self._save(job)
+        if status not in ACTIVE:
+            self._command('DEL', f"image-job-key:{job['key']}")
+
+    def heartbeat(self):
+        self._command('SET', 'image-worker:heartbeat', time.time(), 'EX', HEARTBEAT_TTL)
+
+    def worker_alive(self):
+        return bool(self._command('GET', 'image-worker:heartbeat'))
+
+
+_store = None
+_store_guard = threading.Lock()
+
+
+def get_job_store():
+    """The configured store for this process: KV when its env vars are set, else SQLite."""
+    global _store
+    with _store_guard:
+        if _store is None:
+            kv_url = os.environ.get('KV_REST_API_URL')
+            kv_token = os.environ.get('KV_REST_API_TOKEN')
+            if kv_url and kv_token:
+                _store = KVJobStore(kv_url, kv_token)
+            else:
+                _store = SQLiteJobStore(os.environ.get('IMAGE_JOB_DB', IMAGE_JOB_DB))
+        return _store
+
+
+def jobs_enabled():
+    """True when async jobs will actually run.
+
+    That needs a store every instance shares (KV, or an explicitly set
+    IMAGE_JOB_DB in local dev), a shared blob store for the reference image
+    and result, and a worker that checked in recently.
+    """
+    shared = (os.environ.get('KV_REST_API_URL') and os.environ.get('KV_REST_API_TOKEN')) \
+        or os.environ.get('IMAGE_JOB_DB')
+    if not shared or not blob_urls_enabled():
+        return False
+    try:
+        return get_job_store().worker_alive()
+    except (requests.RequestException, sqlite3.Error):
+        return False
+
+
+def start_job(key, params):
+    """Join the active job for key, or queue a new one for the worker.
+
+    params: JSON-serializable values the worker renders from.
+    Returns (job, created).
+    """
+    return get_job_store().create(key, params)
+
+
+def job_status(job):
+    """The polling payload for a job record."""
+    payload = {'success': job['status'] != FAILED, 'job_id': job['id'], 'status': job['status']}
+    if job['status'] == DONE:
+        payload.update(job['result'] or {})
+    elif job['status'] == FAILED:
+        payload['error'] = job['error']
+    return payload
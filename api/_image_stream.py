@@ -0,0 +1,204 @@
+"""
+Streaming extraction of base64 image fields from OpenAI image responses.
+
+The images endpoints return `{"data": [{"b64_json": "<several MB>"}]}`. Rather
+than reading the whole document, parsing it and decoding the string, the
+decoder here is fed the raw response bytes chunk by chunk and forwards the
+image to a sink as soon as each chunk arrives, so memory per image stays at
+roughly one chunk regardless of image size. The same decoder pulls uploaded
+data URLs out of incoming JSON request bodies (extract_b64_field).
+
+Files starting with an underscore are not deployed as endpoints by Vercel, so
+this module is shared by the api/ handlers and the execution/ scripts.
+"""
+import base64
+import re
+
+
+CHUNK_SIZE = 64 * 1024
+
+# Keep this many bytes of unmatched input while looking for the field, enough
+# to catch a key split across two chunks without buffering the whole document.
+_SEARCH_TAIL = 256
+
+
+class B64FieldDecoder:
+    """Incrementally pull one base64 string field out of a JSON byte stream.
+
+    sink: callable receiving bytes. With decode=True it gets decoded image
+        bytes; with decode=False it gets the base64 text unchanged, which is
+        useful for relaying a data URL without decoding and re-encoding.
+    field: JSON key to extract (first occurrence only).
+    value_prefix: optional marker inside the value to skip up to, e.g. b','
+        for data URLs ("data:image/png;base64,...").
+    """
+
+    def __init__(self, sink, field='b64_json', decode=True, value_prefix=None):
+        self.sink = sink
+        self.decode = decode
+        self.value_prefix = value_prefix
+        self.found = False
+        self.done = False
+        self.bytes_written = 0
+        self.rest = b''  # input after the value's closing quote, once done
+        self._pattern = re.compile(rb'"' + re.escape(field.encode()) + rb'"\s*:\s*"')
+        self._buffer = b''
+        self._carry = b''
+        self._escape = False
+        self._held = b''
+        self._in_prefix = False
+
+    def feed(self, chunk):
+        """Feed the next chunk of the response body."""
+        if self.done or not chunk:
+            return
+        if not self.found:
+            self._buffer += chunk
+            match = self._pattern.search(self._buffer)
+            if not match:
+                self._buffer = self._buffer[-_SEARCH_TAIL:]
+                return
+            self.found = True
+            self._in_prefix = self.value_prefix is not None
+            chunk = self._buffer[match.end():]
+            self._buffer = b''
+        self._consume(chunk)
+
+    def close(self):
+        """Flush any remaining buffered characters. Returns True if a value was found."""
+        if self._carry and not self.done:
+            self._emit_final()
+        return self.found
+
+    def _consume(self, chunk):
+        if self._in_prefix:
+            self._buffer += chunk
+            idx = self._buffer.find(self.value_prefix)
+            quote = self._buffer.find(b'"')
+            if quote != -1 and (idx == -1 or quote < idx):
+                # No prefix in this value, treat the whole string as base64
+                chunk, self._buffer = self._buffer, b''
+                self._in_prefix = False
+            elif idx == -1:
+                return
+            else:
+                chunk = self._buffer[idx + len(self.value_prefix):]
+                self._buffer = b''
+                self._in_prefix = False
+
+        chunk, self._held = self._held + chunk, b''
+        end = self._find_string_end(chunk)
+        if end != -1:
+            self.rest = chunk[end + 1:]
+            chunk = chunk[:end]
+        elif self._escape:
+            # Escape sequence split across chunks, finish it with the next one
+            chunk, self._held = chunk[:-1], chunk[-1:]
+            self._escape = False
+        chunk = self._unescape(chunk)
+        data = self._carry + chunk
+
+        if end != -1:
+            self._carry = data
+            self._emit_final()
+            return
+
+        # Only hand whole 4-character groups to the decoder
+        usable = len(data) - (len(data) % 4)
+        self._carry = data[usable:]
+        if usable:
+            self._write(data[:usable])
+
+    def _find_string_end(self, chunk):
+        """Index of the closing quote of the JSON string, honouring escapes."""
+        start = 0
+        if self._escape and chunk:
+            # First byte completes an escape begun in the previous chunk
+            start = 1
+        self._escape = False
+        pos = chunk.find(b'"', start)
+        while pos != -1:
+            slashes = len(chunk[start:pos]) - len(chunk[start:pos].rstrip(b'\\'))
+            if slashes % 2 == 0:
+                return pos
+            pos = chunk.find(b'"', pos + 1)
+        trailing = len(chunk) - len(chunk.rstrip(b'\\'))
+        self._escape = trailing % 2 == 1
+        return -1
+
+    @staticmethod
+    def _unescape(chunk):
+        # Base64 only ever needs "\/" unescaped; strip JSON line escapes too
+        if b'\\' not in chunk:
+            return chunk
+        return chunk.replace(b'\\/', b'/').replace(b'\\n', b'').replace(b'\\r', b'')
+
+    def _emit_final(self):
+        if self._carry:
+            self._write(self._carry)
+        self._carry = b''
+        self.done = True
+
+    def _write(self, data):
+        if self.decode:
+            data = base64.b64decode(data)
+        self.sink(data)
+        self.bytes_written += len(data)
+
+
+def stream_b64_field(chunks, sink, field='b64_json', decode=True, value_prefix=None):
+    """Run an iterable of byte chunks through a B64FieldDecoder.
+
+    Returns the number of bytes handed to the sink, or 0 if the field was
+    not present in the stream.
+    """
+    decoder = B64FieldDecoder(sink, field=field, decode=decode, value_prefix=value_prefix)
+    for chunk in chunks:
+        decoder.feed(chunk)
+        if decoder.done:
+            break
+    if not decoder.close():
+        return 0
+    return decoder.bytes_written
+
+
+def extract_b64_field(chunks, sink, field, decode=True, value_prefix=None):
+    """Stream one base64 field of a JSON document into sink, keeping the rest.
+
+    For request bodies that carry an upload next to a few small fields: the
+    upload goes to the sink chunk by chunk and everything else is returned.
+    Returns (document, bytes_written), document being the JSON bytes with
+    the field's value emptied, ready for json.loads().
+    """
+    decoder = B64FieldDecoder(sink, field=field, decode=decode, value_prefix=value_prefix)
+    head, rest = [], []
+    for chunk in chunks:
+        if decoder.done:
+            rest.append(chunk)
+            continue
+        if not decoder.found:
+            head.append(chunk)
+        decoder.feed(chunk)
+        if decoder.done:
+            rest.append(decoder.rest)
+    decoder.close()
+
+    head = b''.join(head)
+    if not decoder.found:
+        return head, 0
+    match = decoder._pattern.search(head)
+    return head[:match.end()] + b'"' + b''.join(rest), decoder.bytes_written
+
+
+def iter_chunks(fileobj, chunk_size=CHUNK_SIZE, limit=None):
+    """Yield fixed-size chunks from a file-like object (e.g. an urllib response).
+
+    limit: stop after this many bytes, e.g. a request's Content-Length.
+    """
+    while limit is None or limit > 0:
+        chunk = fileobj.read(chunk_size if limit is None else min(chunk_size, limit))
+        if not chunk:
+            return
+        if limit is not None:
+            limit -= len(chunk)
+        yield chunk
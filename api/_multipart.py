@@ -0,0 +1,63 @@
+"""
+Streaming multipart/form-data encoder for upload requests.
+
+The body is produced part by part as the connection sends it: field
+headers are a few bytes each and file contents are read from their file
+objects a chunk at a time, so an upload never sits in memory as one
+buffer. Each encoder gets a random boundary, so it cannot collide with
+anything inside the uploaded bytes.
+"""
+import secrets
+
+from _image_stream import CHUNK_SIZE, iter_chunks
+
+
+class MultipartEncoder:
+    """An iterable multipart/form-data body with a known length.
+
+    fields: dict of {name: value} for text fields
+    files: list of (field_name, filename, content, content_type), content
+        being bytes or a seekable binary file object (sent from its start)
+
+    Pass the encoder itself as the request body, with content_type and
+    content_length as the Content-Type and Content-Length headers.
+    """
+
+    def __init__(self, fields, files, chunk_size=CHUNK_SIZE):
+        self.boundary = secrets.token_hex(16)
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        self.chunk_size = chunk_size
+        self._parts = []
+
+        for key, value in fields.items():
+            header = f'--{self.boundary}\r\nContent-Disposition: form-data; name="{key}"\r\n\r\n'
+            self._parts.append((header + f'{value}\r\n').encode())
+
+        for field_name, filename, content, content_type in files:
+            self._parts.append((
+                f'--{self.boundary}\r\n'
+                f'Content-Disposition: form-data; name="{field_name}"; filename="{filename}"\r\n'
+                f'Content-Type: {content_type}\r\n\r\n'
+            ).encode())
+            self._parts.append(content)
+            self._parts.append(b'\r\n')
+
+        self._parts.append(f'--{self.boundary}--\r\n'.encode())
+
+    @property
+    def content_length(self):
+        total = 0
+        for part in self._parts:
+            if isinstance(part, bytes):
+                total += len(part)
+            else:
+                total += part.seek(0, 2)
+        return total
+
+    def __iter__(self):
+        for part in self._parts:
+            if isinstance(part, bytes):
+                yield part
+            else:
+                part.seek(0)
+                yield from iter_chunks(part, self.chunk_size)
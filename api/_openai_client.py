@@ -0,0 +1,60 @@
+"""
+Shared OpenAI API client for the api/ handlers.
+
+Like _x_client.py, one pooled keep-alive requests.Session is created per warm
+instance, so concurrent and repeated completions reuse open TLS connections
+instead of handshaking per call. Every call gets connect/read timeouts.
+
+Set OPENAI_BASE_URL to point the handlers at a local stand-in server
+(execution/fake_openai_server.py). It is read on every call.
+"""
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+OPENAI_BASE_URL = 'https://api.openai.com/v1'
+
+# Seconds. Connect slightly above a multiple of 3 (the TCP retransmit window)
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 30
+
+# Enough for a 5-way fan-out from a couple of concurrent requests
+POOL_SIZE = 16
+
+TIMEOUT_ERRORS = (requests.exceptions.Timeout,)
+CONNECTION_ERRORS = (requests.exceptions.ConnectionError,)
+
+
+class OpenAIClient:
+    """Thin wrapper around a pooled session with OpenAI API defaults."""
+
+    def __init__(self):
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE)
+        self._session.mount('https://', adapter)
+        self._session.mount('http://', adapter)
+
+    def url(self, path):
+        """OpenAI API URL, honouring OPENAI_BASE_URL."""
+        base = os.environ.get('OPENAI_BASE_URL', OPENAI_BASE_URL).rstrip('/')
+        return f'{base}{path}'
+
+    def post(self, path, api_key, timeout=None, **kwargs):
+        headers = {'Authorization': f'Bearer {api_key}', **kwargs.pop('headers', {})}
+        return self._session.post(
+            self.url(path),
+            headers=headers,
+            timeout=timeout or (CONNECT_TIMEOUT, READ_TIMEOUT),
+            **kwargs
+        )
+
+
+def error_message(response):
+    """Readable error from a failed OpenAI response."""
+    return f'OpenAI API error: {response.text}'
+
+
+# Created once per warm instance, shared by every handler in it
+openai_api = OpenAIClient()
@@ -0,0 +1,134 @@
+"""
+System prompts for /api/generate.
+
+Every platform x tone x type x variation count combination is rendered once
+per warm instance (memoized on first use) into a ready-to-send system
+message, instead of rebuilding the rule tables and re-formatting the prompt
+on every request. Unknown platforms, tones and types fall back to the
+defaults, so the memo stays bounded.
+
+The rules every prompt shares come first and the per-request parts last,
+so prompts share the longest possible static prefix for the provider's
+prompt-prefix caching; cache_key groups requests with the same prefix.
+
+Bump PROMPT_VERSION whenever the wording changes. It is part of every
+cache_key and of the generation cache key (see generate.py), so cached
+completions of an old prompt are not served for a new one.
+"""
+from functools import lru_cache
+
+
+PROMPT_VERSION = '2'
+
+MAX_VARIATIONS = 5
+
+VARIATION_DELIMITER = '---VARIATION---'
+
+PLATFORM_RULES = {
+    'twitter': 'Keep posts under 280 characters. Make it punchy and engaging. Use line breaks for readability.',
+    'instagram': 'Can be longer. Use relevant hashtags. Include a call-to-action.',
+    'linkedin': 'Professional tone. Can be longer form. End with a question or call-to-action.',
+    'tiktok': 'Casual, trendy language. Short and catchy. Use popular phrases.',
+    'facebook': 'Conversational tone. Medium length. Encourage interaction.'
+}
+
+TONE_DESC = {
+    'professional': 'Professional, credible, and authoritative.',
+    'casual': 'Friendly, approachable, and conversational.',
+    'witty': 'Clever, sharp, and humorous without trying too hard.',
+    'inspirational': 'Motivating, uplifting, and genuine.',
+    'inspiring': 'Motivating, uplifting, and genuine.',
+    'educational': 'Informative, helpful, and clear.',
+    'humorous': 'Funny, entertaining, and relatable.'
+}
+
+TYPE_RULES = {
+    'post': 'Create a single, standalone post.',
+    'thread': 'Create a thread of 3-5 connected posts. Number each (1/, 2/, etc). Make the first tweet a strong hook.',
+    'reply': 'Create a concise, relevant reply that adds value.'
+}
+
+# Fan-out mode: one completion per variation, each nudged towards its own angle
+FANOUT_ANGLES = [
+    'a personal observation or short story',
+    'a bold, slightly contrarian take',
+    'a practical tip or hard-earned lesson',
+    'a question that invites replies',
+    'a short, punchy one-liner',
+]
+
+# Shared by every prompt, so it leads
+STATIC_PREFIX = """You are an expert social media content creator who writes viral, authentic content.
+
+Important rules:
+- Write authentically. No cringe corporate-speak or overused phrases.
+- Don't use excessive emojis. 1-2 max per post if any.
+- No hashtags on X/Twitter unless specifically asked.
+- Make content that people actually want to engage with.
+- Return ONLY the content text, no explanations or meta-commentary."""
+
+
+class SystemPrompt:
+    """A rendered system prompt, ready to lead a chat completion's messages."""
+
+    def __init__(self, text, cache_key):
+        self.text = text
+        self.cache_key = cache_key
+        self.message = {'role': 'system', 'content': text}
+
+    def messages(self, user_prompt):
+        return [self.message, {'role': 'user', 'content': user_prompt}]
+
+
+def normalize(platform, tone, content_type, variations=1):
+    """Map request values onto the known rule keys and a 1-MAX_VARIATIONS count."""
+    platform = platform if platform in PLATFORM_RULES else 'twitter'
+    tone = tone if tone in TONE_DESC else 'professional'
+    content_type = content_type if content_type in TYPE_RULES else 'post'
+    variations = max(1, min(int(variations), MAX_VARIATIONS))
+    return platform, tone, content_type, variations
+
+
+def _render(platform, tone, content_type, variations, angle=None):
+    variation_rule = ''
+    if variations > 1:
+        variation_rule = f"""
+
+Generate exactly {variations} different variations of the content. Separate each variation with the delimiter "{VARIATION_DELIMITER}".
+Each variation should take a different angle or approach while matching the same tone and platform requirements.
+Do NOT number the variations or add labels like "Variation 1:" - just provide the content separated by the delimiter."""
+
+    angle_rule = f"\n\nAngle for this one: {angle}." if angle else ''
+
+    return f"""{STATIC_PREFIX}
+
+Platform: {platform.upper()}
+{PLATFORM_RULES[platform]}
+
+Tone: {tone}
+{TONE_DESC[tone]}
+
+Type: {content_type}
+{TYPE_RULES[content_type]}{variation_rule}{angle_rule}"""
+
+
+@lru_cache(maxsize=None)
+def _compiled(platform, tone, content_type, variations, angle_index):
+    angle = FANOUT_ANGLES[angle_index] if angle_index is not None else None
+    text = _render(platform, tone, content_type, variations, angle)
+    cache_key = f'generate-v{PROMPT_VERSION}-{platform}-{tone}-{content_type}'
+    return SystemPrompt(text, cache_key)
+
+
+def system_prompt(platform, tone, content_type, variations=1):
+    """The memoized SystemPrompt for one request's parameters."""
+    return _compiled(*normalize(platform, tone, content_type, variations), None)
+
+
+def fanout_prompts(platform, tone, content_type, variations):
+    """One single-variation SystemPrompt per fan-out call, each with its own angle."""
+    platform, tone, content_type, variations = normalize(platform, tone, content_type, variations)
+    return [
+        _compiled(platform, tone, content_type, 1, i % len(FANOUT_ANGLES))
+        for i in range(variations)
+    ]
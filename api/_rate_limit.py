@@ -0,0 +1,243 @@
+"""
+X API rate-limit budget tracker shared by every handler in a warm instance.
+
+Every X API response carries x-rate-limit-limit / -remaining / -reset headers
+for its endpoint family (e.g. "GET /2/users/:id/tweets") and user. _x_client
+records them here after each call and consults them before the next one:
+
+- budget left: the call goes ahead, after reserving a slot (remaining is
+  decremented right away, so concurrent calls can't all take the last one;
+  the response's headers then replace the estimate),
+- budget exhausted and the window resets within MAX_DELAY seconds: the call
+  waits for the reset instead of burning a request on a 429,
+- budget exhausted for longer: RateLimited is raised immediately so the
+  handler can serve cached/stored data or a 429 with Retry-After.
+
+Budgets belong to the X user (X counts them per user, not per token), so a
+refreshed access token keeps its user's remaining budget: _session binds each
+token to its user id (bind_caller) and caller_key looks it up. Tokens whose
+user isn't known yet fall back to a hash of the token.
+
+Budgets are kept in memory and, if RATE_LIMIT_DB is set to a file path, in
+SQLite so separate local processes (vercel dev, execution/ scripts) share them.
+"""
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+from collections import OrderedDict
+
+
+# Longest a call is held back waiting for its window to reset (seconds)
+MAX_DELAY = float(os.environ.get('RATE_LIMIT_MAX_DELAY', 3))
+
+_ID_SEGMENT = re.compile(r'/\d+(?=/|$)')
+
+# Token hashes remembered by bind_caller (least recently bound dropped first)
+CALLER_CACHE_SIZE = 1024
+
+
+class RateLimited(Exception):
+    """The endpoint's budget is exhausted. retry_after is in seconds."""
+
+    def __init__(self, family, retry_after):
+        super().__init__(f'Rate limit reached for {family}, retry in {int(retry_after)}s')
+        self.family = family
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+def endpoint_family(method, path):
+    """Normalise a call to its rate-limit family, e.g. 'GET /2/users/:id/tweets'."""
+    path = path.split('?', 1)[0]
+    if '://' in path:
+        path = '/' + path.split('://', 1)[1].split('/', 1)[-1]
+    version, _, rest = path.lstrip('/').partition('/')
+    return f'{method.upper()} /{version}' + _ID_SEGMENT.sub('/:id', '/' + rest if rest else '')
+
+
+# Hash of the Authorization header -> X user id it belongs to
+_token_users = OrderedDict()
+_token_users_lock = threading.Lock()
+
+
+def _token_digest(authorization):
+    return hashlib.sha256(authorization.encode()).hexdigest()[:32]
+
+
+def bind_caller(access_token, user_id):
+    """Record that access_token belongs to user_id, so its calls share that user's budget."""
+    digest = _token_digest(f'Bearer {access_token}')
+    with _token_users_lock:
+        _token_users[digest] = user_id
+        _token_users.move_to_end(digest)
+        while len(_token_users) > CALLER_CACHE_SIZE:
+            _token_users.popitem(last=False)
+
+
+def caller_key(headers):
+    """Budget owner for a call: the token's X user id, else a hash of the token, or 'app' without one."""
+    authorization = (headers or {}).get('Authorization', '')
+    if not authorization:
+        return 'app'
+    digest = _token_digest(authorization)
+    with _token_users_lock:
+        user_id = _token_users.get(digest)
+    return f'uid:{user_id}' if user_id else digest
+
+
+class RateLimitTracker:
+    """Remaining budget per (caller, endpoint family)."""
+
+    def __init__(self, db_path=None):
+        self._budgets = {}
+        self._in_flight = {}  # (caller, family) -> calls reserved and not yet answered
+        self._lock = threading.Lock()
+        self._conn = None
+        if db_path:
+            try:
+                self._conn = sqlite3.connect(db_path, check_same_thread=False, timeout=5)
+                with self._conn:
+                    self._conn.execute(
+                        'CREATE TABLE IF NOT EXISTS rate_limits ('
+                        'caller TEXT, family TEXT, rate_limit INTEGER, remaining INTEGER, reset REAL, '
+                        'PRIMARY KEY (caller, family))'
+                    )
+            except sqlite3.Error:
+                self._conn = None
+
+    def get(self, caller, family):
+        """Return (limit, remaining, reset_epoch) or None if nothing is known."""
+        with self._lock:
+            return self._read(caller, family)
+
+    def _read(self, caller, family):
+        if self._conn is not None:
+            try:
+                row = self._conn.execute(
+                    'SELECT rate_limit, remaining, reset FROM rate_limits WHERE caller = ? AND family = ?',
+                    (caller, family)
+                ).fetchone()
+                if row:
+                    return row
+            except sqlite3.Error:
+                pass
+        return self._budgets.get((caller, family))
+
+    def _adjust(self, caller, family, budget, delta):
+        """Move remaining by delta (call with the lock held). Returns False if it would go below 0."""
+        limit, remaining, reset = budget
+        if remaining + delta < 0:
+            return False
+        if self._conn is not None:
+            try:
+                with self._conn:
+                    # Conditional so processes sharing the file can't both take the last slot
+                    changed = self._conn.execute(
+                        'UPDATE rate_limits SET remaining = remaining + ? '
+                        'WHERE caller = ? AND family = ? AND remaining + ? >= 0',
+                        (delta, caller, family, delta)
+                    ).rowcount
+                    stored = changed or self._conn.execute(
+                        'SELECT 1 FROM rate_limits WHERE caller = ? AND family = ?', (caller, family)
+                    ).fetchone()
+                if stored and not changed:
+                    return False
+            except sqlite3.Error:
+                pass
+        self._budgets[(caller, family)] = (limit, remaining + delta, reset)
+        return True
+
+    def record(self, caller, family, response, reserved=False):
+        """Store the budget reported by a response's x-rate-limit-* headers.
+
+        reserved: acquire() took a slot for this call. The headers count this
+        call but not the others still in flight, whose slots stay reserved.
+        """
+        key = (caller, family)
+        if reserved:
+            with self._lock:
+                self._release_slot(key)
+        headers = response.headers
+        remaining = headers.get('x-rate-limit-remaining')
+        reset = headers.get('x-rate-limit-reset')
+        if response.status_code == 429 and remaining is None:
+            remaining = 0
+            retry_after = headers.get('retry-after')
+            reset = time.time() + float(retry_after) if retry_after else time.time() + 60
+        if remaining is None or reset is None:
+            return
+
+        try:
+            limit, remaining, reset = int(headers.get('x-rate-limit-limit') or 0), int(remaining), float(reset)
+        except ValueError:
+            return
+
+        with self._lock:
+            budget = (limit, max(0, remaining - self._in_flight.get(key, 0)), reset)
+            self._budgets[key] = budget
+            if len(self._budgets) > 5000:
+                now = time.time()
+                for old_key, (_, _, old_reset) in list(self._budgets.items()):
+                    if old_reset < now:
+                        del self._budgets[old_key]
+            if self._conn is not None:
+                try:
+                    with self._conn:
+                        self._conn.execute(
+                            'INSERT OR REPLACE INTO rate_limits VALUES (?, ?, ?, ?, ?)',
+                            (caller, family) + budget
+                        )
+                except sqlite3.Error:
+                    pass
+
+    def acquire(self, caller, family):
+        """Reserve a slot for a call, or wait for or refuse one whose budget is exhausted.
+
+        Returns True if a slot was reserved; pass that on to record(), or to
+        release() if the call fails without a response. Raises RateLimited.
+        """
+        with self._lock:
+            budget = self._read(caller, family)
+            if not budget or budget[2] <= time.time():
+                # Unknown, or the window has reset: nothing to reserve against
+                return False
+            if self._adjust(caller, family, budget, -1):
+                key = (caller, family)
+                self._in_flight[key] = self._in_flight.get(key, 0) + 1
+                return True
+
+        wait = budget[2] - time.time()
+        if wait > MAX_DELAY:
+            raise RateLimited(family, wait)
+        time.sleep(max(0, wait))
+        return False
+
+    def release(self, caller, family, reserved):
+        """Give back the slot of a reserved call that got no response."""
+        if not reserved:
+            return
+        with self._lock:
+            self._release_slot((caller, family))
+            budget = self._read(caller, family)
+            if budget:
+                self._adjust(caller, family, budget, 1)
+
+    def _release_slot(self, key):
+        in_flight = self._in_flight.get(key, 0) - 1
+        if in_flight > 0:
+            self._in_flight[key] = in_flight
+        else:
+            self._in_flight.pop(key, None)
+
+    def remaining(self, caller, family):
+        """Calls left in the current window, or None if unknown/reset."""
+        budget = self.get(caller, family)
+        if not budget or budget[2] <= time.time():
+            return None
+        return budget[1]
+
+
+# Created once per warm instance, shared by every handler in it
+rate_limits = RateLimitTracker(os.environ.get('RATE_LIMIT_DB'))
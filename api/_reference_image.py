@@ -0,0 +1,158 @@
+"""
+Reference image preparation for /api/image.
+
+A PNG that already fits the requested output size and is at most
+MAX_PASSTHROUGH_BYTES is streamed to /images/edits as uploaded; only its
+header is read. Anything else is validated, downscaled to fit and re-encoded
+as a compact PNG (the original is still sent if that comes out larger).
+Prepared bytes are cached per warm instance by content hash and size, within
+REFERENCE_CACHE_BYTES in total and MAX_CACHED_BYTES per image, so repeated
+generations from the same upload skip the decode/resize/encode work.
+"""
+import io
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+from PIL import Image, UnidentifiedImageError
+
+from _image_stream import iter_chunks
+
+
+# Formats a browser upload is likely to be in; all are converted to PNG
+ACCEPTED_FORMATS = {'PNG', 'JPEG', 'WEBP', 'GIF'}
+
+# Refuse anything larger before decoding it (about 8K x 5K)
+MAX_REFERENCE_PIXELS = 40_000_000
+
+# PNGs up to this size that already fit are sent without re-encoding
+MAX_PASSTHROUGH_BYTES = 4 * 1024 * 1024
+
+REFERENCE_CACHE_BYTES = int(os.environ.get('REFERENCE_CACHE_BYTES', 32 * 1024 * 1024))
+# Larger prepared images aren't cached, so a few can't take the whole cache
+MAX_CACHED_BYTES = REFERENCE_CACHE_BYTES // 8
+
+
+class ReferenceImageError(ValueError):
+    """The uploaded reference image can't be used."""
+
+
+class PreparedImageCache:
+    """LRU of prepared PNG bytes, bounded by their total and per-entry size."""
+
+    def __init__(self, max_bytes=REFERENCE_CACHE_BYTES, max_entry_bytes=MAX_CACHED_BYTES):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if len(value) > self.max_entry_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= len(self._entries.pop(key))
+            self._entries[key] = value
+            self.total_bytes += len(value)
+            while self.total_bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.total_bytes -= len(evicted)
+
+
+# Created once per warm instance
+prepared_cache = PreparedImageCache()
+
+
+def _as_file(image):
+    source = io.BytesIO(image) if isinstance(image, bytes) else image
+    source.seek(0)
+    return source
+
+
+def content_hash(image):
+    """SHA-256 of image bytes or a binary file object, read a chunk at a time."""
+    digest = hashlib.sha256()
+    for chunk in iter_chunks(_as_file(image)):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _fits_as_is(image, size):
+    """True for a PNG within the output size and MAX_PASSTHROUGH_BYTES (reads only the header)."""
+    target = tuple(int(v) for v in size.split('x'))
+    source = _as_file(image)
+    if source.seek(0, 2) > MAX_PASSTHROUGH_BYTES:
+        return False
+    source.seek(0)
+    try:
+        with Image.open(source) as img:
+            return img.format == 'PNG' and img.width <= target[0] and img.height <= target[1]
+    except (UnidentifiedImageError, Image.DecompressionBombError):
+        return False  # _prepare() reports it
+
+
+def _prepare(image, size):
+    target = tuple(int(v) for v in size.split('x'))
+    source = _as_file(image)
+    try:
+        img = Image.open(source)
+    except (UnidentifiedImageError, Image.DecompressionBombError):
+        raise ReferenceImageError('Reference image must be a PNG, JPEG, WebP or GIF image')
+
+    with img:
+        original_format, original_size = img.format, img.size
+        if original_format not in ACCEPTED_FORMATS:
+            raise ReferenceImageError('Reference image must be a PNG, JPEG, WebP or GIF image')
+        if img.width * img.height > MAX_REFERENCE_PIXELS:
+            raise ReferenceImageError('Reference image is too large')
+
+        # JPEGs can be decoded straight at a reduced scale
+        img.draft('RGB', target)
+        try:
+            img.load()
+        except OSError:
+            raise ReferenceImageError('Reference image is truncated or corrupt')
+
+        if img.mode not in ('RGB', 'RGBA'):
+            has_alpha = 'A' in img.mode or 'transparency' in img.info
+            img = img.convert('RGBA' if has_alpha else 'RGB')
+        img.thumbnail(target, Image.Resampling.LANCZOS)
+
+        out = io.BytesIO()
+        img.save(out, format='PNG', optimize=True)
+        prepared = out.getvalue()
+
+    fits = original_size[0] <= target[0] and original_size[1] <= target[1]
+    if original_format == 'PNG' and fits and source.seek(0, 2) <= len(prepared):
+        source.seek(0)
+        return source.read()
+    return prepared
+
+
+def prepare_reference(image, size):
+    """The PNG to upload for a reference image at an /images/edits size.
+
+    image: bytes or a seekable binary file object
+    size: 'WIDTHxHEIGHT', e.g. '1536x1024'
+    Returns image itself (rewound) when it can be sent as-is, else PNG bytes.
+    Raises ReferenceImageError if the image is unreadable, in an unsupported
+    format or unreasonably large.
+    """
+    if _fits_as_is(image, size):
+        return _as_file(image) if not isinstance(image, bytes) else image
+
+    key = (content_hash(image), size)
+    prepared = prepared_cache.get(key)
+    if prepared is None:
+        prepared = _prepare(image, size)
+        prepared_cache.set(key, prepared)
+    return prepared
@@ -0,0 +1,148 @@
+"""
+Reply bot logic shared by api/reply-bot.py and execution/reply_worker.py.
+
+- DEFAULT_SETTINGS and how reply_speed / max_replies_per_post are read,
+- fetch_replies(): pages through conversation_id search results, optionally
+  only those newer than a since_id watermark,
+- pick_reply() / post_reply(): choose a GM template and send it.
+"""
+import random
+
+from _x_client import x_api
+
+
+# Default bot settings
+DEFAULT_SETTINGS = {
+    'enabled': False,
+    'gm_enabled': True,
+    'gm_templates': [
+        'GM {NAME}',
+        'Morning {NAME}',
+        'Gmgm {NAME}',
+        'GM',
+        'Gm'
+    ],
+    'verified_only': True,
+    'reply_speed': '1min',
+    'max_replies_per_post': 10,
+    'enabled_post_ids': [],
+    'stats': {
+        'bot_replies_sent': 0
+    }
+}
+
+# Seconds between two replies sent by the bot; 'random' picks from the range each time
+REPLY_SPEED_DELAYS = {
+    'instant': (0, 0),
+    '1min': (60, 60),
+    '5min': (300, 300),
+    'random': (60, 600),
+}
+
+# search/recent accepts 10-100 results per page
+SEARCH_PAGE_SIZE = 100
+
+REPLY_TWEET_FIELDS = 'author_id,created_at,text,public_metrics,in_reply_to_user_id,conversation_id'
+REPLY_USER_FIELDS = 'name,username,verified,profile_image_url'
+
+
+def reply_delay(settings, rng=random):
+    """Seconds to wait between replies for the configured reply_speed."""
+    low, high = REPLY_SPEED_DELAYS.get(settings.get('reply_speed'), REPLY_SPEED_DELAYS['1min'])
+    return low if low == high else rng.uniform(low, high)
+
+
+def max_replies(settings):
+    """max_replies_per_post as an int, or None for 'unlimited'."""
+    value = settings.get('max_replies_per_post', DEFAULT_SETTINGS['max_replies_per_post'])
+    if value in (None, '', 'unlimited'):
+        return None
+    return int(value)
+
+
+class SearchError(Exception):
+    """The search endpoint returned an error. Carries the status and X API payload."""
+
+    def __init__(self, status_code, payload):
+        super().__init__(f'X API returned status {status_code}')
+        self.status_code = status_code
+        self.payload = payload
+
+
+def fetch_replies(auth_headers, tweet_id, since_id=None, max_pages=10, page_size=SEARCH_PAGE_SIZE):
+    """Fetch replies in a post's conversation, newest first.
+
+    Follows next_token for up to max_pages pages. With since_id, only replies
+    newer than it are returned, so repeated polls only cost new results.
+
+    Returns (replies, newest_id). Raises SearchError on an X API error.
+    """
+    params = {
+        'query': f'conversation_id:{tweet_id} is:reply',
+        'max_results': page_size,
+        'tweet.fields': REPLY_TWEET_FIELDS,
+        'expansions': 'author_id',
+        'user.fields': REPLY_USER_FIELDS,
+    }
+    if since_id:
+        params['since_id'] = since_id
+
+    replies = []
+    newest_id = since_id
+    for _ in range(max_pages):
+        response = x_api.get("/2/tweets/search/recent", headers=auth_headers, params=params)
+        if response.status_code != 200:
+            try:
+                payload = response.json()
+            except Exception:
+                payload = {}
+            raise SearchError(response.status_code, payload)
+
+        data = response.json()
+        users = {u['id']: u for u in data.get('includes', {}).get('users', [])}
+        for tweet in data.get('data', []):
+            author = users.get(tweet.get('author_id'), {})
+            replies.append({
+                'id': tweet.get('id'),
+                'text': tweet.get('text'),
+                'created_at': tweet.get('created_at'),
+                'author': {
+                    'id': tweet.get('author_id'),
+                    'name': author.get('name', 'Unknown'),
+                    'username': author.get('username', ''),
+                    'verified': author.get('verified', False),
+                    'profile_image_url': author.get('profile_image_url', '')
+                },
+                'metrics': tweet.get('public_metrics', {})
+            })
+
+        meta = data.get('meta', {})
+        if meta.get('newest_id') and (not newest_id or int(meta['newest_id']) > int(newest_id)):
+            newest_id = meta['newest_id']
+        if not meta.get('next_token'):
+            break
+        params['next_token'] = meta['next_token']
+
+    return replies, newest_id
+
+
+def pick_reply(settings, author_name, rng=random):
+    """Pick a GM template and fill in {NAME}, or None if GM replies are off."""
+    templates = [t for t in settings.get('gm_templates') or [] if t]
+    if not settings.get('gm_enabled') or not templates:
+        return None
+    return rng.choice(templates).replace('{NAME}', author_name or '').strip()
+
+
+def post_reply(auth_headers, tweet_id, reply_text):
+    """Reply to tweet_id. Returns the X API response."""
+    return x_api.post(
+        '/2/tweets',
+        headers={**auth_headers, 'Content-Type': 'application/json'},
+        json={
+            'text': reply_text,
+            'reply': {
+                'in_reply_to_tweet_id': str(tweet_id)
+            }
+        }
+    )
@@ -0,0 +1,211 @@
+"""
+Per-user response cache for the read-only X API handlers (profile, tweets).
+
+Dashboard pages all load /api/profile and /api/tweets, so without a cache every
+navigation costs fresh X API calls and rate-limit budget. Entries are kept in
+memory per warm instance and, if RESPONSE_CACHE_DB is set to a file path, in
+SQLite so they survive cold starts on the same host (e.g. /tmp on Vercel or a
+local dev server).
+
+Each entry is:
+- fresh for `ttl` seconds: served without touching the X API,
+- stale for a further `stale_ttl` seconds: served immediately while one
+  background thread refetches it (stale-while-revalidate),
+- expired after that.
+
+Keys are per user. Callers build them with user_key(session) so one user can
+never be served another user's data.
+
+Env:
+    RESPONSE_CACHE_DB         optional SQLite path for a persistent second tier
+    RESPONSE_CACHE_TTL        default fresh seconds (handlers may set their own)
+    RESPONSE_CACHE_STALE_TTL  default stale-while-revalidate seconds
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+
+DEFAULT_TTL = int(os.environ.get('RESPONSE_CACHE_TTL', 120))
+DEFAULT_STALE_TTL = int(os.environ.get('RESPONSE_CACHE_STALE_TTL', 600))
+
+MAX_ENTRIES = 500
+
+FRESH = 'fresh'
+STALE = 'stale'
+
+
+def user_key(session):
+    """Cache key component for the signed-in user (never the spoofable x_user cookie)."""
+    if session.user_id:
+        return f'uid:{session.user_id}'
+    return 'tok:' + hashlib.sha256(session.access_token.encode()).hexdigest()
+
+
+def etag_for(body):
+    return '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+
+
+def etag_matches(headers, etag):
+    """True if the request's If-None-Match covers etag."""
+    if_none_match = headers.get('If-None-Match', '') if headers else ''
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    candidates = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return etag in candidates
+
+
+def wants_fresh(headers, params=None):
+    """True if the client asked to bypass the cache (?refresh=1 or Cache-Control: no-cache)."""
+    if params and params.get('refresh', ['0'])[0] not in ('0', 'false', ''):
+        return True
+    cache_control = headers.get('Cache-Control', '') if headers else ''
+    return 'no-cache' in cache_control or 'no-store' in cache_control
+
+
+class _SQLiteTier:
+    """Optional persistent tier, one table of JSON values."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS response_cache ('
+                'key TEXT PRIMARY KEY, value TEXT NOT NULL, stored_at REAL NOT NULL)'
+            )
+
+    def get(self, key):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, stored_at FROM response_cache WHERE key = ?', (key,)
+            ).fetchone()
+        if not row:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, stored_at):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO response_cache (key, value, stored_at) VALUES (?, ?, ?)',
+                (key, json.dumps(value), stored_at)
+            )
+
+
+_sqlite_tiers = {}
+_sqlite_guard = threading.Lock()
+
+
+def _sqlite_tier():
+    path = os.environ.get('RESPONSE_CACHE_DB')
+    if not path:
+        return None
+    with _sqlite_guard:
+        if path not in _sqlite_tiers:
+            try:
+                _sqlite_tiers[path] = _SQLiteTier(path)
+            except sqlite3.Error:
+                _sqlite_tiers[path] = None
+        return _sqlite_tiers[path]
+
+
+class ResponseCache:
+    """TTL cache of JSON-serialisable values with stale-while-revalidate."""
+
+    def __init__(self, namespace, ttl=DEFAULT_TTL, stale_ttl=DEFAULT_STALE_TTL):
+        self.namespace = namespace
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._revalidating = set()
+
+    def _full_key(self, key):
+        return f'{self.namespace}:{key}'
+
+    def get(self, key):
+        """Return (value, state) with state FRESH or STALE, or (None, None) on a miss."""
+        full_key = self._full_key(key)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(full_key)
+
+        if entry is None:
+            tier = _sqlite_tier()
+            if tier is not None:
+                try:
+                    entry = tier.get(full_key)
+                except sqlite3.Error:
+                    entry = None
+                if entry is not None:
+                    with self._lock:
+                        self._entries[full_key] = entry
+
+        if entry is None:
+            return None, None
+
+        value, stored_at = entry
+        age = now - stored_at
+        if age < self.ttl:
+            return value, FRESH
+        if age < self.ttl + self.stale_ttl:
+            return value, STALE
+        return None, None
+
+    def set(self, key, value):
+        full_key = self._full_key(key)
+        now = time.time()
+        with self._lock:
+            self._entries[full_key] = (value, now)
+            if len(self._entries) > MAX_ENTRIES:
+                cutoff = now - self.ttl - self.stale_ttl
+                for old_key, (_, stored_at) in list(self._entries.items()):
+                    if stored_at < cutoff:
+                        del self._entries[old_key]
+                if len(self._entries) > MAX_ENTRIES:
+                    oldest = min(self._entries, key=lambda k: self._entries[k][1])
+                    del self._entries[oldest]
+
+        tier = _sqlite_tier()
+        if tier is not None:
+            try:
+                tier.set(full_key, value, now)
+            except sqlite3.Error:
+                pass
+
+    def revalidate(self, key, fetch):
+        """Refetch key on a background thread (at most one per key at a time).
+
+        fetch() returns the new value, or None to keep the stale one. On
+        serverless hosts the thread may be frozen once the response is sent and
+        finish during the next invocation, which is still cheaper than making
+        the user wait.
+        """
+        full_key = self._full_key(key)
+        with self._lock:
+            if full_key in self._revalidating:
+                return
+            self._revalidating.add(full_key)
+
+        def run():
+            try:
+                value = fetch()
+                if value is not None:
+                    self.set(key, value)
+            except Exception:
+                pass  # Keep serving the stale entry, the next request retries
+            finally:
+                with self._lock:
+                    self._revalidating.discard(full_key)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def cache_control(self):
+        return f'private, max-age={self.ttl}, stale-while-revalidate={self.stale_ttl}'
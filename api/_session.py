@@ -0,0 +1,396 @@
+"""
+Shared auth/session helpers for the api/ handlers.
+
+Replaces the get_cookie/decrypt_token/refresh_access_token copies that used to
+live in every handler:
+
+- the Fernet cipher is built once per warm instance (per key),
+- cookies are parsed once per request,
+- decrypted tokens are cached by ciphertext in a small LRU, so the same
+  cookie is only decrypted once per instance,
+- require_user() resolves the access token, trusts it until shortly before
+  the expiry recorded at login, and refreshes it when needed,
+- refreshed tokens are written back as Set-Cookie headers (session.set_cookies)
+  and concurrent refreshes of the same refresh token share one X API call.
+"""
+import os
+import json
+import time
+import base64
+import hashlib
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+from http.cookies import SimpleCookie
+
+from cryptography.fernet import Fernet, InvalidToken
+
+from _x_client import x_api, RateLimited, bind_caller
+
+
+# Refresh this many seconds before the recorded expiry
+EXPIRY_MARGIN = 300
+
+# Tokens without expiry metadata (issued before it was recorded) are validated
+# against /2/users/me at most once per this many seconds per warm instance
+VALIDATION_TTL = 300
+
+DECRYPT_CACHE_SIZE = 256
+
+# X rotates refresh tokens, so a refresh token can only be exchanged once.
+# Requests that were already in flight with the old one reuse the result for
+# this many seconds instead of failing.
+REFRESH_REUSE_WINDOW = 60
+
+
+@lru_cache(maxsize=4)
+def _cipher(key):
+    return Fernet(key.encode() if isinstance(key, str) else key)
+
+
+def encryption_key():
+    return os.environ.get('ENCRYPTION_KEY')
+
+
+def parse_cookies(headers):
+    """Parse the Cookie header once into a plain {name: value} dict."""
+    cookie_header = headers.get('Cookie', '') if headers else ''
+    if not cookie_header:
+        return {}
+    cookie = SimpleCookie()
+    cookie.load(cookie_header)
+    return {name: morsel.value for name, morsel in cookie.items()}
+
+
+def encrypt_token(token, key=None):
+    """Encrypt a value for cookie storage (base64 only when no key is configured, dev only)."""
+    key = key or encryption_key()
+    if not key:
+        return base64.b64encode(token.encode()).decode()
+    return _cipher(key).encrypt(token.encode()).decode()
+
+
+_decrypted = OrderedDict()
+_decrypted_lock = threading.Lock()
+
+
+def decrypt_token(encrypted_token, key=None):
+    """Decrypt a cookie value, or return None if it is invalid.
+
+    With a key configured only Fernet tokens are accepted; base64 is the dev
+    fallback used when no ENCRYPTION_KEY is set.
+    """
+    if not encrypted_token:
+        return None
+    key = key or encryption_key()
+    cache_key = (key, encrypted_token)
+    with _decrypted_lock:
+        if cache_key in _decrypted:
+            _decrypted.move_to_end(cache_key)
+            return _decrypted[cache_key]
+
+    try:
+        if key:
+            value = _cipher(key).decrypt(encrypted_token.encode()).decode()
+        else:
+            value = base64.b64decode(encrypted_token).decode()
+    except (InvalidToken, ValueError):
+        return None
+
+    with _decrypted_lock:
+        _decrypted[cache_key] = value
+        if len(_decrypted) > DECRYPT_CACHE_SIZE:
+            _decrypted.popitem(last=False)
+    return value
+
+
+# Refresh tokens are long-lived, keep their cookie (and the metadata) for 6 months
+REFRESH_COOKIE_MAX_AGE = 15552000
+
+
+def token_cookies(access_token, refresh_token, expires_in, user_id=''):
+    """Set-Cookie values storing freshly issued tokens plus their expiry metadata.
+
+    The metadata is only stored with a user id. Without one, any old metadata
+    cookie is cleared instead, and require_user() validates the token
+    against /2/users/me, which records the id on the next refresh.
+    """
+    cookies = [
+        f'x_access_token={encrypt_token(access_token)}; HttpOnly; Secure; SameSite=Lax; Path=/; Max-Age={expires_in}'
+    ]
+    if refresh_token:
+        cookies.append(
+            f'x_refresh_token={encrypt_token(refresh_token)}; HttpOnly; Secure; SameSite=Lax; Path=/; Max-Age={REFRESH_COOKIE_MAX_AGE}'
+        )
+    if not user_id:
+        cookies.append('x_token_meta=; HttpOnly; Secure; SameSite=Lax; Path=/; Max-Age=0')
+        return cookies
+
+    issued_at = int(time.time())
+    token_meta = json.dumps({
+        'iat': issued_at,
+        'exp': issued_at + int(expires_in),
+        'uid': user_id,
+    })
+    cookies.append(
+        f'x_token_meta={encrypt_token(token_meta)}; HttpOnly; Secure; SameSite=Lax; Path=/; Max-Age={REFRESH_COOKIE_MAX_AGE}'
+    )
+    return cookies
+
+
+def refresh_access_token(refresh_token, client_id=None, client_secret=None):
+    """Refresh the access token using refresh token."""
+    client_id = client_id or os.environ.get('X_CLIENT_ID')
+    client_secret = client_secret or os.environ.get('X_CLIENT_SECRET')
+
+    token_data = {
+        'grant_type': 'refresh_token',
+        'refresh_token': refresh_token,
+        'client_id': client_id,
+    }
+
+    auth = None
+    if client_secret:
+        auth = (client_id, client_secret)
+
+    response = x_api.post(
+        "/2/oauth2/token",
+        data=token_data,
+        auth=auth,
+        headers={'Content-Type': 'application/x-www-form-urlencoded'}
+    )
+
+    if response.status_code == 200:
+        return response.json()
+    return None
+
+
+# sha256(refresh_token) -> lock while a refresh is in flight / (refreshed_at, new tokens)
+_refresh_locks = {}
+_refresh_results = {}
+_refresh_locks_guard = threading.Lock()
+
+
+def refresh_tokens_once(refresh_token):
+    """Refresh, coalescing concurrent and repeated refreshes of the same token.
+
+    The first caller hits the X API; callers waiting on the same refresh token
+    (or arriving within REFRESH_REUSE_WINDOW) get the same new tokens.
+    """
+    key = _token_hash(refresh_token)
+    with _refresh_locks_guard:
+        lock = _refresh_locks.setdefault(key, threading.Lock())
+
+    try:
+        with lock:
+            now = time.time()
+            with _refresh_locks_guard:
+                cached = _refresh_results.get(key)
+            if cached and now - cached[0] < REFRESH_REUSE_WINDOW:
+                return cached[1]
+
+            new_tokens = refresh_access_token(refresh_token)
+            if not new_tokens or not new_tokens.get('access_token'):
+                return None
+
+            with _refresh_locks_guard:
+                for old_key, (refreshed_at, _) in list(_refresh_results.items()):
+                    if now - refreshed_at >= REFRESH_REUSE_WINDOW:
+                        del _refresh_results[old_key]
+                _refresh_results[key] = (now, new_tokens)
+            return new_tokens
+    finally:
+        # Callers already waiting hold the lock object; later ones find the result
+        with _refresh_locks_guard:
+            if _refresh_locks.get(key) is lock:
+                del _refresh_locks[key]
+
+
+def read_token_meta(cookies):
+    """Issued-at/expiry/user id metadata stored by callback.py, or None."""
+    raw = decrypt_token(cookies.get('x_token_meta'))
+    try:
+        meta = json.loads(raw) if raw else None
+    except ValueError:
+        return None
+    if not isinstance(meta, dict) or not isinstance(meta.get('exp'), (int, float)):
+        return None
+    return meta
+
+
+# sha256(access_token) -> (time until which the token is known to be valid, user id)
+_validated_tokens = {}
+_validated_lock = threading.Lock()
+
+
+def _token_hash(access_token):
+    return hashlib.sha256(access_token.encode()).hexdigest()
+
+
+def _remember_valid(access_token, now, user_id=None):
+    key = _token_hash(access_token)
+    with _validated_lock:
+        if len(_validated_tokens) > 1000:
+            for old_key, (until, _) in list(_validated_tokens.items()):
+                if until <= now:
+                    del _validated_tokens[old_key]
+        _validated_tokens[key] = (now + VALIDATION_TTL, user_id)
+
+
+def _known_valid(access_token, now):
+    """Return (is_valid, user_id) from the validation cache."""
+    key = _token_hash(access_token)
+    with _validated_lock:
+        until, user_id = _validated_tokens.get(key, (0, None))
+    return until > now, user_id
+
+
+class Session:
+    """The authenticated user for one request."""
+
+    def __init__(self, cookies, access_token, refresh_token, meta):
+        self.cookies = cookies
+        self.access_token = access_token
+        self.refresh_token = refresh_token
+        self.meta = meta or {}
+        # Set-Cookie values the handler must send back after a refresh
+        self.set_cookies = []
+
+    @property
+    def user_id(self):
+        return self.meta.get('uid') or None
+
+    @property
+    def auth_headers(self):
+        if self.user_id:
+            # Calls with these headers count against the user's rate-limit budget
+            bind_caller(self.access_token, self.user_id)
+        return {'Authorization': f'Bearer {self.access_token}'}
+
+    def refresh(self):
+        """Exchange the refresh token for a new access token. Returns True on success.
+
+        The new tokens are queued in set_cookies so the browser stores them and
+        later requests don't have to refresh again.
+        """
+        if not self.refresh_token:
+            return False
+        new_tokens = refresh_tokens_once(self.refresh_token)
+        if not new_tokens:
+            return False
+
+        self.access_token = new_tokens['access_token']
+        self.refresh_token = new_tokens.get('refresh_token') or self.refresh_token
+        expires_in = int(new_tokens.get('expires_in', 7200))
+        self.meta['exp'] = time.time() + expires_in
+        if self.user_id:
+            _remember_valid(self.access_token, time.time(), self.user_id)
+
+        self.set_cookies = token_cookies(self.access_token, self.refresh_token, expires_in, self.user_id)
+        if self.cookies.get('x_user'):
+            # Keep the JS-readable user info alive as long as the access token
+            self.set_cookies.append(
+                f"x_user={self.cookies['x_user']}; Secure; SameSite=Lax; Path=/; Max-Age={expires_in}"
+            )
+        return True
+
+    def detached(self):
+        """A copy of this session for work that runs after the response is sent.
+
+        It never refreshes: the rotated tokens could no longer reach the
+        browser, whose refresh token X has just invalidated. A 401 simply
+        makes the background work fail.
+        """
+        return Session(self.cookies, self.access_token, None, dict(self.meta))
+
+    def send_cookies(self, request_handler):
+        """Write any pending Set-Cookie headers (call before end_headers())."""
+        for cookie in self.set_cookies:
+            request_handler.send_header('Set-Cookie', cookie)
+
+
+def resolve_user_id(session):
+    """User ID comes from the session metadata; older sessions look it up once.
+
+    The looked-up id is kept on the session (and written into the metadata
+    cookie by a later refresh). Returns (user_id, status_code, error_payload).
+    """
+    if session.user_id:
+        return session.user_id, 200, None
+
+    user_response = x_api.get("/2/users/me", headers=session.auth_headers)
+
+    if user_response.status_code == 401 and session.refresh():
+        user_response = x_api.get("/2/users/me", headers=session.auth_headers)
+
+    if user_response.status_code != 200:
+        try:
+            user_err = user_response.json()
+            err_detail = user_err.get('detail', user_err.get('title', 'Unknown error'))
+        except Exception:
+            err_detail = f"Status {user_response.status_code}"
+        return None, user_response.status_code, {'error': f'Failed to get user info: {err_detail}'}
+
+    user_id = user_response.json().get('data', {}).get('id')
+    if not user_id:
+        return None, 502, {'error': 'Failed to get user info: no user id in response'}
+    session.meta['uid'] = user_id
+    _remember_valid(session.access_token, time.time(), user_id)
+    return user_id, 200, None
+
+
+def require_user(headers):
+    """Resolve the signed-in user from the request cookies.
+
+    Tokens are trusted until EXPIRY_MARGIN before the expiry recorded at
+    login, so steady-state requests make no extra X API calls; tokens
+    without that record are verified once and cached for VALIDATION_TTL.
+
+    Returns (session, error_response) - if error_response is set, session is None.
+    """
+    cookies = parse_cookies(headers)
+    encrypted_access = cookies.get('x_access_token')
+    encrypted_refresh = cookies.get('x_refresh_token')
+
+    if not encrypted_access and not encrypted_refresh:
+        return None, {'error': 'Not authenticated'}
+
+    # The browser drops the access cookie once it expires, leaving only the refresh token
+    access_token = None
+    if encrypted_access:
+        access_token = decrypt_token(encrypted_access)
+        if not access_token:
+            return None, {'error': 'Invalid token'}
+
+    session = Session(cookies, access_token, decrypt_token(encrypted_refresh), read_token_meta(cookies))
+    now = time.time()
+    needs_refresh = access_token is None
+
+    if access_token and session.meta:
+        needs_refresh = session.meta['exp'] - EXPIRY_MARGIN <= now
+    elif access_token:
+        known_valid, user_id = _known_valid(access_token, now)
+        if known_valid:
+            session.meta['uid'] = user_id
+        else:
+            try:
+                verify_response = x_api.get("/2/users/me", headers=session.auth_headers)
+            except RateLimited as e:
+                return None, {'error': f'Token validation rate limited, retry in {e.retry_after}s'}
+            if verify_response.status_code == 401:
+                needs_refresh = True
+            elif verify_response.status_code != 200:
+                return None, {'error': f'Token validation failed: status {verify_response.status_code}'}
+            else:
+                user_id = verify_response.json().get('data', {}).get('id')
+                _remember_valid(access_token, now, user_id)
+                session.meta['uid'] = user_id
+
+    if not needs_refresh or session.refresh():
+        return session, None
+
+    if access_token and session.meta.get('exp', 0) > now:
+        # Refresh failed but the current token hasn't actually expired yet
+        return session, None
+
+    return None, {'error': 'Token expired and refresh failed'}
@@ -0,0 +1,314 @@
+"""
+Local tweet store and incremental timeline sync for /api/tweets.
+
+The X API returns at most 100 tweets per call, so instead of re-downloading
+the latest page on every request the timeline is synced into SQLite:
+
+- the first sync pages back through GET /2/users/:id/tweets with
+  pagination_token until enough history is stored (X keeps the latest 3200),
+- later syncs pass since_id and only fetch tweets newer than the newest one
+  stored, plus older pages (until_id) when a request asks for more history,
+- public_metrics of recent tweets are refreshed in batches of 100 ids through
+  GET /2/tweets?ids=, one call per 100 tweets instead of re-paging the timeline.
+
+Env:
+    TWEET_STORE_DB   SQLite path (default: /tmp/tweet_store.sqlite3, the only
+                     writable directory on Vercel; ':memory:' if that fails)
+"""
+import os
+import json
+import time
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+
+from _x_client import x_api, RateLimited
+
+
+TWEET_STORE_DB = os.environ.get('TWEET_STORE_DB', '/tmp/tweet_store.sqlite3')
+
+TWEET_FIELDS = 'public_metrics,created_at,text'
+
+PAGE_SIZE = 100
+LOOKUP_BATCH_SIZE = 100
+
+# X only serves the latest 3200 tweets of a timeline
+MAX_TIMELINE_PAGES = 32
+
+# Re-sync a timeline at most this often (seconds)
+SYNC_INTERVAL = int(os.environ.get('TWEET_SYNC_INTERVAL', 60))
+
+# Tweets younger than this keep getting their metrics refreshed
+METRICS_REFRESH_DAYS = 7
+
+# ...but no more often than this (seconds)
+METRICS_REFRESH_INTERVAL = 300
+
+
+class SyncError(Exception):
+    """An X API call failed during sync. Carries the status and error payload."""
+
+    def __init__(self, status_code, payload):
+        super().__init__(payload.get('error', f'X API returned status {status_code}'))
+        self.status_code = status_code
+        self.payload = payload
+
+
+def _error_payload(response):
+    """Extract a meaningful error message from an X API error response."""
+    try:
+        error_data = response.json()
+        x_error = ''
+        if 'detail' in error_data:
+            x_error = error_data['detail']
+        elif 'errors' in error_data and len(error_data['errors']) > 0:
+            x_error = error_data['errors'][0].get('message', '')
+        elif 'title' in error_data:
+            x_error = error_data['title']
+        error_msg = f"X API error ({response.status_code}): {x_error}" if x_error else f"X API returned status {response.status_code}"
+    except Exception:
+        error_msg = f"X API returned status {response.status_code}"
+        error_data = {}
+    return {'error': error_msg, 'details': error_data}
+
+
+def _iso(dt):
+    return dt.strftime('%Y-%m-%dT%H:%M:%S.000Z')
+
+
+class TweetStore:
+    """SQLite-backed tweets keyed by id, plus per-user sync state."""
+
+    def __init__(self, path=TWEET_STORE_DB):
+        self._lock = threading.RLock()
+        try:
+            self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5)
+            self._init_schema()
+        except sqlite3.Error:
+            self._conn = sqlite3.connect(':memory:', check_same_thread=False)
+            self._init_schema()
+
+    def _init_schema(self):
+        with self._lock, self._conn:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS tweets ('
+                'id INTEGER PRIMARY KEY, user_id TEXT NOT NULL, text TEXT, created_at TEXT, '
+                'metrics TEXT, metrics_updated_at REAL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS tweets_user ON tweets (user_id, id)')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS sync_state ('
+                'user_id TEXT PRIMARY KEY, newest_id INTEGER, oldest_id INTEGER, '
+                'history_complete INTEGER DEFAULT 0, synced_at REAL)'
+            )
+
+    def upsert(self, user_id, tweets, now=None):
+        now = now or time.time()
+        rows = [
+            (int(t['id']), user_id, t.get('text'), t.get('created_at'), json.dumps(t.get('public_metrics', {})), now)
+            for t in tweets
+        ]
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'INSERT INTO tweets (id, user_id, text, created_at, metrics, metrics_updated_at) '
+                'VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT(id) DO UPDATE SET '
+                'text = excluded.text, metrics = excluded.metrics, metrics_updated_at = excluded.metrics_updated_at',
+                rows
+            )
+
+    def update_metrics(self, metrics_by_id, now=None):
+        now = now or time.time()
+        with self._lock, self._conn:
+            self._conn.executemany(
+                'UPDATE tweets SET metrics = ?, metrics_updated_at = ? WHERE id = ?',
+                [(json.dumps(metrics), now, int(tweet_id)) for tweet_id, metrics in metrics_by_id.items()]
+            )
+
+    def delete(self, tweet_ids):
+        with self._lock, self._conn:
+            self._conn.executemany('DELETE FROM tweets WHERE id = ?', [(int(i),) for i in tweet_ids])
+
+    def tweets(self, user_id, limit=None):
+        """Stored tweets for user_id, newest first, in X API shape."""
+        query = 'SELECT id, text, created_at, metrics FROM tweets WHERE user_id = ? ORDER BY id DESC'
+        args = [user_id]
+        if limit:
+            query += ' LIMIT ?'
+            args.append(int(limit))
+        with self._lock:
+            rows = self._conn.execute(query, args).fetchall()
+        return [
+            {'id': str(row[0]), 'text': row[1], 'created_at': row[2], 'public_metrics': json.loads(row[3] or '{}')}
+            for row in rows
+        ]
+
+    def user_ids(self):
+        with self._lock:
+            return [row[0] for row in self._conn.execute('SELECT DISTINCT user_id FROM tweets').fetchall()]
+
+    def count(self, user_id):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM tweets WHERE user_id = ?', (user_id,)).fetchone()[0]
+
+    def stale_metric_ids(self, user_id, created_after, updated_before):
+        with self._lock:
+            rows = self._conn.execute(
+                'SELECT id FROM tweets WHERE user_id = ? AND created_at >= ? AND '
+                '(metrics_updated_at IS NULL OR metrics_updated_at < ?) ORDER BY id DESC',
+                (user_id, created_after, updated_before)
+            ).fetchall()
+        return [str(row[0]) for row in rows]
+
+    def sync_state(self, user_id):
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT newest_id, oldest_id, history_complete, synced_at FROM sync_state WHERE user_id = ?',
+                (user_id,)
+            ).fetchone()
+        if not row:
+            return {'newest_id': None, 'oldest_id': None, 'history_complete': False, 'synced_at': 0}
+        return {'newest_id': row[0], 'oldest_id': row[1], 'history_complete': bool(row[2]), 'synced_at': row[3] or 0}
+
+    def save_sync_state(self, user_id, state):
+        with self._lock, self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO sync_state (user_id, newest_id, oldest_id, history_complete, synced_at) '
+                'VALUES (?, ?, ?, ?, ?)',
+                (user_id, state['newest_id'], state['oldest_id'], int(state['history_complete']), state['synced_at'])
+            )
+
+
+def _get(session, path, params):
+    try:
+        response = x_api.get(path, headers=session.auth_headers, params=params)
+        if response.status_code == 401 and session.refresh():
+            # Token was revoked or expired early, retry once with a fresh one
+            response = x_api.get(path, headers=session.auth_headers, params=params)
+    except RateLimited as e:
+        raise SyncError(429, {'error': str(e), 'retry_after': e.retry_after})
+    if response.status_code != 200:
+        raise SyncError(response.status_code, _error_payload(response))
+    return response.json()
+
+
+def _page_timeline(session, user_id, store, max_pages, **bounds):
+    """Page through the timeline within since_id/until_id bounds.
+
+    Returns (newest_id, oldest_id, reached_end) of what was fetched.
+    """
+    params = {
+        'max_results': PAGE_SIZE,
+        'tweet.fields': TWEET_FIELDS,
+        'exclude': 'retweets,replies',
+    }
+    params.update({k: v for k, v in bounds.items() if v})
+    newest_id = oldest_id = None
+
+    for _ in range(max_pages):
+        data = _get(session, f"/2/users/{user_id}/tweets", params)
+        tweets = data.get('data', [])
+        if tweets:
+            store.upsert(user_id, tweets)
+            ids = [int(t['id']) for t in tweets]
+            newest_id = max(ids + ([newest_id] if newest_id else []))
+            oldest_id = min(ids + ([oldest_id] if oldest_id else []))
+
+        next_token = data.get('meta', {}).get('next_token')
+        if not next_token:
+            return newest_id, oldest_id, True
+        params['pagination_token'] = next_token
+
+    return newest_id, oldest_id, False
+
+
+def refresh_recent_metrics(session, user_id, store, days=METRICS_REFRESH_DAYS, interval=METRICS_REFRESH_INTERVAL):
+    """Refresh public_metrics of recent tweets, 100 ids per lookup call.
+
+    Returns the number of tweets refreshed.
+    """
+    now = time.time()
+    created_after = _iso(datetime.now(timezone.utc) - timedelta(days=days))
+    tweet_ids = store.stale_metric_ids(user_id, created_after, now - interval)
+
+    refreshed = 0
+    for start in range(0, len(tweet_ids), LOOKUP_BATCH_SIZE):
+        batch = tweet_ids[start:start + LOOKUP_BATCH_SIZE]
+        data = _get(session, "/2/tweets", {'ids': ','.join(batch), 'tweet.fields': 'public_metrics'})
+        metrics = {t['id']: t.get('public_metrics', {}) for t in data.get('data', [])}
+        store.update_metrics(metrics, now)
+        refreshed += len(metrics)
+
+        # Tweets that no longer exist come back as errors with their id
+        missing = [e.get('resource_id') or e.get('value') for e in data.get('errors', [])
+                   if e.get('resource_type') == 'tweet']
+        if missing:
+            store.delete([i for i in missing if i])
+    return refreshed
+
+
+_sync_locks = {}
+_sync_locks_guard = threading.Lock()
+
+
+def sync_timeline(session, user_id, store, min_tweets=PAGE_SIZE, force=False):
+    """Bring the stored timeline for user_id up to date.
+
+    Fetches new tweets since the last sync, pages further back until at least
+    min_tweets are stored (or the timeline ends), and refreshes metrics of
+    recent tweets. Skipped if the user was synced within SYNC_INTERVAL and
+    already has enough history, unless force is set.
+
+    Raises SyncError if an X API call fails.
+    """
+    with _sync_locks_guard:
+        lock = _sync_locks.setdefault(user_id, threading.Lock())
+
+    # Concurrent requests for the same user wait for one sync instead of repeating it
+    with lock:
+        state = store.sync_state(user_id)
+        now = time.time()
+        stored = store.count(user_id)
+        enough_history = state['history_complete'] or stored >= min_tweets
+        if not force and enough_history and now - state['synced_at'] < SYNC_INTERVAL:
+            return state
+
+        if state['newest_id'] is None:
+            pages = max(1, -(-min_tweets // PAGE_SIZE))
+            newest_id, oldest_id, reached_end = _page_timeline(session, user_id, store, min(pages, MAX_TIMELINE_PAGES))
+            state.update(newest_id=newest_id, oldest_id=oldest_id, history_complete=reached_end)
+        else:
+            newest_id, _, _ = _page_timeline(
+                session, user_id, store, MAX_TIMELINE_PAGES, since_id=str(state['newest_id'])
+            )
+            if newest_id:
+                state['newest_id'] = max(newest_id, state['newest_id'])
+
+            stored = store.count(user_id)
+            if not state['history_complete'] and stored < min_tweets:
+                pages = -(-(min_tweets - stored) // PAGE_SIZE)
+                _, oldest_id, reached_end = _page_timeline(
+                    session, user_id, store, min(pages, MAX_TIMELINE_PAGES), until_id=str(state['oldest_id'])
+                )
+                if oldest_id:
+                    state['oldest_id'] = min(oldest_id, state['oldest_id'])
+                state['history_complete'] = reached_end
+
+        refresh_recent_metrics(session, user_id, store)
+
+        state['synced_at'] = now
+        store.save_sync_state(user_id, state)
+        return state
+
+
+_store = None
+_store_guard = threading.Lock()
+
+
+def get_tweet_store():
+    """The TweetStore for this warm instance, opened on first use."""
+    global _store
+    with _store_guard:
+        if _store is None:
+            _store = TweetStore()
+        return _store
@@ -0,0 +1,101 @@
+"""
+Shared X API client for the api/ handlers.
+
+A single pooled, keep-alive HTTP session is created when this module is first
+imported and reused for every invocation served by the same warm serverless
+instance, so repeated calls to api.twitter.com skip the TCP+TLS handshake.
+Every call gets connect/read timeouts by default.
+
+If httpx is installed with HTTP/2 support (pip install "httpx[http2]"), the
+session multiplexes requests over one HTTP/2 connection; otherwise it falls
+back to a pooled requests.Session. Both return responses with the same
+status_code / headers / json() interface used by the handlers.
+
+Rate-limit headers on every response are recorded in _rate_limit.py; a call
+whose budget is exhausted waits briefly for the reset or raises RateLimited.
+
+Set X_API_BASE_URL to point the handlers at a local fake X API.
+"""
+import os
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+    import h2  # noqa: F401 - only needed to enable HTTP/2 in httpx
+except ImportError:
+    httpx = None
+
+from _rate_limit import rate_limits, endpoint_family, caller_key, bind_caller, RateLimited  # noqa: F401 - re-exported
+
+
+X_API_BASE_URL = os.environ.get('X_API_BASE_URL', 'https://api.twitter.com').rstrip('/')
+
+# Seconds. Connect slightly above a multiple of 3 (the TCP retransmit window)
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 15
+
+POOL_SIZE = 10
+
+
+class XClient:
+    """Thin wrapper around a pooled session with X API defaults."""
+
+    def __init__(self, base_url=X_API_BASE_URL):
+        self.base_url = base_url
+        self.http2 = httpx is not None
+        if self.http2:
+            self._session = httpx.Client(
+                http2=True,
+                timeout=httpx.Timeout(READ_TIMEOUT, connect=CONNECT_TIMEOUT),
+                limits=httpx.Limits(max_connections=POOL_SIZE, max_keepalive_connections=POOL_SIZE),
+            )
+        else:
+            self._session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE)
+            self._session.mount('https://', adapter)
+            self._session.mount('http://', adapter)
+
+    def url(self, path):
+        """Absolute URL for an API path like '/2/users/me'."""
+        if path.startswith('http://') or path.startswith('https://'):
+            return path
+        return f'{self.base_url}{path}'
+
+    def request(self, method, path, timeout=None, **kwargs):
+        family = endpoint_family(method, path)
+        caller = caller_key(kwargs.get('headers'))
+        reserved = rate_limits.acquire(caller, family)
+
+        if timeout is None and not self.http2:
+            timeout = (CONNECT_TIMEOUT, READ_TIMEOUT)
+        if timeout is not None:
+            kwargs['timeout'] = timeout
+        try:
+            response = self._session.request(method, self.url(path), **kwargs)
+        except Exception:
+            rate_limits.release(caller, family, reserved)
+            raise
+
+        rate_limits.record(caller, family, response, reserved)
+        return response
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+
+# Exception types callers can catch regardless of the transport in use
+if httpx is not None:
+    TIMEOUT_ERRORS = (requests.exceptions.Timeout, httpx.TimeoutException)
+    CONNECTION_ERRORS = (requests.exceptions.ConnectionError, httpx.TransportError)
+else:
+    TIMEOUT_ERRORS = (requests.exceptions.Timeout,)
+    CONNECTION_ERRORS = (requests.exceptions.ConnectionError,)
+
+
+# Created once per warm instance, shared by every handler in it
+x_api = XClient()
@@ -0,0 +1,73 @@
+"""
+Blob Endpoint - Serves generated images from the local blob store
+
+GET /api/blob?name=images/<hash>.png
+    The stored file. Names are content hashes, so responses are cacheable
+    forever and the hash doubles as the ETag.
+
+Only used with the local filesystem store (see _blob_store.py); with Vercel
+Blob configured, image URLs point at the blob CDN directly.
+"""
+import os
+import json
+import sys
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _blob_store import get_blob_store, LocalBlobStore, BLOB_MAX_AGE, CONTENT_TYPES
+from _image_stream import iter_chunks
+from _response_cache import etag_matches
+
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        name = params.get('name', [''])[0]
+
+        store = get_blob_store()
+        if not isinstance(store, LocalBlobStore):
+            self._send_json(404, {'error': 'Blobs are served by the blob store'})
+            return
+
+        path = store.path(name)
+        if path is None:
+            self._send_json(400, {'error': 'Invalid blob name'})
+            return
+        if not path.exists():
+            self._send_json(404, {'error': 'Not found'})
+            return
+
+        etag = '"' + path.stem + '"'
+        if etag_matches(self.headers, etag):
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.end_headers()
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPES[path.suffix.lstrip('.')])
+        self.send_header('Content-Length', str(path.stat().st_size))
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Cache-Control', f'public, max-age={BLOB_MAX_AGE}, immutable')
+        self.send_header('ETag', etag)
+        self.end_headers()
+        with open(path, 'rb') as f:
+            for chunk in iter_chunks(f):
+                self.wfile.write(chunk)
+
+    def do_OPTIONS(self):
+        """Handle CORS preflight requests."""
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Max-Age', '86400')
+        self.end_headers()
+
+    def _send_json(self, code, data):
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+        self.wfile.write(json.dumps(data).encode())
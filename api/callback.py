@@ -3,29 +3,14 @@ X OAuth 2.0 Callback Endpoint - Exchanges code for tokens
 """
 import os
 import json
+import sys
 import base64
-import requests
 from http.server import BaseHTTPRequestHandler
 from urllib.parse import parse_qs, urlparse
-from http.cookies import SimpleCookie
-from cryptography.fernet import Fernet
 
-
-def get_cookie(cookie_header, name):
-    """Extract a cookie value from the Cookie header."""
-    if not cookie_header:
-        return None
-    cookie = SimpleCookie()
-    cookie.load(cookie_header)
-    if name in cookie:
-        return cookie[name].value
-    return None
-
-
-def encrypt_token(token, key):
-    """Encrypt a token for secure storage."""
-    cipher = Fernet(key.encode() if isinstance(key, str) else key)
-    return cipher.encrypt(token.encode()).decode()
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _x_client import x_api
+from _session import parse_cookies, token_cookies
 
 
 class handler(BaseHTTPRequestHandler):
@@ -55,9 +40,9 @@ class handler(BaseHTTPRequestHandler):
             return
 
         # Get cookies
-        cookie_header = self.headers.get('Cookie', '')
-        stored_state = get_cookie(cookie_header, 'oauth_state')
-        code_verifier = get_cookie(cookie_header, 'pkce_verifier')
+        cookies = parse_cookies(self.headers)
+        stored_state = cookies.get('oauth_state')
+        code_verifier = cookies.get('pkce_verifier')
 
         # Validate state (CSRF protection)
         if not stored_state or stored_state != state:
@@ -77,7 +62,7 @@ class handler(BaseHTTPRequestHandler):
         client_secret = os.environ.get('X_CLIENT_SECRET')
         redirect_uri = f"{app_url}/api/callback"
 
-        token_url = "https://api.twitter.com/2/oauth2/token"
+        token_url = "/2/oauth2/token"
 
         # Prepare token request
         token_data = {
@@ -94,7 +79,7 @@ class handler(BaseHTTPRequestHandler):
             auth = (client_id, client_secret)
 
         try:
-            response = requests.post(
+            response = x_api.post(
                 token_url,
                 data=token_data,
                 auth=auth,
@@ -114,8 +99,8 @@ class handler(BaseHTTPRequestHandler):
             expires_in = tokens.get('expires_in', 7200)
 
             # Get user info
-            user_response = requests.get(
-                "https://api.twitter.com/2/users/me",
+            user_response = x_api.get(
+                "/2/users/me",
                 headers={'Authorization': f'Bearer {access_token}'},
                 params={'user.fields': 'profile_image_url,username,name'}
             )
@@ -124,24 +109,14 @@ class handler(BaseHTTPRequestHandler):
             if user_response.status_code == 200:
                 user_data = user_response.json().get('data', {})
 
-            # Encrypt tokens for cookie storage
-            encryption_key = os.environ.get('ENCRYPTION_KEY')
-            if encryption_key:
-                encrypted_access = encrypt_token(access_token, encryption_key)
-                encrypted_refresh = encrypt_token(refresh_token, encryption_key) if refresh_token else ''
-            else:
-                # Fallback: base64 encode (less secure, for dev only)
-                encrypted_access = base64.b64encode(access_token.encode()).decode()
-                encrypted_refresh = base64.b64encode(refresh_token.encode()).decode() if refresh_token else ''
-
             # Redirect to dashboard with success
             self.send_response(302)
             self.send_header('Location', f"{app_url}/dashboard")
 
-            # Set auth cookies
-            self.send_header('Set-Cookie', f'x_access_token={encrypted_access}; HttpOnly; Secure; SameSite=Lax; Path=/; Max-Age={expires_in}')
-            if encrypted_refresh:
-                self.send_header('Set-Cookie', f'x_refresh_token={encrypted_refresh}; HttpOnly; Secure; SameSite=Lax; Path=/; Max-Age=15552000')  # 6 months
+            # Set auth cookies (encrypted, plus expiry metadata so handlers can
+            # trust the token until then instead of re-validating it)
+            for cookie in token_cookies(access_token, refresh_token, expires_in, user_data.get('id', '')):
+                self.send_header('Set-Cookie', cookie)
 
             # Set user info cookie (not sensitive, readable by JS)
             user_info = {
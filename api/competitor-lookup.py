@@ -0,0 +1,249 @@
+"""
+Competitor Lookup Endpoint - Public profile stats of tracked competitor accounts
+
+GET /api/competitor-lookup?username=garyvee
+    Returns one competitor in the shape competitors.html stores.
+
+GET /api/competitor-lookup?usernames=garyvee,alexhormozi,...
+    Batch mode: { "results": { handle: competitor }, "errors": { handle: message } }.
+
+Handles are resolved with GET /2/users/by?usernames=, up to 100 per call,
+and cached per handle (see _response_cache.py), so refreshing 50 competitors
+costs at most one X API call. Stale handles are answered from cache and
+refreshed together in one background call. Every fetch snapshots the
+follower and post counts (see _competitor_store.py), and growth_30d /
+post_frequency come from that history. Pass ?refresh=1 to bypass the cache.
+"""
+import os
+import re
+import json
+import sys
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _x_client import x_api, RateLimited, TIMEOUT_ERRORS, CONNECTION_ERRORS
+from _session import require_user
+from _response_cache import ResponseCache, FRESH, STALE, etag_for, etag_matches, wants_fresh
+from _competitor_store import get_competitor_store
+
+
+USER_FIELDS = 'name,username,profile_image_url,verified,public_metrics'
+
+# GET /2/users/by accepts up to 100 usernames per call
+LOOKUP_BATCH_SIZE = 100
+MAX_HANDLES = 500
+
+USERNAME_RE = re.compile(r'^[A-Za-z0-9_]{1,15}$')
+
+# Public profiles are the same for every caller, so the cache is shared. Stale
+# entries are served for a day while a background lookup refreshes them.
+competitor_cache = ResponseCache(
+    'competitor',
+    ttl=int(os.environ.get('COMPETITOR_CACHE_TTL', 900)),
+    stale_ttl=int(os.environ.get('COMPETITOR_CACHE_STALE_TTL', 86400))
+)
+
+
+def format_number(value):
+    """3200000 -> '3.2M', 18200 -> '18.2K'."""
+    if value is None:
+        return None
+    if value >= 1_000_000:
+        return f"{value / 1_000_000:.1f}M"
+    if value >= 1_000:
+        return f"{value / 1_000:.1f}K"
+    return str(value)
+
+
+def lookup_users(session, usernames):
+    """Resolve usernames with batched /2/users/by calls and cache each handle.
+
+    Returns (status_code, {handle: user or {'not_found': True, 'error': ...}}).
+    Raises RateLimited when the lookup budget is exhausted.
+    """
+    store = get_competitor_store()
+    results = {}
+    for start in range(0, len(usernames), LOOKUP_BATCH_SIZE):
+        batch = usernames[start:start + LOOKUP_BATCH_SIZE]
+        params = {'usernames': ','.join(batch), 'user.fields': USER_FIELDS}
+        response = x_api.get("/2/users/by", headers=session.auth_headers, params=params)
+
+        if response.status_code == 401 and session.refresh():
+            response = x_api.get("/2/users/by", headers=session.auth_headers, params=params)
+
+        if response.status_code != 200:
+            return response.status_code, results
+
+        data = response.json()
+        for user in data.get('data', []):
+            handle = user['username'].lower()
+            record = {
+                'id': user.get('id'),
+                'username': user.get('username'),
+                'name': user.get('name'),
+                'profile_image_url': user.get('profile_image_url', ''),
+                'verified': user.get('verified', False),
+                'public_metrics': user.get('public_metrics', {}),
+            }
+            store.record(handle, record['public_metrics'])
+            competitor_cache.set(handle, record)
+            results[handle] = record
+        for error in data.get('errors', []):
+            handle = str(error.get('value', '')).lower()
+            if handle and handle not in results:
+                record = {'not_found': True, 'error': error.get('detail', error.get('title', 'Not found'))}
+                competitor_cache.set(handle, record)
+                results[handle] = record
+
+    return 200, results
+
+
+def format_competitor(record):
+    """A cached user record in the shape competitors.html keeps per competitor."""
+    metrics = record.get('public_metrics', {})
+    growth, per_day = get_competitor_store().trends(record['username'])
+    name = record.get('name') or record['username']
+    words = name.split()
+    initials = (words[0][0] + words[1][0] if len(words) > 1 else record['username'][:2]).upper()
+
+    competitor = {
+        'name': name,
+        'handle': '@' + record['username'],
+        'avatar_initials': initials,
+        'profile_image_url': record.get('profile_image_url'),
+        'verified': record.get('verified', False),
+        'followers': format_number(metrics.get('followers_count')),
+        'followers_count': metrics.get('followers_count'),
+        'following_count': metrics.get('following_count'),
+        'tweet_count': metrics.get('tweet_count'),
+        'growth_30d': None,
+        'post_frequency': None,
+    }
+    if growth is not None:
+        competitor['growth_30d'] = f"{growth:+.1f}%"
+    if per_day is not None:
+        competitor['post_frequency'] = f"{per_day:.0f}/day" if per_day >= 10 else f"{per_day:.1f}/day"
+    return competitor
+
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+
+        session, error = require_user(self.headers)
+        if error:
+            self._send_json(401, error)
+            return
+        self.session = session
+
+        batch_mode = 'usernames' in params
+        raw = ','.join(params.get('usernames', params.get('username', [''])))
+        handles, errors = [], {}
+        for name in raw.split(','):
+            name = name.strip().lstrip('@')
+            if not name:
+                continue
+            if not USERNAME_RE.match(name):
+                errors[name] = 'Invalid username'
+            elif name.lower() not in handles:
+                handles.append(name.lower())
+
+        if not handles and not errors:
+            self._send_json(400, {'error': 'username or usernames is required'})
+            return
+        if len(handles) > MAX_HANDLES:
+            self._send_json(400, {'error': f'At most {MAX_HANDLES} usernames per request'})
+            return
+
+        records, missing, stale = {}, [], []
+        bypass = wants_fresh(self.headers, params)
+        for handle in handles:
+            record, state = (None, None) if bypass else competitor_cache.get(handle)
+            if record is None:
+                missing.append(handle)
+                continue
+            records[handle] = record
+            if state == STALE:
+                stale.append(handle)
+
+        if stale:
+            # One background call for every stale handle, answered from cache meanwhile.
+            # It must not refresh the token: the rotated cookies could no longer be sent.
+            background = session.detached()
+
+            def refresh_stale():
+                lookup_users(background, stale)  # caches each handle itself
+                return None
+
+            competitor_cache.revalidate('refresh:' + ','.join(stale), refresh_stale)
+
+        cache_state = 'miss' if missing else (STALE if stale else FRESH)
+        if missing:
+            try:
+                status_code, fetched = lookup_users(session, missing)
+            except RateLimited as e:
+                if not batch_mode or not records:
+                    self._send_json(429, {'error': str(e), 'retry_after': e.retry_after})
+                    return
+                status_code, fetched = 429, {}
+            except TIMEOUT_ERRORS:
+                self._send_json(504, {'error': 'Request to X API timed out'})
+                return
+            except CONNECTION_ERRORS:
+                self._send_json(502, {'error': 'Failed to connect to X API'})
+                return
+
+            if status_code != 200 and not (batch_mode and (records or fetched)):
+                self._send_json(status_code, {'error': f'X API returned status {status_code}'})
+                return
+            records.update(fetched)
+            for handle in missing:
+                if handle not in records:
+                    errors[handle] = f'Lookup failed with status {status_code}'
+
+        results = {}
+        for handle in handles:
+            record = records.get(handle)
+            if record is None:
+                continue
+            if record.get('not_found'):
+                errors[handle] = record['error']
+            else:
+                results[handle] = format_competitor(record)
+
+        if batch_mode:
+            self._send_json(200, {'results': results, 'errors': errors}, cache_state)
+        elif results:
+            self._send_json(200, next(iter(results.values())), cache_state)
+        else:
+            handle, message = next(iter(errors.items()))
+            self._send_json(400 if message == 'Invalid username' else 404, {'error': message, 'username': handle})
+
+    def do_OPTIONS(self):
+        """Handle CORS preflight requests."""
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Max-Age', '86400')
+        self.end_headers()
+
+    def _send_json(self, code, data, cache_state=None):
+        """Send a JSON response, with ETag/Cache-Control on cacheable ones."""
+        body = json.dumps(data).encode()
+        etag = etag_for(body) if cache_state else None
+        if etag and etag_matches(self.headers, etag):
+            code, body = 304, b''
+
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', competitor_cache.cache_control())
+            self.send_header('X-Cache', cache_state.upper())
+        if getattr(self, 'session', None):
+            self.session.send_cookies(self)
+        self.end_headers()
+        self.wfile.write(body)
@@ -1,8 +1,107 @@
+"""
+Generate Endpoint - Writes social posts with the chat completions API
+
+POST /api/generate
+    Body: { "prompt", "platform", "tone", "type", "variations" (1-5) }
+    Returns { success, content, posts, platform, tone, type } once the whole
+    completion is done.
+
+POST /api/generate with "stream": true (or Accept: text/event-stream)
+    Streams the completion as server-sent events:
+        event: token      {"variation": i, "text": "..."}   text as it arrives
+        event: variation  {"index": i, "text": "..."}       a finished variation
+        event: done       the same payload as the JSON response
+        event: error      {"success": false, "error": "..."}
+    Each variation is sent as soon as its ---VARIATION--- delimiter arrives,
+    so the first one shows up after roughly one round trip instead of after
+    the whole batch.
+
+POST /api/generate with "parallel": true
+    Fan-out: one completion per variation, run concurrently over a shared
+    connection pool (see _openai_client.py), each with its own timeout, so
+    latency is that of one variation rather than five. A failed or timed-out
+    call drops only its variation ("failed" counts them). Combined with
+    "stream", each variation event is sent as its completion finishes.
+
+Completed generations are cached per platform/tone/type/variations and
+prompt, including near-identical prompts (see _generation_cache.py); a cached
+answer carries "cached": "exact" or "similar" and is replayed as variation
+events when streaming. Pass "regenerate": true to skip the cache and replace
+its entry with a fresh completion.
+"""
 from http.server import BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import json
 import os
-import urllib.request
-import urllib.error
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _openai_client import openai_api, error_message, TIMEOUT_ERRORS, CONNECTION_ERRORS
+from _generation_cache import generation_cache
+from _prompts import PROMPT_VERSION, VARIATION_DELIMITER, normalize, system_prompt, fanout_prompts
+
+
+# (connect, read) seconds per fan-out call; a slow one is dropped, not waited on
+FANOUT_TIMEOUT = (3.05, 20)
+
+
+def split_variations(content):
+    """Split a completion into variations on the delimiter."""
+    if VARIATION_DELIMITER in content:
+        return [p.strip() for p in content.split(VARIATION_DELIMITER) if p.strip()]
+    return [content.strip()]
+
+
+class VariationSplitter:
+    """Splits streamed completion text into variations as the delimiters arrive.
+
+    feed() and finish() return events: ('token', index, text) for text that is
+    safe to show (never part of a delimiter) and ('variation', index, text)
+    for each finished variation.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.sent = 0      # chars of buffer already sent as tokens
+        self.index = 0
+
+    def _held_back(self):
+        """Length of the buffer's tail that could be the start of a delimiter."""
+        for size in range(min(len(VARIATION_DELIMITER) - 1, len(self.buffer)), 0, -1):
+            if VARIATION_DELIMITER.startswith(self.buffer[-size:]):
+                return size
+        return 0
+
+    def _token(self, end):
+        text = self.buffer[self.sent:end]
+        self.sent = max(self.sent, end)
+        return [('token', self.index, text)] if text else []
+
+    def _close(self, text):
+        events = []
+        if text.strip():
+            events.append(('variation', self.index, text.strip()))
+            self.index += 1
+        return events
+
+    def feed(self, text):
+        self.buffer += text
+        events = []
+        while VARIATION_DELIMITER in self.buffer:
+            variation, self.buffer = self.buffer.split(VARIATION_DELIMITER, 1)
+            if self.sent < len(variation):
+                events.append(('token', self.index, variation[self.sent:]))
+            events.extend(self._close(variation))
+            self.sent = 0
+        events.extend(self._token(len(self.buffer) - self._held_back()))
+        return events
+
+    def finish(self):
+        events = self._token(len(self.buffer))
+        events.extend(self._close(self.buffer))
+        self.buffer, self.sent = '', 0
+        return events
+
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
@@ -12,7 +111,8 @@ class handler(BaseHTTPRequestHandler):
         self.end_headers()
         api_key = os.environ.get('OPENAI_API_KEY', '')
         has_key = 'yes' if api_key else 'no'
-        response = {'status': 'ok', 'endpoint': 'generate', 'api_key_configured': has_key}
+        response = {'status': 'ok', 'endpoint': 'generate', 'api_key_configured': has_key,
+                    'prompt_version': PROMPT_VERSION}
         self.wfile.write(json.dumps(response).encode())
 
     def do_POST(self):
@@ -30,31 +130,59 @@ class handler(BaseHTTPRequestHandler):
             platform = data.get('platform', 'twitter')
             tone = data.get('tone', 'professional')
             content_type = data.get('type', 'post')
-            variations = min(int(data.get('variations', 3)), 5)
+            try:
+                variations = min(int(data.get('variations', 3)), 5)
+            except (TypeError, ValueError):
+                self._send_json(400, {'success': False, 'error': 'variations must be a number'})
+                return
 
-            system_prompt = self._build_system_prompt(platform, tone, content_type, variations)
+            prompt_prefix = system_prompt(platform, tone, content_type, variations)
             user_prompt = prompt if prompt else f"Create an engaging {content_type} for {platform}"
 
-            result = self._call_openai(api_key, system_prompt, user_prompt)
+            stream = data.get('stream') or 'text/event-stream' in self.headers.get('Accept', '')
+            meta = {'platform': platform, 'tone': tone, 'type': content_type}
+
+            # Keyed on the values the prompt is built from, so unknown or
+            # out-of-range inputs share an entry with what they fall back to
+            self.cache_key = ((PROMPT_VERSION, *normalize(platform, tone, content_type, variations)), user_prompt)
+            if not data.get('regenerate'):
+                cached, kind = generation_cache.get(*self.cache_key)
+                if cached:
+                    if stream:
+                        self._replay_cached(cached, kind)
+                    else:
+                        self._send_json(200, {**cached, 'cached': kind})
+                    return
+
+            if data.get('parallel') and variations > 1 and content_type != 'thread':
+                results = self._fan_out(api_key, platform, tone, content_type, variations, user_prompt)
+                if stream:
+                    self._stream_fan_out(results, meta)
+                else:
+                    self._send_fan_out(results, meta)
+                return
+
+            if stream:
+                self._stream_generation(api_key, prompt_prefix, user_prompt, platform, tone, content_type)
+                return
+
+            result = self._call_openai(api_key, prompt_prefix, user_prompt)
 
             if result.get('error'):
                 self._send_json(500, {'success': False, 'error': result['error']})
             else:
-                content = result['content']
-                # Split into variations if delimiter is present
-                if '---VARIATION---' in content:
-                    posts = [p.strip() for p in content.split('---VARIATION---') if p.strip()]
-                else:
-                    posts = [content.strip()]
+                posts = split_variations(result['content'])
 
-                self._send_json(200, {
+                payload = {
                     'success': True,
                     'content': posts[0] if len(posts) == 1 else posts[0],
                     'posts': posts,
                     'platform': platform,
                     'tone': tone,
                     'type': content_type
-                })
+                }
+                self._remember(payload)
+                self._send_json(200, payload)
 
         except json.JSONDecodeError:
             self._send_json(400, {'success': False, 'error': 'Invalid JSON'})
@@ -75,93 +203,187 @@ class handler(BaseHTTPRequestHandler):
         self.end_headers()
         self.wfile.write(json.dumps(data).encode())
 
-    def _build_system_prompt(self, platform, tone, content_type, variations=1):
-        platform_rules = {
-            'twitter': 'Keep posts under 280 characters. Make it punchy and engaging. Use line breaks for readability.',
-            'instagram': 'Can be longer. Use relevant hashtags. Include a call-to-action.',
-            'linkedin': 'Professional tone. Can be longer form. End with a question or call-to-action.',
-            'tiktok': 'Casual, trendy language. Short and catchy. Use popular phrases.',
-            'facebook': 'Conversational tone. Medium length. Encourage interaction.'
-        }
+    def _start_events(self):
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('X-Accel-Buffering', 'no')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
 
-        tone_desc = {
-            'professional': 'Professional, credible, and authoritative.',
-            'casual': 'Friendly, approachable, and conversational.',
-            'witty': 'Clever, sharp, and humorous without trying too hard.',
-            'inspirational': 'Motivating, uplifting, and genuine.',
-            'inspiring': 'Motivating, uplifting, and genuine.',
-            'educational': 'Informative, helpful, and clear.',
-            'humorous': 'Funny, entertaining, and relatable.'
-        }
+    def _send_event(self, event, data):
+        self.wfile.write(f'event: {event}\ndata: {json.dumps(data)}\n\n'.encode())
+        self.wfile.flush()
 
-        type_rules = {
-            'post': 'Create a single, standalone post.',
-            'thread': 'Create a thread of 3-5 connected posts. Number each (1/, 2/, etc). Make the first tweet a strong hook.',
-            'reply': 'Create a concise, relevant reply that adds value.'
-        }
+    def _remember(self, payload):
+        """Cache a successful generation under this request's key."""
+        generation_cache.set(*self.cache_key, payload)
 
-        variation_rule = ''
-        if variations > 1:
-            variation_rule = f"""
+    def _replay_cached(self, payload, kind):
+        """Send a cached generation as the same events a live stream ends with."""
+        self._start_events()
+        try:
+            for index, text in enumerate(payload['posts']):
+                self._send_event('variation', {'index': index, 'text': text})
+            self._send_event('done', {**payload, 'cached': kind})
+        except (BrokenPipeError, ConnectionResetError):
+            return  # The browser went away
+
+    def _stream_generation(self, api_key, prompt_prefix, user_prompt, platform, tone, content_type):
+        """Relay a streamed completion as server-sent events, one variation at a time."""
+        response, error = self._open_openai_stream(api_key, prompt_prefix, user_prompt)
+        if error:
+            self._send_json(500, {'success': False, 'error': error})
+            return
+
+        self._start_events()
+
+        splitter = VariationSplitter()
+        posts = []
+
+        def relay(events):
+            for kind, index, text in events:
+                if kind == 'token':
+                    self._send_event('token', {'variation': index, 'text': text})
+                else:
+                    posts.append(text)
+                    self._send_event('variation', {'index': index, 'text': text})
 
-Generate exactly {variations} different variations of the content. Separate each variation with the delimiter "---VARIATION---".
-Each variation should take a different angle or approach while matching the same tone and platform requirements.
-Do NOT number the variations or add labels like "Variation 1:" - just provide the content separated by the delimiter."""
+        try:
+            with response:
+                for delta in self._iter_stream_deltas(response):
+                    relay(splitter.feed(delta))
+            relay(splitter.finish())
+        except (BrokenPipeError, ConnectionResetError):
+            return  # The browser went away
+        except Exception as e:
+            self._send_event('error', {'success': False, 'error': f'Error: {str(e)}'})
+            return
 
-        return f"""You are an expert social media content creator who writes viral, authentic content.
+        if not posts:
+            self._send_event('error', {'success': False, 'error': 'The model returned no content'})
+            return
+        payload = {
+            'success': True,
+            'content': posts[0],
+            'posts': posts,
+            'platform': platform,
+            'tone': tone,
+            'type': content_type
+        }
+        self._remember(payload)
+        self._send_event('done', payload)
 
-Platform: {platform.upper()}
-{platform_rules.get(platform, platform_rules['twitter'])}
+    def _fan_out(self, api_key, platform, tone, content_type, variations, user_prompt):
+        """Run one completion per variation concurrently. Yields results as they finish."""
+        prompts = fanout_prompts(platform, tone, content_type, variations)
+        with ThreadPoolExecutor(max_workers=variations) as pool:
+            futures = [
+                pool.submit(self._call_openai, api_key, prompt, user_prompt, FANOUT_TIMEOUT)
+                for prompt in prompts
+            ]
+            for future in as_completed(futures):
+                yield future.result()
 
-Tone: {tone}
-{tone_desc.get(tone, tone_desc['professional'])}
+    def _send_fan_out(self, results, meta):
+        posts, errors = [], []
+        for result in results:
+            if result.get('error'):
+                errors.append(result['error'])
+            else:
+                posts.extend(split_variations(result['content'])[:1])
 
-Type: {content_type}
-{type_rules.get(content_type, type_rules['post'])}
-{variation_rule}
+        if not posts:
+            self._send_json(500, {'success': False, 'error': errors[0] if errors else 'No content generated'})
+            return
+        payload = {'success': True, 'content': posts[0], 'posts': posts, 'failed': len(errors), **meta}
+        if not errors:
+            self._remember(payload)  # a partial batch would be replayed short
+        self._send_json(200, payload)
 
-Important rules:
-- Write authentically. No cringe corporate-speak or overused phrases.
-- Don't use excessive emojis. 1-2 max per post if any.
-- No hashtags on X/Twitter unless specifically asked.
-- Make content that people actually want to engage with.
-- Return ONLY the content text, no explanations or meta-commentary."""
+    def _stream_fan_out(self, results, meta):
+        """Send each fan-out variation as a server-sent event as soon as its call finishes."""
+        self._start_events()
 
-    def _call_openai(self, api_key, system_prompt, user_prompt):
-        url = 'https://api.openai.com/v1/chat/completions'
+        posts, errors = [], []
+        try:
+            for result in results:
+                if result.get('error'):
+                    errors.append(result['error'])
+                    continue
+                text = split_variations(result['content'])[0]
+                self._send_event('variation', {'index': len(posts), 'text': text})
+                posts.append(text)
+        except (BrokenPipeError, ConnectionResetError):
+            return  # The browser went away
 
-        headers = {
-            'Content-Type': 'application/json',
-            'Authorization': f'Bearer {api_key}'
-        }
+        if not posts:
+            self._send_event('error', {'success': False, 'error': errors[0] if errors else 'No content generated'})
+            return
+        payload = {'success': True, 'content': posts[0], 'posts': posts, 'failed': len(errors), **meta}
+        if not errors:
+            self._remember(payload)
+        self._send_event('done', payload)
 
+    def _chat_payload(self, prompt_prefix, user_prompt, stream=False):
         payload = {
             'model': 'gpt-4o',
-            'messages': [
-                {'role': 'system', 'content': system_prompt},
-                {'role': 'user', 'content': user_prompt}
-            ],
+            'messages': prompt_prefix.messages(user_prompt),
+            'prompt_cache_key': prompt_prefix.cache_key,
             'temperature': 0.8,
             'max_tokens': 1000
         }
+        if stream:
+            payload['stream'] = True
+        return payload
 
+    def _open_openai_stream(self, api_key, prompt_prefix, user_prompt):
+        """Start a streamed completion. Returns (response, None) or (None, error message)."""
         try:
-            req = urllib.request.Request(
-                url,
-                data=json.dumps(payload).encode('utf-8'),
-                headers=headers,
-                method='POST'
+            response = openai_api.post(
+                '/chat/completions', api_key,
+                json=self._chat_payload(prompt_prefix, user_prompt, stream=True),
+                stream=True
             )
+            if response.status_code != 200:
+                return None, error_message(response)
+            return response, None
+        except TIMEOUT_ERRORS:
+            return None, 'OpenAI request timed out'
+        except CONNECTION_ERRORS as e:
+            return None, f'Network error: {str(e)}'
+        except Exception as e:
+            return None, f'Error: {str(e)}'
+
+    def _iter_stream_deltas(self, response):
+        """Yield the content deltas of a streamed completion's SSE lines."""
+        for line in response.iter_lines():
+            line = line.decode('utf-8').strip()
+            if not line.startswith('data:'):
+                continue
+            chunk = line[len('data:'):].strip()
+            if chunk == '[DONE]':
+                return
+            choices = json.loads(chunk).get('choices') or [{}]
+            content = choices[0].get('delta', {}).get('content')
+            if content:
+                yield content
 
-            with urllib.request.urlopen(req, timeout=30) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                content = result['choices'][0]['message']['content']
-                return {'content': content.strip()}
+    def _call_openai(self, api_key, prompt_prefix, user_prompt, timeout=None):
+        try:
+            response = openai_api.post(
+                '/chat/completions', api_key,
+                json=self._chat_payload(prompt_prefix, user_prompt),
+                timeout=timeout
+            )
+            if response.status_code != 200:
+                return {'error': error_message(response)}
+            content = response.json()['choices'][0]['message']['content']
+            return {'content': content.strip()}
 
-        except urllib.error.HTTPError as e:
-            error_body = e.read().decode('utf-8')
-            return {'error': f'OpenAI API error: {error_body}'}
-        except urllib.error.URLError as e:
+        except TIMEOUT_ERRORS:
+            return {'error': 'OpenAI request timed out'}
+        except CONNECTION_ERRORS as e:
             return {'error': f'Network error: {str(e)}'}
         except Exception as e:
             return {'error': f'Error: {str(e)}'}
@@ -1,12 +1,34 @@
 from http.server import BaseHTTPRequestHandler
+import io
 import json
 import os
-import base64
 import random
+import hashlib
+import tempfile
 import urllib.request
 import urllib.error
-import io
+import sys
 from pathlib import Path
+from urllib.parse import parse_qs, urlparse
+
+from PIL import Image
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _image_stream import extract_b64_field, iter_chunks
+from _multipart import MultipartEncoder
+from _reference_image import prepare_reference, content_hash, ReferenceImageError
+from _blob_store import get_blob_store, blob_urls_enabled
+from _image_jobs import start_job, get_job_store, job_status, jobs_enabled
+
+
+# Uploaded reference images stay in memory up to this size, then spill to /tmp
+REFERENCE_SPOOL_SIZE = 1024 * 1024
+
+# Generated images (1.5-2.6 MB) likewise spill to /tmp before going to the blob store
+IMAGE_SPOOL_SIZE = 1024 * 1024
+
+# Longest side of the JPEG thumbnails stored next to each image in 'url' mode
+THUMBNAIL_SIZE = 512
 
 
 # ============================================
@@ -93,6 +115,12 @@ CAMERA_EFFECTS = [
 ]
 
 
+def _openai_url(path):
+    """OpenAI API URL, honouring OPENAI_BASE_URL (e.g. a local stand-in server for load tests)."""
+    base = os.environ.get('OPENAI_BASE_URL', 'https://api.openai.com/v1').rstrip('/')
+    return f'{base}{path}'
+
+
 # ============================================
 # Load the Mutant Ape reference image bytes
 # ============================================
@@ -117,73 +145,200 @@ def _load_mutant_ape_bytes():
     return None
 
 
-def _decode_data_url(data_url):
-    """Decode a base64 data URL (data:image/png;base64,...) to raw bytes."""
-    if ',' in data_url:
-        encoded = data_url.split(',', 1)[1]
-    else:
-        encoded = data_url
-    return base64.b64decode(encoded)
+def publish_image(image, digest):
+    """Store a generated PNG and its thumbnail under content-hashed names.
+
+    image: binary file object holding the PNG; digest: its SHA-256 hex digest.
+    Returns (image_url, thumbnail_url).
+    """
+    store = get_blob_store()
+    name = digest[:32]
+    image_url = store.put(f'images/{name}.png', image, 'image/png')
+
+    image.seek(0)
+    with Image.open(image) as img:
+        img.draft('RGB', (THUMBNAIL_SIZE, THUMBNAIL_SIZE))
+        thumb = img.convert('RGB')
+        thumb.thumbnail((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.LANCZOS)
+        out = io.BytesIO()
+        thumb.save(out, format='JPEG', quality=82, optimize=True)
+    thumbnail_url = store.put(f'thumbs/{name}.jpg', out.getvalue(), 'image/jpeg')
+    return image_url, thumbnail_url
+
+
+def image_url(document):
+    """URL of the first image in an OpenAI images response that has no b64_json."""
+    try:
+        items = json.loads(document).get('data') or []
+    except (ValueError, AttributeError):
+        return None
+    return next((item['url'] for item in items if isinstance(item, dict) and item.get('url')), None)
+
+
+def read_image(upstream, write):
+    """Decode the image from an OpenAI images response into write(), chunk by chunk.
+
+    The base64 image is decoded as it streams in; an image only returned as a
+    URL is downloaded instead. Returns False if there was no image.
+    """
+    document, written = extract_b64_field(iter_chunks(upstream), write, field='b64_json')
+    if written:
+        return True
+    url = image_url(document)
+    if not url:
+        return False
+    with urllib.request.urlopen(url, timeout=120) as remote:
+        for chunk in iter_chunks(remote):
+            write(chunk)
+    return True
+
+
+def store_image(upstream):
+    """Decode the image from OpenAI into the blob store.
+
+    Returns (image_url, thumbnail_url), or None if there was no image.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=IMAGE_SPOOL_SIZE) as image:
+        digest = hashlib.sha256()
+
+        def write(png_chunk):
+            digest.update(png_chunk)
+            image.write(png_chunk)
+
+        if not read_image(upstream, write):
+            return None
+        return publish_image(image, digest.hexdigest())
 
 
-def _build_multipart(fields, files):
-    """Build a multipart/form-data request body manually.
+def url_payload(full_prompt, image_url, thumbnail_url):
+    """The /api/image response for an image in the blob store."""
+    return {
+        'success': True,
+        'images': [image_url],
+        'thumbnails': [thumbnail_url],
+        'revised_prompt': '',
+        'enhanced_prompt': full_prompt,
+        'vision_description': '',
+    }
 
-    fields: dict of {name: value} for text fields
-    files: list of (field_name, filename, content_bytes, content_type)
-    Returns (content_type_header, body_bytes)
+
+def _job_key(prompt, art_style, size, quality, image_digest):
+    """Key under which identical in-flight async requests share one job.
+
+    Built from the request's own inputs rather than full_prompt, whose
+    texture, lighting and camera are picked at random per request.
     """
-    boundary = '----WebKitFormBoundary7MA4YWxkTrZu0gW'
-    parts = []
-
-    for key, value in fields.items():
-        parts.append(f'--{boundary}\r\n'.encode())
-        parts.append(f'Content-Disposition: form-data; name="{key}"\r\n\r\n'.encode())
-        parts.append(f'{value}\r\n'.encode())
-
-    for field_name, filename, content_bytes, content_type in files:
-        parts.append(f'--{boundary}\r\n'.encode())
-        parts.append(
-            f'Content-Disposition: form-data; name="{field_name}"; filename="{filename}"\r\n'.encode()
-        )
-        parts.append(f'Content-Type: {content_type}\r\n\r\n'.encode())
-        parts.append(content_bytes)
-        parts.append(b'\r\n')
+    raw = json.dumps([prompt.strip(), art_style, size, quality, image_digest])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
 
-    parts.append(f'--{boundary}--\r\n'.encode())
+def open_gpt_image(api_key, prompt, image, size, quality):
+    """Start a gpt-image-1 /images/edits request.
+
+    This model actually SEES the reference image and generates based on it,
+    unlike DALL-E 3 which only takes text prompts.
+
+    image: PNG bytes or a binary file object, streamed into the upload.
+    Returns (response, error). The response body is left unread so the
+    caller can stream the image out of it.
+    """
+    url = _openai_url('/images/edits')
+
+    # Build multipart form data
+    fields = {
+        'model': 'gpt-image-1',
+        'prompt': prompt,
+        'size': size,
+        'quality': quality,
+        'n': '1',
+    }
+
+    files = [
+        ('image', 'reference.png', image, 'image/png'),
+    ]
 
-    body = b''.join(parts)
-    content_type = f'multipart/form-data; boundary={boundary}'
-    return content_type, body
+    body = MultipartEncoder(fields, files)
+
+    headers = {
+        'Content-Type': body.content_type,
+        'Content-Length': str(body.content_length),
+        'Authorization': f'Bearer {api_key}'
+    }
+
+    try:
+        req = urllib.request.Request(
+            url,
+            data=body,
+            headers=headers,
+            method='POST'
+        )
+        return urllib.request.urlopen(req, timeout=120), None
+
+    except urllib.error.HTTPError as e:
+        error_body = e.read().decode('utf-8')
+        try:
+            err_data = json.loads(error_body)
+            err_msg = err_data.get('error', {}).get('message', error_body)
+        except Exception:
+            err_msg = error_body
+        return None, f'GPT Image error: {err_msg}'
+    except urllib.error.URLError as e:
+        return None, f'Network error: {str(e)}'
+    except Exception as e:
+        return None, f'Error: {str(e)}'
 
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        if 'job' in params:
+            job = get_job_store().get(params['job'][0])
+            if job is None:
+                self._send_json(404, {'success': False, 'error': 'Unknown job'})
+            else:
+                self._send_json(200, job_status(job))
+            return
+
         self.send_response(200)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
         api_key = os.environ.get('OPENAI_API_KEY', '')
         has_key = 'yes' if api_key else 'no'
-        response = {'status': 'ok', 'endpoint': 'image', 'api_key_configured': has_key}
+        response = {'status': 'ok', 'endpoint': 'image', 'api_key_configured': has_key,
+                    'url_mode': blob_urls_enabled(), 'async_jobs': jobs_enabled()}
         self.wfile.write(json.dumps(response).encode())
 
     def do_POST(self):
+        reference = tempfile.SpooledTemporaryFile(max_size=REFERENCE_SPOOL_SIZE)
+        # Set once the status line and headers are out, see _start_response()
+        self.response_started = False
         try:
             api_key = os.environ.get('OPENAI_API_KEY')
             if not api_key:
                 self._send_json(500, {'success': False, 'error': 'OPENAI_API_KEY not configured'})
                 return
 
+            # The uploaded reference_image data URL is decoded into the spool as
+            # it arrives; only the small remaining fields are parsed as JSON
             content_length = int(self.headers.get('Content-Length', 0))
-            body = self.rfile.read(content_length)
+            body, reference_size = extract_b64_field(
+                iter_chunks(self.rfile, limit=content_length), reference.write,
+                field='reference_image', value_prefix=b','
+            )
             data = json.loads(body) if body else {}
 
             prompt = data.get('prompt', '')
             style = data.get('style', 'realistic')
             aspect_ratio = data.get('aspect_ratio', '1:1')
             quality = data.get('quality', 'standard')
-            reference_image = data.get('reference_image', '')  # base64 data URL from frontend
+            # 'json' returns data URLs (default), 'png' streams the raw image bytes,
+            # 'url' stores the image (see _blob_store.py) and returns its URL
+            response_format = data.get('response_format', 'json')
+            if response_format == 'url' and not blob_urls_enabled():
+                response_format = 'json'  # URLs from this instance's /tmp would 404 elsewhere
+            # Answer with a job id right away and let execution/image_worker.py render it
+            run_async = bool(data.get('async'))
 
             if not prompt:
                 self._send_json(400, {'success': False, 'error': 'Prompt is required'})
@@ -217,34 +372,55 @@ class handler(BaseHTTPRequestHandler):
                 f"faithful to the reference image. Do not add or remove any features."
             )
 
-            # Get image bytes - user upload takes priority, otherwise use default Mutant Ape
-            if reference_image:
-                image_bytes = _decode_data_url(reference_image)
-            else:
-                image_bytes = _load_mutant_ape_bytes()
+            # Get the reference image - user upload takes priority, otherwise use default Mutant Ape
+            image = reference if reference_size else _load_mutant_ape_bytes()
 
-            if not image_bytes:
+            if not image:
                 self._send_json(500, {'success': False, 'error': 'No reference image available. Please upload an image.'})
                 return
 
+            # A PNG that fits is streamed as uploaded; anything else is downscaled
+            # to the output size as a compact PNG, cached by content hash
+            try:
+                image = prepare_reference(image, size)
+            except ReferenceImageError as e:
+                self._send_json(400, {'success': False, 'error': str(e)})
+                return
+
+            # Only while a worker and shared stores are there to run it; otherwise render now
+            if run_async and jobs_enabled():
+                self._submit_job(prompt, art_style, full_prompt, image, size, gpt_quality)
+                return
+
             # Generate with gpt-image-1 via /images/edits (can see the reference image)
-            result = self._call_gpt_image(api_key, full_prompt, image_bytes, size, gpt_quality)
+            upstream, error = open_gpt_image(api_key, full_prompt, image, size, gpt_quality)
 
-            if result.get('error'):
-                self._send_json(500, {'success': False, 'error': result['error']})
-            else:
-                self._send_json(200, {
-                    'success': True,
-                    'images': result['images'],
-                    'revised_prompt': '',
-                    'enhanced_prompt': full_prompt,
-                    'vision_description': '',
-                })
+            if error:
+                self._send_json(500, {'success': False, 'error': error})
+                return
+
+            with upstream:
+                if response_format == 'png':
+                    streamed = self._stream_png(upstream)
+                elif response_format == 'url':
+                    streamed = self._send_urls(upstream, full_prompt)
+                else:
+                    streamed = self._stream_json(upstream, full_prompt)
+
+            if not streamed:
+                self._send_json(500, {'success': False, 'error': 'GPT Image error: no image data in response'})
 
         except json.JSONDecodeError:
             self._send_json(400, {'success': False, 'error': 'Invalid JSON'})
         except Exception as e:
-            self._send_json(500, {'success': False, 'error': str(e)})
+            if self.response_started:
+                # Part of a streamed image is already out; a second response would
+                # be appended to it, so cut the connection to show it's incomplete
+                self.close_connection = True
+            else:
+                self._send_json(500, {'success': False, 'error': str(e)})
+        finally:
+            reference.close()
 
     def do_OPTIONS(self):
         self.send_response(200)
@@ -253,70 +429,82 @@ class handler(BaseHTTPRequestHandler):
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
 
-    def _send_json(self, code, data):
+    def _start_response(self, code, content_type):
         self.send_response(code)
-        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Type', content_type)
         self.send_header('Access-Control-Allow-Origin', '*')
         self.end_headers()
+        self.response_started = True
+
+    def _send_json(self, code, data):
+        self._start_response(code, 'application/json')
         self.wfile.write(json.dumps(data).encode())
 
-    def _call_gpt_image(self, api_key, prompt, image_bytes, size, quality):
-        """Generate image using gpt-image-1 /images/edits endpoint.
+    def _stream_json(self, upstream, full_prompt):
+        """Relay the base64 image from OpenAI into our JSON response as a data URL.
 
-        This model actually SEES the reference image and generates based on it,
-        unlike DALL-E 3 which only takes text prompts.
+        The base64 text is copied through chunk by chunk without being decoded
+        or buffered, so memory stays constant regardless of image size. An
+        image OpenAI only returns as a URL is passed on as that URL.
+        Returns False if no image was found (nothing has been written yet).
         """
-        url = 'https://api.openai.com/v1/images/edits'
-
-        # Build multipart form data
-        fields = {
-            'model': 'gpt-image-1',
-            'prompt': prompt,
+        def write(b64_chunk):
+            if not self.response_started:
+                self._start_response(200, 'application/json')
+                self.wfile.write(b'{"success": true, "images": ["data:image/png;base64,')
+            self.wfile.write(b64_chunk)
+
+        document, written = extract_b64_field(iter_chunks(upstream), write, field='b64_json', decode=False)
+        tail = {
+            'revised_prompt': '',
+            'enhanced_prompt': full_prompt,
+            'vision_description': '',
+        }
+        if not written:
+            url = image_url(document)
+            if not url:
+                return False
+            self._send_json(200, {'success': True, 'images': [url], **tail})
+            return True
+
+        self.wfile.write(b'"], ' + json.dumps(tail)[1:].encode())
+        return True
+
+    def _stream_png(self, upstream):
+        """Decode the base64 image from OpenAI straight into a PNG response."""
+        def write(png_chunk):
+            if not self.response_started:
+                self._start_response(200, 'image/png')
+            self.wfile.write(png_chunk)
+
+        return read_image(upstream, write)
+
+    def _send_urls(self, upstream, full_prompt):
+        """Store the image from OpenAI and send its URLs.
+
+        The response is a few hundred bytes, and the browser fetches (and
+        caches) the image and thumbnail separately.
+        """
+        urls = store_image(upstream)
+        if urls is None:
+            return False
+        self._send_json(200, url_payload(full_prompt, *urls))
+        return True
+
+    def _submit_job(self, prompt, art_style, full_prompt, image, size, quality):
+        """Queue the generation for the image worker, or join the identical job in flight, and send its id."""
+        digest = content_hash(image)
+        reference_url = get_blob_store().put(f'refs/{digest}.png', image, 'image/png')
+        job, created = start_job(_job_key(prompt, art_style, size, quality, digest), {
+            'full_prompt': full_prompt,
             'size': size,
             'quality': quality,
-            'n': '1',
-        }
-
-        files = [
-            ('image', 'reference.png', image_bytes, 'image/png'),
-        ]
-
-        content_type, body = _build_multipart(fields, files)
-
-        headers = {
-            'Content-Type': content_type,
-            'Authorization': f'Bearer {api_key}'
-        }
-
-        try:
-            req = urllib.request.Request(
-                url,
-                data=body,
-                headers=headers,
-                method='POST'
-            )
-
-            with urllib.request.urlopen(req, timeout=120) as response:
-                result = json.loads(response.read().decode('utf-8'))
-                images = []
-                for item in result.get('data', []):
-                    # gpt-image-1 returns base64, convert to data URL
-                    b64 = item.get('b64_json', '')
-                    if b64:
-                        images.append(f'data:image/png;base64,{b64}')
-                    elif item.get('url'):
-                        images.append(item['url'])
-                return {'images': images}
-
-        except urllib.error.HTTPError as e:
-            error_body = e.read().decode('utf-8')
-            try:
-                err_data = json.loads(error_body)
-                err_msg = err_data.get('error', {}).get('message', error_body)
-            except Exception:
-                err_msg = error_body
-            return {'error': f'GPT Image error: {err_msg}'}
-        except urllib.error.URLError as e:
-            return {'error': f'Network error: {str(e)}'}
-        except Exception as e:
-            return {'error': f'Error: {str(e)}'}
+            'reference_url': reference_url,
+        })
+        self._send_json(202, {
+            'success': True,
+            'job_id': job['id'],
+            'status': job['status'],
+            'deduplicated': not created,
+            'poll': f"/api/image?job={job['id']}",
+        })
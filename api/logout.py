@@ -2,35 +2,12 @@
 X OAuth 2.0 Logout Endpoint - Revokes tokens and clears session
 """
 import os
-import base64
-import requests
+import sys
 from http.server import BaseHTTPRequestHandler
-from http.cookies import SimpleCookie
-from cryptography.fernet import Fernet
 
-
-def get_cookie(cookie_header, name):
-    """Extract a cookie value from the Cookie header."""
-    if not cookie_header:
-        return None
-    cookie = SimpleCookie()
-    cookie.load(cookie_header)
-    if name in cookie:
-        return cookie[name].value
-    return None
-
-
-def decrypt_token(encrypted_token, key):
-    """Decrypt a token."""
-    try:
-        cipher = Fernet(key.encode() if isinstance(key, str) else key)
-        return cipher.decrypt(encrypted_token.encode()).decode()
-    except Exception:
-        # Fallback: try base64 decode
-        try:
-            return base64.b64decode(encrypted_token).decode()
-        except Exception:
-            return None
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _x_client import x_api
+from _session import parse_cookies, decrypt_token
 
 
 class handler(BaseHTTPRequestHandler):
@@ -38,25 +15,18 @@ class handler(BaseHTTPRequestHandler):
         app_url = os.environ.get('APP_URL', 'https://kram-content-dashboard.vercel.app')
         client_id = os.environ.get('X_CLIENT_ID')
         client_secret = os.environ.get('X_CLIENT_SECRET')
-        encryption_key = os.environ.get('ENCRYPTION_KEY')
 
         # Get tokens from cookies
-        cookie_header = self.headers.get('Cookie', '')
-        encrypted_access = get_cookie(cookie_header, 'x_access_token')
+        cookies = parse_cookies(self.headers)
+        encrypted_access = cookies.get('x_access_token')
 
         # Try to revoke the token with X API
         if encrypted_access and client_id:
-            if encryption_key:
-                access_token = decrypt_token(encrypted_access, encryption_key)
-            else:
-                try:
-                    access_token = base64.b64decode(encrypted_access).decode()
-                except Exception:
-                    access_token = None
+            access_token = decrypt_token(encrypted_access)
 
             if access_token:
                 try:
-                    revoke_url = "https://api.twitter.com/2/oauth2/revoke"
+                    revoke_url = "/2/oauth2/revoke"
                     revoke_data = {
                         'token': access_token,
                         'token_type_hint': 'access_token',
@@ -67,7 +37,7 @@ class handler(BaseHTTPRequestHandler):
                     if client_secret:
                         auth = (client_id, client_secret)
 
-                    requests.post(
+                    x_api.post(
                         revoke_url,
                         data=revoke_data,
                         auth=auth,
@@ -83,6 +53,7 @@ class handler(BaseHTTPRequestHandler):
         # Clear all auth cookies
         self.send_header('Set-Cookie', 'x_access_token=; Path=/; Max-Age=0')
         self.send_header('Set-Cookie', 'x_refresh_token=; Path=/; Max-Age=0')
+        self.send_header('Set-Cookie', 'x_token_meta=; Path=/; Max-Age=0')
         self.send_header('Set-Cookie', 'x_user=; Path=/; Max-Age=0')
 
         self.end_headers()
@@ -1,102 +1,129 @@
 """
 Analytics Profile Endpoint - Fetches user's profile information
+
+Responses are cached per user (see _response_cache.py). Pass ?refresh=1 to
+bypass the cache. When X is rate limited, times out or can't be reached, a
+cached profile is served marked stale; without one the response is 429,
+504 or 502.
 """
 import os
 import json
-import base64
-import requests
+import sys
 from http.server import BaseHTTPRequestHandler
-from http.cookies import SimpleCookie
-from cryptography.fernet import Fernet
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _x_client import x_api, RateLimited, TIMEOUT_ERRORS, CONNECTION_ERRORS
+from _session import require_user
+from _response_cache import ResponseCache, STALE, user_key, etag_for, etag_matches, wants_fresh
+
+
+PROFILE_FIELDS = 'profile_image_url,username,name,description,public_metrics,created_at,verified'
 
+# Profiles change rarely, cache them longer than tweets
+profile_cache = ResponseCache('profile', ttl=int(os.environ.get('PROFILE_CACHE_TTL', 300)))
+
+
+def fetch_profile(session):
+    """Fetch and format the user's profile. Returns (status_code, profile or None)."""
+    user_response = x_api.get(
+        "/2/users/me",
+        headers=session.auth_headers,
+        params={'user.fields': PROFILE_FIELDS}
+    )
+
+    if user_response.status_code == 401 and session.refresh():
+        # Token was revoked or expired early, retry once with a fresh one
+        user_response = x_api.get(
+            "/2/users/me",
+            headers=session.auth_headers,
+            params={'user.fields': PROFILE_FIELDS}
+        )
 
-def get_cookie(cookie_header, name):
-    """Extract a cookie value from the Cookie header."""
-    if not cookie_header:
-        return None
-    cookie = SimpleCookie()
-    cookie.load(cookie_header)
-    if name in cookie:
-        return cookie[name].value
-    return None
+    if user_response.status_code != 200:
+        return user_response.status_code, None
 
+    user_data = user_response.json().get('data', {})
 
-def decrypt_token(encrypted_token, key):
-    """Decrypt a token."""
-    try:
-        cipher = Fernet(key.encode() if isinstance(key, str) else key)
-        return cipher.decrypt(encrypted_token.encode()).decode()
-    except Exception:
-        try:
-            return base64.b64decode(encrypted_token).decode()
-        except Exception:
-            return None
+    # Format response
+    return 200, {
+        'id': user_data.get('id'),
+        'username': user_data.get('username'),
+        'name': user_data.get('name'),
+        'description': user_data.get('description'),
+        'profile_image_url': user_data.get('profile_image_url', '').replace('_normal', '_400x400'),  # Get larger image
+        'verified': user_data.get('verified', False),
+        'created_at': user_data.get('created_at'),
+        'metrics': user_data.get('public_metrics', {})
+    }
 
 
 class handler(BaseHTTPRequestHandler):
     def do_GET(self):
-        # Get encryption key and tokens
-        encryption_key = os.environ.get('ENCRYPTION_KEY')
+        params = parse_qs(urlparse(self.path).query)
 
-        cookie_header = self.headers.get('Cookie', '')
-        encrypted_access = get_cookie(cookie_header, 'x_access_token')
-
-        if not encrypted_access:
-            self.send_response(401)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Not authenticated'}).encode())
+        session, error = require_user(self.headers)
+        if error:
+            self._send_json(401, error)
             return
+        self.session = session
+
+        cache_key = user_key(session)
+        profile, cache_state = None, None
+        # Also kept with ?refresh=1, as the fallback when X can't be reached
+        cached, cached_state = profile_cache.get(cache_key)
+        if not wants_fresh(self.headers, params):
+            profile, cache_state = cached, cached_state
 
-        # Decrypt access token
-        if encryption_key:
-            access_token = decrypt_token(encrypted_access, encryption_key)
-        else:
-            # No encryption key set - tokens are base64 encoded
+        if cache_state == STALE:
+            background = session.detached()
+            profile_cache.revalidate(cache_key, lambda: fetch_profile(background)[1])
+
+        if profile is None:
+            fetch_error = None
             try:
-                access_token = base64.b64decode(encrypted_access).decode()
-            except Exception:
-                access_token = None
-
-        if not access_token:
-            self.send_response(401)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Invalid token'}).encode())
-            return
+                status_code, profile = fetch_profile(session)
+            except RateLimited as e:
+                fetch_error = (429, {'error': str(e), 'retry_after': e.retry_after})
+            except TIMEOUT_ERRORS:
+                fetch_error = (504, {'error': 'Request to X API timed out'})
+            except CONNECTION_ERRORS:
+                fetch_error = (502, {'error': 'Failed to connect to X API'})
 
-        # Fetch user profile with extended fields
-        user_response = requests.get(
-            "https://api.twitter.com/2/users/me",
-            headers={'Authorization': f'Bearer {access_token}'},
-            params={
-                'user.fields': 'profile_image_url,username,name,description,public_metrics,created_at,verified'
-            }
-        )
+            if fetch_error:
+                if cached is None:
+                    self._send_json(*fetch_error)
+                    return
+                profile, cache_state = cached, STALE
+            elif status_code != 200:
+                self._send_json(status_code, {'error': 'Failed to fetch profile'})
+                return
+            else:
+                profile_cache.set(cache_key, profile)
+                cache_state = 'miss'
 
-        if user_response.status_code != 200:
-            self.send_response(user_response.status_code)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Failed to fetch profile'}).encode())
-            return
+        self._send_json(200, profile, cache_state)
+
+    def _send_json(self, code, data, cache_state=None):
+        """Send a JSON response, including any refreshed auth cookies.
+
+        Cacheable responses (cache_state set) get ETag/Cache-Control headers and
+        become a bodiless 304 when the browser already has the same ETag.
+        """
+        body = json.dumps(data).encode()
+        etag = etag_for(body) if cache_state else None
+        if etag and etag_matches(self.headers, etag):
+            code, body = 304, b''
 
-        user_data = user_response.json().get('data', {})
-
-        # Format response
-        profile = {
-            'id': user_data.get('id'),
-            'username': user_data.get('username'),
-            'name': user_data.get('name'),
-            'description': user_data.get('description'),
-            'profile_image_url': user_data.get('profile_image_url', '').replace('_normal', '_400x400'),  # Get larger image
-            'verified': user_data.get('verified', False),
-            'created_at': user_data.get('created_at'),
-            'metrics': user_data.get('public_metrics', {})
-        }
-
-        self.send_response(200)
+        self.send_response(code)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', profile_cache.cache_control())
+            self.send_header('Vary', 'Cookie')
+            self.send_header('X-Cache', cache_state.upper())
+        if getattr(self, 'session', None):
+            self.session.send_cookies(self)
         self.end_headers()
-        self.wfile.write(json.dumps(profile).encode())
+        self.wfile.write(body)
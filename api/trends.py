@@ -0,0 +1,117 @@
+"""
+Trends Endpoint - Serves the precomputed trend index
+
+GET /api/trends[?window=24h|7d|30d][&category=Crypto]
+    Returns the window's rising topics as a list, in the shape trends.html renders.
+
+GET /api/trends?view=full[&window=7d]
+    Returns the whole window: topics, rising terms, hashtags, emojis and topic
+    clusters, with post counts.
+
+The index is built offline by execution/build_trends.py from our synced
+tweets and the analytics CSV, committed, and bundled with this function
+(vercel.json includeFiles); until then this returns 503. Requests only
+read it from a TTL cache (see _response_cache.py), so a page load never
+tokenizes anything.
+"""
+import os
+import json
+import sys
+from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _session import require_user
+from _response_cache import ResponseCache, STALE, etag_for, etag_matches
+
+
+TRENDS_INDEX = os.environ.get(
+    'TRENDS_INDEX',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.tmp', 'trends', 'trends_index.json')
+)
+
+# The index only changes when build_trends.py runs, so cache it for a while
+trends_cache = ResponseCache('trends', ttl=int(os.environ.get('TRENDS_CACHE_TTL', 600)))
+
+
+def load_index():
+    """Read the trend index from disk, or None if it has not been built."""
+    try:
+        with open(TRENDS_INDEX, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+class handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+
+        session, error = require_user(self.headers)
+        if error:
+            self._send_json(401, error)
+            return
+        self.session = session
+
+        index, cache_state = trends_cache.get('index')
+        if cache_state == STALE:
+            trends_cache.revalidate('index', load_index)
+        if index is None:
+            index = load_index()
+            if index is None:
+                self._send_json(503, {'error': 'Trend index has not been built, run execution/build_trends.py'})
+                return
+            trends_cache.set('index', index)
+            cache_state = 'miss'
+
+        window_name = params.get('window', [index.get('default_window')])[0]
+        window = index.get('windows', {}).get(window_name)
+        if window is None:
+            self._send_json(400, {
+                'error': f'Unknown window: {window_name}',
+                'windows': list(index.get('windows', {}))
+            })
+            return
+
+        if params.get('view', [None])[0] == 'full':
+            self._send_json(200, {
+                'window': window_name,
+                'reference_date': index.get('reference_date'),
+                'generated_at': index.get('generated_at'),
+                **window
+            }, cache_state)
+            return
+
+        topics = window.get('topics', [])
+        category = params.get('category', [None])[0]
+        if category and category != 'All':
+            topics = [t for t in topics if t.get('category') == category]
+        self._send_json(200, topics, cache_state)
+
+    def do_OPTIONS(self):
+        """Handle CORS preflight requests."""
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.send_header('Access-Control-Max-Age', '86400')
+        self.end_headers()
+
+    def _send_json(self, code, data, cache_state=None):
+        """Send a JSON response, with ETag/Cache-Control on cacheable ones."""
+        body = json.dumps(data).encode()
+        etag = etag_for(body) if cache_state else None
+        if etag and etag_matches(self.headers, etag):
+            code, body = 304, b''
+
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', trends_cache.cache_control())
+            self.send_header('X-Cache', cache_state.upper())
+        if getattr(self, 'session', None):
+            self.session.send_cookies(self)
+        self.end_headers()
+        self.wfile.write(body)
@@ -1,63 +1,76 @@
 """
 Analytics Tweets Endpoint - Fetches user's tweets with engagement metrics
+
+Tweets are synced incrementally into a local store (see _tweet_store.py) and
+max_results is read from it. Syncs only page back through the 3200 tweets X
+keeps per timeline, but the store keeps older tweets it already has. Syncs are
+rate-limited per user by the response cache (see _response_cache.py); pass
+?refresh=1 to force one. When a sync fails (X API error, timeout or
+connection failure) the stored tweets are served marked stale; with nothing
+stored the error is returned (504 for timeouts, 502 for connection errors).
 """
 import os
 import json
-import base64
-import requests
+import sys
 from http.server import BaseHTTPRequestHandler
 from urllib.parse import parse_qs, urlparse
-from http.cookies import SimpleCookie
-from cryptography.fernet import Fernet
-
-
-def get_cookie(cookie_header, name):
-    """Extract a cookie value from the Cookie header."""
-    if not cookie_header:
-        return None
-    cookie = SimpleCookie()
-    cookie.load(cookie_header)
-    if name in cookie:
-        return cookie[name].value
-    return None
-
-
-def decrypt_token(encrypted_token, key):
-    """Decrypt a token."""
-    try:
-        cipher = Fernet(key.encode() if isinstance(key, str) else key)
-        return cipher.decrypt(encrypted_token.encode()).decode()
-    except Exception:
-        try:
-            return base64.b64decode(encrypted_token).decode()
-        except Exception:
-            return None
 
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from _x_client import RateLimited, TIMEOUT_ERRORS, CONNECTION_ERRORS, rate_limits, caller_key
+from _session import require_user, resolve_user_id
+from _response_cache import ResponseCache, STALE, user_key, etag_for, etag_matches, wants_fresh
+from _tweet_store import get_tweet_store, sync_timeline, SyncError
 
-def refresh_access_token(refresh_token, client_id, client_secret):
-    """Refresh the access token using refresh token."""
-    token_url = "https://api.twitter.com/2/oauth2/token"
 
-    token_data = {
-        'grant_type': 'refresh_token',
-        'refresh_token': refresh_token,
-        'client_id': client_id,
-    }
+# Cached value: {'min_tweets': n} - the store was synced with at least n tweets of history
+tweets_cache = ResponseCache('tweets', ttl=int(os.environ.get('TWEETS_CACHE_TTL', 120)))
 
-    auth = None
-    if client_secret:
-        auth = (client_id, client_secret)
+# X only serves the latest 3200 tweets of a timeline
+MAX_HISTORY = 3200
 
-    response = requests.post(
-        token_url,
-        data=token_data,
-        auth=auth,
-        headers={'Content-Type': 'application/x-www-form-urlencoded'}
-    )
+# Below this many timeline calls left in the window, serve stored tweets instead of syncing
+LOW_BUDGET = 2
 
-    if response.status_code == 200:
-        return response.json()
-    return None
+
+def summarize_tweets(tweets):
+    """Score tweets by engagement and build the response payload."""
+    processed_tweets = []
+    for tweet in tweets:
+        metrics = tweet.get('public_metrics', {})
+        engagement = (
+            metrics.get('like_count', 0) +
+            metrics.get('retweet_count', 0) * 2 +
+            metrics.get('reply_count', 0) +
+            metrics.get('quote_count', 0) * 2
+        )
+
+        processed_tweets.append({
+            'id': tweet.get('id'),
+            'text': tweet.get('text'),
+            'created_at': tweet.get('created_at'),
+            'metrics': metrics,
+            'engagement_score': engagement
+        })
+
+    # Sort by engagement score
+    processed_tweets.sort(key=lambda x: x['engagement_score'], reverse=True)
+
+    # Calculate summary stats
+    total_likes = sum(t['metrics'].get('like_count', 0) for t in processed_tweets)
+    total_retweets = sum(t['metrics'].get('retweet_count', 0) for t in processed_tweets)
+    total_replies = sum(t['metrics'].get('reply_count', 0) for t in processed_tweets)
+
+    return {
+        'tweets': processed_tweets,
+        'summary': {
+            'total_tweets': len(processed_tweets),
+            'total_likes': total_likes,
+            'total_retweets': total_retweets,
+            'total_replies': total_replies,
+            'avg_likes': total_likes / len(processed_tweets) if processed_tweets else 0,
+            'avg_retweets': total_retweets / len(processed_tweets) if processed_tweets else 0
+        }
+    }
 
 
 class handler(BaseHTTPRequestHandler):
@@ -65,154 +78,103 @@ class handler(BaseHTTPRequestHandler):
         # Parse query parameters
         parsed = urlparse(self.path)
         params = parse_qs(parsed.query)
-        max_results = params.get('max_results', ['20'])[0]
-
-        # Get encryption key and tokens
-        encryption_key = os.environ.get('ENCRYPTION_KEY')
-        client_id = os.environ.get('X_CLIENT_ID')
-        client_secret = os.environ.get('X_CLIENT_SECRET')
-
-        cookie_header = self.headers.get('Cookie', '')
-        encrypted_access = get_cookie(cookie_header, 'x_access_token')
-        encrypted_refresh = get_cookie(cookie_header, 'x_refresh_token')
-
-        if not encrypted_access:
-            self.send_response(401)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Not authenticated'}).encode())
+        max_results = max(1, int(params.get('max_results', ['20'])[0]))
+        # X can't page back further than MAX_HISTORY, reads from the store can
+        sync_size = min(max_results, MAX_HISTORY)
+
+        session, error = require_user(self.headers)
+        if error:
+            self._send_json(401, error)
             return
+        self.session = session
 
-        # Decrypt access token
-        if encryption_key:
-            access_token = decrypt_token(encrypted_access, encryption_key)
-        else:
-            # No encryption key set - tokens are base64 encoded
-            try:
-                access_token = base64.b64decode(encrypted_access).decode()
-            except Exception:
-                access_token = None
-
-        if not access_token:
-            self.send_response(401)
-            self.send_header('Content-Type', 'application/json')
-            self.end_headers()
-            self.wfile.write(json.dumps({'error': 'Invalid token'}).encode())
+        try:
+            user_id, status_code, error_payload = resolve_user_id(session)
+        except RateLimited as e:
+            user_id, status_code, error_payload = None, 429, {'error': str(e), 'retry_after': e.retry_after}
+        except TIMEOUT_ERRORS:
+            user_id, status_code, error_payload = None, 504, {'error': 'Request to X API timed out'}
+        except CONNECTION_ERRORS:
+            user_id, status_code, error_payload = None, 502, {'error': 'Failed to connect to X API'}
+        if not user_id:
+            self._send_json(status_code, error_payload)
             return
 
-        # First get user ID
-        user_response = requests.get(
-            "https://api.twitter.com/2/users/me",
-            headers={'Authorization': f'Bearer {access_token}'}
-        )
+        store = get_tweet_store()
+        cache_key = user_key(session)
+        cached, cache_state = None, None
+        if not wants_fresh(self.headers, params):
+            cached, cache_state = tweets_cache.get(cache_key)
+            if cached and cached['min_tweets'] < sync_size:
+                cached, cache_state = None, None
 
-        if user_response.status_code == 401 and encrypted_refresh:
-            # Token expired, try to refresh
-            refresh_token = decrypt_token(encrypted_refresh, encryption_key)
-            if refresh_token:
-                new_tokens = refresh_access_token(refresh_token, client_id, client_secret)
-                if new_tokens:
-                    access_token = new_tokens.get('access_token')
-                    user_response = requests.get(
-                        "https://api.twitter.com/2/users/me",
-                        headers={'Authorization': f'Bearer {access_token}'}
-                    )
-
-        if user_response.status_code != 200:
-            self.send_response(user_response.status_code)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
-            try:
-                user_err = user_response.json()
-                err_detail = user_err.get('detail', user_err.get('title', 'Unknown error'))
-            except Exception:
-                err_detail = f"Status {user_response.status_code}"
-            self.wfile.write(json.dumps({'error': f'Failed to get user info: {err_detail}'}).encode())
-            return
+        if cache_state == STALE:
+            synced_size = cached['min_tweets']
+            background = session.detached()
 
-        user_id = user_response.json().get('data', {}).get('id')
+            def revalidate():
+                state = sync_timeline(background, user_id, store, min(synced_size, MAX_HISTORY))
+                return {'min_tweets': MAX_HISTORY if state['history_complete'] else synced_size}
 
-        # Fetch user's tweets with metrics
-        tweets_url = f"https://api.twitter.com/2/users/{user_id}/tweets"
-        tweets_params = {
-            'max_results': min(int(max_results), 100),
-            'tweet.fields': 'public_metrics,created_at,text',
-            'exclude': 'retweets,replies'
-        }
+            tweets_cache.revalidate(cache_key, revalidate)
 
-        tweets_response = requests.get(
-            tweets_url,
-            headers={'Authorization': f'Bearer {access_token}'},
-            params=tweets_params
-        )
+        if cached is None and not wants_fresh(self.headers, params) and self._budget_low(session, store, user_id, sync_size):
+            # Save the remaining budget for other pages, the stored timeline is good enough
+            cached, cache_state = {'min_tweets': sync_size}, 'stale'
 
-        if tweets_response.status_code != 200:
-            self.send_response(tweets_response.status_code)
-            self.send_header('Content-Type', 'application/json')
-            self.send_header('Access-Control-Allow-Origin', '*')
-            self.end_headers()
+        if cached is None:
+            sync_error = None
             try:
-                error_data = tweets_response.json()
-                # Extract meaningful error message from X API response
-                x_error = ''
-                if 'detail' in error_data:
-                    x_error = error_data['detail']
-                elif 'errors' in error_data and len(error_data['errors']) > 0:
-                    x_error = error_data['errors'][0].get('message', '')
-                elif 'title' in error_data:
-                    x_error = error_data['title']
-                error_msg = f"X API error ({tweets_response.status_code}): {x_error}" if x_error else f"X API returned status {tweets_response.status_code}"
-            except Exception:
-                error_msg = f"X API returned status {tweets_response.status_code}"
-                error_data = {}
-            self.wfile.write(json.dumps({'error': error_msg, 'details': error_data}).encode())
-            return
-
-        tweets_data = tweets_response.json()
-        tweets = tweets_data.get('data', [])
-
-        # Process and sort by engagement
-        processed_tweets = []
-        for tweet in tweets:
-            metrics = tweet.get('public_metrics', {})
-            engagement = (
-                metrics.get('like_count', 0) +
-                metrics.get('retweet_count', 0) * 2 +
-                metrics.get('reply_count', 0) +
-                metrics.get('quote_count', 0) * 2
-            )
-
-            processed_tweets.append({
-                'id': tweet.get('id'),
-                'text': tweet.get('text'),
-                'created_at': tweet.get('created_at'),
-                'metrics': metrics,
-                'engagement_score': engagement
-            })
-
-        # Sort by engagement score
-        processed_tweets.sort(key=lambda x: x['engagement_score'], reverse=True)
-
-        # Calculate summary stats
-        total_likes = sum(t['metrics'].get('like_count', 0) for t in processed_tweets)
-        total_retweets = sum(t['metrics'].get('retweet_count', 0) for t in processed_tweets)
-        total_replies = sum(t['metrics'].get('reply_count', 0) for t in processed_tweets)
-
-        result = {
-            'tweets': processed_tweets,
-            'summary': {
-                'total_tweets': len(processed_tweets),
-                'total_likes': total_likes,
-                'total_retweets': total_retweets,
-                'total_replies': total_replies,
-                'avg_likes': total_likes / len(processed_tweets) if processed_tweets else 0,
-                'avg_retweets': total_retweets / len(processed_tweets) if processed_tweets else 0
-            }
+                state = sync_timeline(session, user_id, store, sync_size, force=wants_fresh(self.headers, params))
+                covered = MAX_HISTORY if state['history_complete'] else max(sync_size, store.count(user_id))
+                tweets_cache.set(cache_key, {'min_tweets': covered})
+                cache_state = 'miss'
+            except SyncError as e:
+                sync_error = (e.status_code, e.payload)
+            except TIMEOUT_ERRORS:
+                sync_error = (504, {'error': 'Request to X API timed out'})
+            except CONNECTION_ERRORS:
+                sync_error = (502, {'error': 'Failed to connect to X API'})
+
+            if sync_error:
+                if not store.count(user_id):
+                    self._send_json(*sync_error)
+                    return
+                # Serve what is already stored rather than failing (e.g. on a 429 or a timeout)
+                cache_state = 'stale'
+
+        result = summarize_tweets(store.tweets(user_id, max_results))
+        state = store.sync_state(user_id)
+        result['sync'] = {
+            'stored_tweets': store.count(user_id),
+            'history_complete': state['history_complete'],
         }
+        self._send_json(200, result, cache_state)
+
+    def _budget_low(self, session, store, user_id, sync_size):
+        remaining = rate_limits.remaining(caller_key(session.auth_headers), 'GET /2/users/:id/tweets')
+        return remaining is not None and remaining < LOW_BUDGET and store.count(user_id) >= sync_size
+
+    def _send_json(self, code, data, cache_state=None):
+        """Send a JSON response, including any refreshed auth cookies.
+
+        Cacheable responses (cache_state set) get ETag/Cache-Control headers and
+        become a bodiless 304 when the browser already has the same ETag.
+        """
+        body = json.dumps(data).encode()
+        etag = etag_for(body) if cache_state else None
+        if etag and etag_matches(self.headers, etag):
+            code, body = 304, b''
 
-        self.send_response(200)
+        self.send_response(code)
         self.send_header('Content-Type', 'application/json')
         self.send_header('Access-Control-Allow-Origin', '*')
+        if etag:
+            self.send_header('ETag', etag)
+            self.send_header('Cache-Control', tweets_cache.cache_control())
+            self.send_header('Vary', 'Cookie')
+            self.send_header('X-Cache', cache_state.upper())
+        if getattr(self, 'session', None):
+            self.session.send_cookies(self)
         self.end_headers()
-        self.wfile.write(json.dumps(result).encode())
+        self.wfile.write(body)
@@ -0,0 +1,198 @@
+"""
+Benchmark Generation - Measures end-to-end throughput of /api/generate and /api/image
+
+Usage: python benchmark_generation.py [--target text|image|both] [--requests 50]
+                                      [--concurrency 10] [--latency 1.0] [--error-rate 0.0]
+                                      [--rate-limit 0] [--image-kb 2048] [--base-url URL] [--parallel]
+                                      [--use-cache]
+
+Starts fake_openai_server.py (unless --base-url is given), serves the real
+api/generate.py and api/image.py handlers on local ports pointed at it, then
+fires concurrent requests at them and reports throughput and latency
+percentiles. Nothing touches the network or costs money.
+
+Every text request is identical, so /api/generate would answer all but the
+first from its generation cache. They are sent with "regenerate": true to
+measure the upstream path; --use-cache drops it. Responses served from the
+cache are counted and timed separately from generated ones either way.
+
+No third-party dependencies beyond what the api/ handlers import.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import importlib.util
+import threading
+import urllib.request
+import urllib.error
+from pathlib import Path
+from http.server import ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+
+from fake_openai_server import start_server
+
+# Fix Windows console encoding for emojis
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+
+# Paths
+BASE_DIR = Path(__file__).parent.parent
+API_DIR = BASE_DIR / "api"
+
+SAMPLE_REQUESTS = {
+    'text': {
+        'path': 'generate',
+        'body': {'prompt': 'GM post about building through the bear market', 'platform': 'twitter',
+                 'tone': 'casual', 'type': 'post', 'variations': 3},
+    },
+    'image': {
+        'path': 'image',
+        'body': {'prompt': 'neon city rooftop at night', 'style': 'cyberpunk', 'aspect_ratio': '1:1'},
+    },
+}
+
+
+def serve_handler(module_name: str):
+    """Load an api/ module and serve its handler class on a local port."""
+    spec = importlib.util.spec_from_file_location(f"bench_{module_name}", API_DIR / f"{module_name}.py")
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+
+    handler_class = type(f"Quiet_{module_name}", (module.handler,), {'log_message': lambda self, *a: None})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler_class)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f"http://127.0.0.1:{server.server_port}/"
+
+
+def timed_request(url: str, body: dict):
+    """POST a JSON body. Returns (seconds, ok, response_bytes, cached).
+
+    cached is the response's "cached" field ("exact"/"similar") or None.
+    """
+    started = time.perf_counter()
+    req = urllib.request.Request(
+        url,
+        data=json.dumps(body).encode(),
+        headers={'Content-Type': 'application/json'},
+        method='POST'
+    )
+    try:
+        with urllib.request.urlopen(req, timeout=300) as response:
+            payload = response.read()
+            ok = response.status == 200
+    except urllib.error.HTTPError as e:
+        payload = e.read()
+        ok = False
+    except Exception:
+        payload = b''
+        ok = False
+    seconds = time.perf_counter() - started
+
+    cached = None
+    if ok:
+        try:
+            cached = json.loads(payload).get('cached')
+        except (ValueError, AttributeError):
+            pass
+    return seconds, ok, len(payload), cached
+
+
+def percentile(values, pct):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_benchmark(target: str, url: str, total: int, concurrency: int, parallel: bool = False,
+                  use_cache: bool = False) -> dict:
+    body = SAMPLE_REQUESTS[target]['body']
+    if parallel and target == 'text':
+        body = dict(body, parallel=True)
+    if target == 'text' and not use_cache:
+        body = dict(body, regenerate=True)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(lambda _: timed_request(url, body), range(total)))
+    elapsed = time.perf_counter() - started
+
+    ok_results = [(seconds, size, cached) for seconds, ok, size, cached in results if ok]
+    latencies = [seconds for seconds, _, cached in ok_results if not cached]
+    cache_latencies = [seconds for seconds, _, cached in ok_results if cached]
+    return {
+        'target': target,
+        'requests': total,
+        'ok': len(ok_results),
+        'failed': total - len(ok_results),
+        'cache_hits': len(cache_latencies),
+        'elapsed': elapsed,
+        'throughput': len(ok_results) / elapsed if elapsed else 0.0,
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'max': max(latencies) if latencies else 0.0,
+        'cache_p50': percentile(cache_latencies, 50),
+        'avg_bytes': sum(size for _, size, _ in ok_results) / len(ok_results) if ok_results else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark text and image generation against a fake OpenAI server")
+    parser.add_argument("--target", choices=["text", "image", "both"], default="both", help="Which endpoint to benchmark")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per target (default: 50)")
+    parser.add_argument("--concurrency", type=int, default=10, help="Concurrent requests (default: 10)")
+    parser.add_argument("--latency", type=float, default=1.0, help="Fake server mean latency in seconds (default: 1.0)")
+    parser.add_argument("--jitter", type=float, default=0.25, help="Fake server latency noise in seconds")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fake server 500 rate")
+    parser.add_argument("--rate-limit", type=int, default=0, help="Fake server requests per minute before 429s")
+    parser.add_argument("--image-kb", type=int, default=2048, help="Fake PNG size in KB (default: 2048)")
+    parser.add_argument("--base-url", type=str, default=None, help="Use an already running server instead")
+    parser.add_argument("--parallel", action="store_true", help="Text: one concurrent completion per variation")
+    parser.add_argument("--use-cache", action="store_true", help="Text: let the generation cache answer repeats")
+    args = parser.parse_args()
+
+    fake = None
+    base_url = args.base_url
+    if not base_url:
+        fake, base_url = start_server(
+            latency=args.latency,
+            jitter=args.jitter,
+            error_rate=args.error_rate,
+            rate_limit=args.rate_limit,
+            image_kb=args.image_kb,
+        )
+
+    os.environ['OPENAI_BASE_URL'] = base_url
+    os.environ.setdefault('OPENAI_API_KEY', 'sk-fake-benchmark')
+
+    targets = ["text", "image"] if args.target == "both" else [args.target]
+    print(f"Benchmarking against {base_url}")
+    print(f"Requests per target: {args.requests}, concurrency: {args.concurrency}")
+    print("=" * 50)
+
+    for target in targets:
+        server, url = serve_handler(SAMPLE_REQUESTS[target]['path'])
+        result = run_benchmark(target, url, args.requests, args.concurrency, args.parallel, args.use_cache)
+        server.shutdown()
+
+        print(f"\n{target.upper()} ({SAMPLE_REQUESTS[target]['path']}.py)")
+        print(f"  OK: {result['ok']}/{result['requests']}  failed: {result['failed']}")
+        print(f"  Wall time: {result['elapsed']:.2f}s  throughput: {result['throughput']:.2f} req/s")
+        print(f"  Latency p50: {result['p50']:.2f}s  p95: {result['p95']:.2f}s  max: {result['max']:.2f}s"
+              f"  (generated: {result['ok'] - result['cache_hits']})")
+        if result['cache_hits']:
+            print(f"  Cache hits: {result['cache_hits']}  p50: {result['cache_p50'] * 1000:.1f}ms")
+        print(f"  Avg response: {result['avg_bytes'] / 1024:.1f} KB")
+
+    if fake is not None:
+        stats = fake.RequestHandlerClass.stats
+        print(f"\nFake server: {stats['requests']} requests, {stats['errors']} errors, {stats['rate_limited']} rate limited")
+        fake.shutdown()
+
+
+if __name__ == "__main__":
+    main()
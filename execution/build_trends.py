@@ -0,0 +1,408 @@
+"""
+Build Trends - Precomputes the trend index served by /api/trends
+
+Usage: python build_trends.py [--as-of YYYY-MM-DD] [--tweet-store PATH] [--full]
+
+Reads our own posts from the analytics CSV in data/ and the synced tweet
+store (api/_tweet_store.py, TWEET_STORE_DB), tokenizes each one into terms
+(words and two-word phrases), hashtags/cashtags and emojis, and aggregates
+them into per-day buckets. For each sliding window (24h, 7d, 30d) ending at
+the latest day with posts, every feature's post count is compared with the
+window before it to find what is rising, and co-occurring rising features
+are grouped into topic clusters.
+
+Runs are incremental: tokenized days are kept in .tmp/trends/state.json and
+only days whose posts changed (plus the last RECENT_DAYS, whose engagement is
+still moving) are re-tokenized. --full rebuilds everything.
+
+Outputs:
+- .tmp/trends/trends_index.json - Read by api/trends.py (bundled via vercel.json)
+- .tmp/trends/state.json - Per-day buckets for the next incremental run
+
+The Vercel build doesn't run this script (the tweet store is local), so the
+index is committed: rebuild and commit trends_index.json to deploy new trends.
+state.json stays untracked.
+"""
+
+import os
+import re
+import sys
+import json
+import math
+import argparse
+from pathlib import Path
+from datetime import date, datetime, timedelta, timezone
+from collections import Counter
+
+from dotenv import load_dotenv
+
+from analyze_posts import load_posts
+
+# Fix Windows console encoding for emojis
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+
+# Paths
+BASE_DIR = Path(__file__).parent.parent
+API_DIR = BASE_DIR / "api"
+TRENDS_DIR = BASE_DIR / ".tmp" / "trends"
+INDEX_FILE = TRENDS_DIR / "trends_index.json"
+STATE_FILE = TRENDS_DIR / "state.json"
+
+load_dotenv(BASE_DIR / ".env")
+
+# Bump when tokenization changes so stored buckets are rebuilt
+INDEX_VERSION = 1
+
+# Window name -> length in days (the CSV only has day resolution)
+WINDOWS = {'24h': 1, '7d': 7, '30d': 30}
+DEFAULT_WINDOW = '7d'
+
+# Days before the reference date that are always re-tokenized
+RECENT_DAYS = 2
+
+# Entries kept per list in each window
+TOP_N = 25
+# Minimum posts in the current window for a term to count as trending
+MIN_TERM_POSTS = 2
+CLUSTER_CANDIDATES = 40
+CLUSTER_SIMILARITY = 0.25
+
+URL_RE = re.compile(r'https?://\S+')
+MENTION_RE = re.compile(r'@\w+')
+TAG_RE = re.compile(r'(?<!\w)([#$][A-Za-z][\w]{1,29})')
+WORD_RE = re.compile(r"[a-z][a-z0-9']+")
+EMOJI_RE = re.compile('[\U0001F300-\U0001FAFF\u2600-\u27BF]')
+
+STOPWORDS = set("""
+a about above after again all also am an and any are as at be because been before being below between both but
+by can could did do does doing don't down during each few for from further get got had has have having he her
+here hers him his how i i'm i've if in into is it it's its just let like me more most my no nor not now of off
+on once only or other our ours out over own really same she should so some such than that that's the their
+them then there these they this those through to too under until up very was we we're were what when where
+which while who whom why will with would you you're your yours
+""".split())
+
+# Keyword -> category, for the category filter on trends.html
+CATEGORY_KEYWORDS = {
+    'NFTs': {'nft', 'nfts', 'bayc', 'mayc', 'ape', 'apes', 'mutant', 'pfp', 'mint', 'ordinals', 'otherside',
+             'boredapeyc', 'opensea', 'floor', 'collection'},
+    'Crypto': {'btc', 'bitcoin', 'eth', 'ethereum', 'crypto', 'sol', 'solana', 'defi', 'etf', 'altcoin',
+               'altcoins', 'token', 'tokens', 'airdrop', 'memecoin', 'web3', 'onchain', 'wallet', 'bull', 'bear',
+               'apecoin', 'blockchain', 'stablecoin'},
+    'Tech': {'ai', 'tech', 'gpt', 'chatgpt', 'openai', 'apple', 'gaming', 'game', 'app', 'software', 'robot', 'code'},
+    'Business': {'business', 'startup', 'market', 'markets', 'stocks', 'fed', 'economy', 'money', 'invest',
+                 'investing', 'brand', 'founder'},
+    'Sports': {'nfl', 'nba', 'football', 'soccer', 'buckeyes', 'game day', 'playoffs', 'super bowl', 'ufc'},
+    'Entertainment': {'movie', 'music', 'netflix', 'show', 'album', 'concert', 'anime', 'memes', 'meme'},
+}
+
+
+def parse_day(value):
+    """Day of a CSV date ('Fri, Jan 23, 2026') or an X API created_at, as YYYY-MM-DD."""
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%a, %b %d, %Y").date().isoformat()
+    except ValueError:
+        pass
+    try:
+        return datetime.fromisoformat(value.replace('Z', '+00:00')).date().isoformat()
+    except ValueError:
+        return None
+
+
+def engagement(metrics):
+    return (
+        metrics.get('likes', metrics.get('like_count', 0)) +
+        metrics.get('reposts', metrics.get('retweet_count', 0)) * 2 +
+        metrics.get('replies', metrics.get('reply_count', 0)) +
+        metrics.get('quote_count', 0) * 2 +
+        metrics.get('bookmarks', metrics.get('bookmark_count', 0))
+    )
+
+
+def extract_features(text):
+    """Return (terms, hashtags, emojis) of a post, each as a set."""
+    text = MENTION_RE.sub(' ', URL_RE.sub(' ', text or ''))
+    hashtags = {tag[0] + tag[1:].lower() for tag in TAG_RE.findall(text)}
+    emojis = set(EMOJI_RE.findall(text))
+
+    words = WORD_RE.findall(TAG_RE.sub(' ', text).lower().replace('\u2019', "'"))
+    terms = {w for w in words if w not in STOPWORDS}
+    for first, second in zip(words, words[1:]):
+        if first not in STOPWORDS and second not in STOPWORDS:
+            terms.add(f"{first} {second}")
+    return terms, hashtags, emojis
+
+
+def collect_posts(tweet_store_path=None):
+    """All our posts by id from the analytics CSV and the tweet store; the store wins on overlap."""
+    posts = {}
+    sources = Counter()
+
+    try:
+        for post in load_posts():
+            day = parse_day(post['date'])
+            if day:
+                posts[post['id']] = {'day': day, 'text': post['text'], 'engagement': engagement(post)}
+                sources['csv'] += 1
+    except FileNotFoundError:
+        print("  No analytics CSV found, using the tweet store only")
+
+    path = tweet_store_path or os.environ.get('TWEET_STORE_DB')
+    if path and Path(path).exists():
+        sys.path.insert(0, str(API_DIR))
+        from _tweet_store import TweetStore
+        store = TweetStore(path)
+        for user_id in store.user_ids():
+            for tweet in store.tweets(user_id):
+                day = parse_day(tweet.get('created_at'))
+                if day:
+                    posts[tweet['id']] = {
+                        'day': day,
+                        'text': tweet.get('text'),
+                        'engagement': engagement(tweet.get('public_metrics', {})),
+                    }
+                    sources['tweet_store'] += 1
+    elif not path:
+        print("  No tweet store configured (TWEET_STORE_DB), using the analytics CSV only")
+
+    return posts, dict(sources)
+
+
+def load_state(full=False):
+    if full or not STATE_FILE.exists():
+        return {'version': INDEX_VERSION, 'days': {}}
+    with open(STATE_FILE, 'r', encoding='utf-8') as f:
+        state = json.load(f)
+    if state.get('version') != INDEX_VERSION:
+        return {'version': INDEX_VERSION, 'days': {}}
+    return state
+
+
+def tokenize_day(posts):
+    """Tokenized posts of one day: [[id, engagement, terms, hashtags, emojis], ...]."""
+    rows = []
+    for post_id, post in sorted(posts.items()):
+        terms, hashtags, emojis = extract_features(post['text'])
+        rows.append([post_id, post['engagement'], sorted(terms), sorted(hashtags), sorted(emojis)])
+    return rows
+
+
+def update_state(state, posts, reference):
+    """Re-tokenize days whose posts changed. Returns the number of days rebuilt."""
+    by_day = {}
+    for post_id, post in posts.items():
+        by_day.setdefault(post['day'], {})[post_id] = post
+
+    recent = {(reference - timedelta(days=i)).isoformat() for i in range(RECENT_DAYS)}
+    rebuilt = 0
+    for day, day_posts in by_day.items():
+        stored = state['days'].get(day)
+        if stored is not None and day not in recent and sorted(day_posts) == [row[0] for row in stored]:
+            continue
+        state['days'][day] = tokenize_day(day_posts)
+        rebuilt += 1
+
+    for day in list(state['days']):
+        if day not in by_day:
+            del state['days'][day]
+            rebuilt += 1
+    return rebuilt
+
+
+def window_rows(state, reference, days, offset=0):
+    """Tokenized posts from the `days` days ending `offset` days before reference."""
+    rows = []
+    for i in range(offset, offset + days):
+        rows.extend(state['days'].get((reference - timedelta(days=i)).isoformat(), []))
+    return rows
+
+
+def count_features(rows, column):
+    counts, totals = Counter(), Counter()
+    for row in rows:
+        for feature in row[column]:
+            counts[feature] += 1
+            totals[feature] += row[1]
+    return counts, totals
+
+
+def rising(rows, previous_rows, column, min_posts):
+    """Features posted about more in this window than the last, best first."""
+    counts, totals = count_features(rows, column)
+    previous, _ = count_features(previous_rows, column)
+
+    entries = []
+    for feature, count in counts.items():
+        before = previous.get(feature, 0)
+        if count < min_posts or count <= before:
+            continue
+        score = (count - before) * (1 + math.log1p(totals[feature] / count))
+        entries.append({
+            'term': feature,
+            'count': count,
+            'previous': before,
+            'change': round((count - before) / before, 3) if before else None,
+            'engagement': totals[feature],
+            'score': round(score, 3),
+        })
+    entries.sort(key=lambda e: (-e['score'], e['term']))
+    return entries[:TOP_N]
+
+
+def cluster_topics(rows, candidates):
+    """Group rising features that tend to appear in the same posts."""
+    docs = {}
+    for row in rows:
+        for feature in row[2] + row[3] + row[4]:
+            docs.setdefault(feature, set()).add(row[0])
+
+    clusters = []
+    assigned = set()
+    for seed in candidates:
+        if seed in assigned or seed not in docs:
+            continue
+        members = [seed]
+        for other in candidates:
+            if other in assigned or other == seed or other not in docs:
+                continue
+            # Skip a phrase's own words, they trivially co-occur with it
+            if other in seed.split() or seed in other.split():
+                continue
+            overlap = len(docs[seed] & docs[other]) / len(docs[seed] | docs[other])
+            if overlap >= CLUSTER_SIMILARITY:
+                members.append(other)
+        if len(members) < 2:
+            continue
+        assigned.update(members)
+        post_ids = set().union(*(docs[m] for m in members))
+        clusters.append({'label': seed, 'terms': members[:6], 'count': len(post_ids)})
+    return clusters
+
+
+def categorize(feature):
+    words = set(feature.lstrip('#$').lower().split())
+    for category, keywords in CATEGORY_KEYWORDS.items():
+        if words & keywords or feature.lstrip('#$').lower() in keywords:
+            return category
+    return 'Other'
+
+
+def format_volume(count):
+    if count >= 1_000_000:
+        return f"{count / 1_000_000:.1f}M"
+    if count >= 1_000:
+        return f"{count / 1_000:.1f}K"
+    return str(count)
+
+
+def streak_days(state, reference, feature, column):
+    """Consecutive days, ending at the reference date, the feature was posted about."""
+    days = 0
+    while True:
+        rows = state['days'].get((reference - timedelta(days=days)).isoformat(), [])
+        if not any(feature in row[column] for row in rows):
+            return days
+        days += 1
+
+
+def page_topics(state, reference, hashtags, terms):
+    """The top rising hashtags and terms in the shape trends.html renders."""
+    merged = [(entry, 3) for entry in hashtags] + [(entry, 2) for entry in terms]
+    merged.sort(key=lambda item: -item[0]['score'])
+
+    topics = []
+    for entry, column in merged[:20]:
+        change = entry['change']
+        if change is None:
+            badge = 'new'
+        elif change >= 1:
+            badge = 'hot'
+        else:
+            badge = 'rising'
+        streak = max(1, streak_days(state, reference, entry['term'], column))
+        topics.append({
+            'rank': len(topics) + 1,
+            'topic': entry['term'],
+            'category': categorize(entry['term']),
+            'badge': badge,
+            'volume': format_volume(entry['count']),
+            'change': f"+{round(change * 100)}%" if change is not None else 'New',
+            'duration': f"{streak} day" if streak == 1 else f"{streak} days",
+        })
+    return topics
+
+
+def build_window(state, reference, days):
+    rows = window_rows(state, reference, days)
+    previous_rows = window_rows(state, reference, days, offset=days)
+
+    terms = rising(rows, previous_rows, 2, MIN_TERM_POSTS)
+    hashtags = rising(rows, previous_rows, 3, 1)
+    emojis = rising(rows, previous_rows, 4, 1)
+    candidates = [e['term'] for e in sorted(terms + hashtags, key=lambda e: -e['score'])][:CLUSTER_CANDIDATES]
+
+    return {
+        'days': days,
+        'posts': len(rows),
+        'previous_posts': len(previous_rows),
+        'topics': page_topics(state, reference, hashtags, terms),
+        'terms': terms,
+        'hashtags': hashtags,
+        'emojis': emojis,
+        'clusters': cluster_topics(rows, candidates),
+    }
+
+
+def write_json(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temp_path = path.with_suffix('.part')
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False)
+    temp_path.replace(path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Precompute the trend index served by /api/trends")
+    parser.add_argument("--as-of", type=str, default=None, help="Reference date (default: latest day with posts)")
+    parser.add_argument("--tweet-store", type=str, default=None, help="Tweet store SQLite file (default: TWEET_STORE_DB)")
+    parser.add_argument("--full", action="store_true", help="Rebuild every day instead of only changed ones")
+    args = parser.parse_args()
+
+    print("Collecting posts...")
+    posts, sources = collect_posts(args.tweet_store)
+    if not posts:
+        print("No posts found, nothing to index")
+        return 1
+    print(f"  {len(posts)} posts ({', '.join(f'{n} from {s}' for s, n in sources.items())})")
+
+    reference = date.fromisoformat(args.as_of) if args.as_of else max(date.fromisoformat(p['day']) for p in posts.values())
+
+    state = load_state(args.full)
+    rebuilt = update_state(state, posts, reference)
+    print(f"  Re-tokenized {rebuilt} of {len(state['days'])} days")
+
+    index = {
+        'version': INDEX_VERSION,
+        'generated_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+        'reference_date': reference.isoformat(),
+        'default_window': DEFAULT_WINDOW,
+        'posts_indexed': len(posts),
+        'sources': sources,
+        'windows': {name: build_window(state, reference, days) for name, days in WINDOWS.items()},
+    }
+
+    write_json(STATE_FILE, state)
+    write_json(INDEX_FILE, index)
+
+    for name, window in index['windows'].items():
+        top = ', '.join(t['topic'] for t in window['topics'][:5]) or '-'
+        print(f"  {name}: {window['posts']} posts, rising: {top}")
+    print(f"Saved: {INDEX_FILE}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,8 +1,12 @@
 """
-Daily Run - Generates content and image for today, then rebuilds dashboard
+Daily Run - Generates content and images for today, optimizes them, then rebuilds dashboard and trends
 
 This script is designed to be run automatically via Windows Task Scheduler.
 Automatically commits and pushes to GitHub for GitHub Pages deployment.
+
+The trend index also covers posts synced by /api/tweets when TWEET_STORE_DB
+(in .env or the environment) points at that SQLite tweet store; without it
+only the analytics CSV in data/ is used.
 """
 
 import subprocess
@@ -33,10 +37,13 @@ def run_git(*args):
 
 def push_to_github(today):
     """Commit and push changes to GitHub."""
-    print("\n[4/4] Pushing to GitHub...")
+    print("\n[6/6] Pushing to GitHub...")
 
-    # Add all changes
-    run_git("add", "dashboard.html", ".tmp/images/")
+    # Add all changes (the trend index only exists once build_trends.py has succeeded)
+    paths = ["dashboard.html", ".tmp/images/"]
+    if (BASE_DIR / ".tmp" / "trends" / "trends_index.json").exists():
+        paths.append(".tmp/trends/trends_index.json")
+    run_git("add", *paths)
 
     # Commit with today's date
     run_git("commit", "-m", f"Daily content update - {today}")
@@ -57,24 +64,34 @@ def main():
     print(f"=" * 50)
 
     # Step 1: Generate content
-    print("\n[1/4] Generating content...")
+    print("\n[1/6] Generating content...")
     if not run_script("generate_content.py"):
         print("ERROR: Content generation failed")
         return 1
 
     # Step 2: Generate image
-    print("\n[2/4] Generating image...")
+    print("\n[2/6] Generating image...")
     if not run_script("generate_images.py"):
         print("ERROR: Image generation failed")
         return 1
 
-    # Step 3: Build dashboard
-    print("\n[3/4] Building dashboard...")
+    # Step 3: Optimize images (non-fatal, unoptimized images are still usable)
+    print("\n[3/6] Optimizing images...")
+    if not run_script("optimize_images.py"):
+        print("WARNING: Image optimization failed, continuing with original images")
+
+    # Step 4: Build dashboard
+    print("\n[4/6] Building dashboard...")
     if not run_script("build_dashboard.py"):
         print("ERROR: Dashboard build failed")
         return 1
 
-    # Step 4: Push to GitHub
+    # Step 5: Rebuild the trend index (non-fatal, /api/trends keeps serving the last one)
+    print("\n[5/6] Building trend index...")
+    if not run_script("build_trends.py"):
+        print("WARNING: Trend index build failed, keeping the previous index")
+
+    # Step 6: Push to GitHub
     push_to_github(today)
 
     print("\n" + "=" * 50)
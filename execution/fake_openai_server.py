@@ -0,0 +1,344 @@
+"""
+Fake OpenAI Server - Offline stand-in for the image and chat endpoints
+
+Usage: python fake_openai_server.py [--port 8765] [--latency 2.0] [--jitter 0.5]
+                                    [--error-rate 0.0] [--rate-limit 0] [--image-kb 0] [--seed 0]
+
+Then point the pipeline at it:
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 python execution/generate_images.py
+
+Serves /v1/images/edits, /v1/images/generations and /v1/chat/completions with
+deterministic payloads: the same prompt always yields the same PNG or text.
+Chat requests with "stream": true are answered as server-sent event chunks,
+with the latency spread over the tokens like a real streamed completion.
+Latency, random 500 errors and 429 rate limiting are configurable so the
+pipeline can be load-tested and benchmarked without spending money.
+
+No third-party dependencies.
+"""
+
+import re
+import sys
+import json
+import time
+import zlib
+import base64
+import random
+import struct
+import hashlib
+import argparse
+import threading
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Fix Windows console encoding for emojis
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+
+
+DEFAULT_CONFIG = {
+    'latency': 2.0,        # mean seconds per request
+    'jitter': 0.5,         # +/- seconds of uniform noise
+    'error_rate': 0.0,     # fraction of requests answered with 500
+    'rate_limit': 0,       # max requests per minute before 429 (0 = unlimited)
+    'image_kb': 0,         # pad PNGs to roughly this size to mimic real 1.5-2.6 MB outputs
+    'seed': 0,
+}
+
+# Share of the latency spent before the first streamed token
+FIRST_TOKEN_SHARE = 0.15
+
+SENTENCES = [
+    "GM fam, coffee's on and the charts are green",
+    "Building through the bear, shipping through the bull",
+    "Touch grass, then touch the mint button",
+    "The best alpha is showing up every day",
+    "Community over everything, always",
+    "Another day, another block",
+    "Stay curious, stay early, stay kind",
+    "Mutants don't sleep, they iterate",
+]
+
+
+def fake_png(seed_text: str, width: int = 1024, height: int = 1024, pad_kb: int = 0) -> bytes:
+    """Build a deterministic striped PNG from a seed string.
+
+    pad_kb adds an ancillary chunk of seeded random bytes (ignored by decoders)
+    so payload sizes match real gpt-image-1 output.
+    """
+    digest = hashlib.sha256(seed_text.encode()).digest()
+    bands = [digest[i:i + 3] for i in range(0, 24, 3)]
+    band_height = max(1, height // len(bands))
+
+    rows = []
+    for y in range(height):
+        color = bands[min(y // band_height, len(bands) - 1)]
+        rows.append(b'\x00' + color * width)
+    raw = b''.join(rows)
+
+    def chunk(kind, data):
+        body = kind + data
+        return struct.pack('>I', len(data)) + body + struct.pack('>I', zlib.crc32(body) & 0xffffffff)
+
+    header = struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)
+    padding = chunk(b'fkPd', random.Random(seed_text).randbytes(pad_kb * 1024)) if pad_kb else b''
+    return (b'\x89PNG\r\n\x1a\n' + chunk(b'IHDR', header) + padding
+            + chunk(b'IDAT', zlib.compress(raw, 6)) + chunk(b'IEND', b''))
+
+
+def fake_text(seed_text: str, variations: int = 1) -> str:
+    """Build deterministic post text, honouring the ---VARIATION--- convention."""
+    rng = random.Random(seed_text)
+    posts = []
+    for _ in range(variations):
+        posts.append(". ".join(rng.sample(SENTENCES, 2)) + " ☕️")
+    return "\n---VARIATION---\n".join(posts)
+
+
+def _multipart_field(body: bytes, name: str):
+    match = re.search(rb'name="' + name.encode() + rb'"\r\n\r\n(.*?)\r\n--', body, re.S)
+    return match.group(1).decode('utf-8', 'replace') if match else None
+
+
+class FakeOpenAIHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    config = DEFAULT_CONFIG
+    rng = random.Random(0)
+    request_times = deque()
+    lock = threading.Lock()
+    stats = {'requests': 0, 'errors': 0, 'rate_limited': 0}
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip('/').endswith('/models'):
+            self._send_json(200, {'object': 'list', 'data': [
+                {'id': 'gpt-image-1', 'object': 'model'},
+                {'id': 'gpt-4o', 'object': 'model'},
+            ]})
+        else:
+            self._send_json(404, {'error': {'message': 'Not found'}})
+
+    def do_POST(self):
+        body = self._read_body()
+
+        with self.lock:
+            self.stats['requests'] += 1
+            roll = self.rng.random()
+            delay = max(0.0, self.config['latency'] + self.rng.uniform(-1, 1) * self.config['jitter'])
+            limited, retry_after = self._check_rate_limit()
+
+        if limited:
+            with self.lock:
+                self.stats['rate_limited'] += 1
+            self._send_json(429, {'error': {
+                'message': 'Rate limit reached for requests', 'type': 'requests', 'code': 'rate_limit_exceeded',
+            }}, {'Retry-After': str(retry_after)})
+            return
+
+        path = self.path.split('?')[0].rstrip('/')
+        stream = path.endswith('/chat/completions') and self._wants_stream(body)
+        # Streamed completions spend most of the latency between tokens instead
+        time.sleep(delay * FIRST_TOKEN_SHARE if stream else delay)
+
+        if roll < self.config['error_rate']:
+            with self.lock:
+                self.stats['errors'] += 1
+            self._send_json(500, {'error': {'message': 'The server had an error processing your request.', 'type': 'server_error'}})
+            return
+
+        if path.endswith('/images/edits') or path.endswith('/images/generations'):
+            self._handle_image(path, body)
+        elif stream:
+            self._handle_chat_stream(body, delay * (1 - FIRST_TOKEN_SHARE))
+        elif path.endswith('/chat/completions'):
+            self._handle_chat(body)
+        else:
+            self._send_json(404, {'error': {'message': f'Unknown endpoint {path}'}})
+
+    def _check_rate_limit(self):
+        """Sliding one-minute window. Must be called with the lock held."""
+        limit = self.config['rate_limit']
+        if not limit:
+            return False, 0
+        now = time.monotonic()
+        while self.request_times and now - self.request_times[0] >= 60:
+            self.request_times.popleft()
+        if len(self.request_times) >= limit:
+            return True, max(1, int(60 - (now - self.request_times[0])) + 1)
+        self.request_times.append(now)
+        return False, 0
+
+    def _read_body(self):
+        if self.headers.get('Transfer-Encoding', '').lower() == 'chunked':
+            parts = []
+            while True:
+                size = int(self.rfile.readline().split(b';')[0].strip() or b'0', 16)
+                if size == 0:
+                    self.rfile.readline()
+                    break
+                parts.append(self.rfile.read(size))
+                self.rfile.readline()
+            return b''.join(parts)
+        return self.rfile.read(int(self.headers.get('Content-Length', 0)))
+
+    def _handle_image(self, path, body):
+        if path.endswith('/edits'):
+            prompt = _multipart_field(body, 'prompt') or ''
+            size = _multipart_field(body, 'size') or '1024x1024'
+            n = int(_multipart_field(body, 'n') or 1)
+        else:
+            data = json.loads(body or b'{}')
+            prompt = data.get('prompt', '')
+            size = data.get('size', '1024x1024')
+            n = int(data.get('n', 1))
+
+        try:
+            width, height = (int(v) for v in size.split('x'))
+        except ValueError:
+            width, height = 1024, 1024
+
+        images = []
+        for i in range(n):
+            png = fake_png(f"{self.config['seed']}:{prompt}:{i}", width, height, self.config['image_kb'])
+            images.append({'b64_json': base64.b64encode(png).decode()})
+        self._send_json(200, {'created': int(time.time()), 'data': images})
+
+    @staticmethod
+    def _wants_stream(body):
+        try:
+            return bool(json.loads(body or b'{}').get('stream'))
+        except ValueError:
+            return False
+
+    def _chat_seed(self, data):
+        """Seed text and requested variation count of a chat request."""
+        messages = data.get('messages', [])
+        seed_text = f"{self.config['seed']}:" + json.dumps(messages, sort_keys=True)
+        system = next((m.get('content', '') for m in messages if m.get('role') == 'system'), '')
+        match = re.search(r'Generate exactly (\d+) different variations', system)
+        return seed_text, int(match.group(1)) if match else 1
+
+    def _handle_chat_stream(self, body, duration):
+        """Send the completion as chat.completion.chunk events spread over `duration` seconds."""
+        data = json.loads(body or b'{}')
+        seed_text, variations = self._chat_seed(data)
+        content = fake_text(f"{seed_text}:0", variations)
+        tokens = re.findall(r'\S+\s*|\s+', content)
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        def send(delta, finish_reason=None):
+            chunk = {
+                'id': 'chatcmpl-fake',
+                'object': 'chat.completion.chunk',
+                'created': int(time.time()),
+                'model': data.get('model', 'gpt-4o'),
+                'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode())
+            self.wfile.flush()
+
+        send({'role': 'assistant', 'content': ''})
+        for token in tokens:
+            time.sleep(duration / max(1, len(tokens)))
+            send({'content': token})
+        send({}, 'stop')
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _handle_chat(self, body):
+        data = json.loads(body or b'{}')
+        seed_text, variations = self._chat_seed(data)
+
+        choices = []
+        for i in range(int(data.get('n', 1))):
+            content = fake_text(f"{seed_text}:{i}", variations)
+            choices.append({
+                'index': i,
+                'message': {'role': 'assistant', 'content': content},
+                'finish_reason': 'stop',
+            })
+
+        completion_tokens = sum(len(c['message']['content'].split()) for c in choices)
+        self._send_json(200, {
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': data.get('model', 'gpt-4o'),
+            'choices': choices,
+            'usage': {'prompt_tokens': len(seed_text) // 4, 'completion_tokens': completion_tokens,
+                      'total_tokens': len(seed_text) // 4 + completion_tokens},
+        })
+
+    def _send_json(self, code, data, extra_headers=None):
+        payload = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in (extra_headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_server(port: int = 0, **config):
+    """Start the fake server on a background thread.
+
+    Returns (server, base_url). Call server.shutdown() to stop it.
+    """
+    merged = dict(DEFAULT_CONFIG)
+    merged.update({k: v for k, v in config.items() if v is not None})
+    handler_class = type('ConfiguredFakeOpenAIHandler', (FakeOpenAIHandler,), {
+        'config': merged,
+        'rng': random.Random(merged['seed']),
+        'request_times': deque(),
+        'lock': threading.Lock(),
+        'stats': {'requests': 0, 'errors': 0, 'rate_limited': 0},
+    })
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler_class)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_port}/v1"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake OpenAI API server for load testing")
+    parser.add_argument("--port", type=int, default=8765, help="Port to listen on (default: 8765)")
+    parser.add_argument("--latency", type=float, default=DEFAULT_CONFIG['latency'], help="Mean response latency in seconds")
+    parser.add_argument("--jitter", type=float, default=DEFAULT_CONFIG['jitter'], help="Uniform +/- latency noise in seconds")
+    parser.add_argument("--error-rate", type=float, default=DEFAULT_CONFIG['error_rate'], help="Fraction of requests that fail with 500")
+    parser.add_argument("--rate-limit", type=int, default=DEFAULT_CONFIG['rate_limit'], help="Requests per minute before 429s (0 = off)")
+    parser.add_argument("--image-kb", type=int, default=DEFAULT_CONFIG['image_kb'], help="Pad fake PNGs to about this many KB")
+    parser.add_argument("--seed", type=int, default=DEFAULT_CONFIG['seed'], help="Seed for payloads and randomness")
+    args = parser.parse_args()
+
+    server, base_url = start_server(
+        args.port,
+        latency=args.latency,
+        jitter=args.jitter,
+        error_rate=args.error_rate,
+        rate_limit=args.rate_limit,
+        image_kb=args.image_kb,
+        seed=args.seed,
+    )
+    print(f"Fake OpenAI server listening on {base_url}")
+    print(f"export OPENAI_BASE_URL={base_url}")
+    print("Press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stats = server.RequestHandlerClass.stats
+        print(f"\nServed {stats['requests']} requests ({stats['errors']} errors, {stats['rate_limited']} rate limited)")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
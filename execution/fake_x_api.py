@@ -0,0 +1,349 @@
+"""
+Fake X API - Offline stand-in for the X API v2 endpoints the dashboard uses
+
+Usage: python fake_x_api.py [--port 8766] [--latency 0.05] [--tweets 250]
+                            [--reply-rate 6] [--limit-scale 1.0] [--seed 0]
+
+Then point the api/ handlers or the reply worker at it:
+    X_API_BASE_URL=http://127.0.0.1:8766 python execution/reply_worker.py
+
+Serves:
+    GET  /2/users/me, /2/users/by?usernames=, /2/users/:id/tweets
+    GET  /2/tweets?ids=, /2/tweets/search/recent (conversation_id queries)
+    POST /2/tweets, /2/oauth2/token, /2/oauth2/revoke
+
+The signed-in user has a deterministic timeline. New replies keep arriving on
+every conversation at --reply-rate per minute, so polling workers have
+something to do. Every response carries x-rate-limit-* headers from per-token
+15 minute windows (X's published limits times --limit-scale), and exhausted
+windows answer 429.
+
+No third-party dependencies.
+"""
+
+import re
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Fix Windows console encoding for emojis
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+
+
+DEFAULT_CONFIG = {
+    'latency': 0.05,       # seconds per request
+    'tweets': 250,         # tweets on the signed-in user's timeline
+    'reply_rate': 6.0,     # new replies per conversation per minute
+    'limit_scale': 1.0,    # multiply the per-window rate limits
+    'seed': 0,
+}
+
+ME = {'id': '42', 'username': 'KRAM_btc', 'name': 'KRAM', 'verified': True}
+
+# Requests per 15 minute window per token, roughly X's user-context limits
+RATE_LIMITS = {
+    'GET /2/users/me': 75,
+    'GET /2/users/by': 900,
+    'GET /2/users/:id/tweets': 900,
+    'GET /2/tweets': 900,
+    'GET /2/tweets/search/recent': 180,
+    'POST /2/tweets': 200,
+}
+WINDOW = 15 * 60
+
+# Snowflake-sized ids so since_id/until_id comparisons behave like the real API
+FIRST_ID = 1800000000000000000
+
+SENTENCES = [
+    "GM fam", "gm gm", "Building every day", "LFG", "Wen moon", "Good morning legend",
+    "This is the way", "Coffee first", "Bullish", "Great post ser",
+]
+
+
+def _iso(ts: float) -> str:
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(ts))
+
+
+def fake_user(key: str) -> dict:
+    """Deterministic user for an id or username."""
+    digest = hashlib.sha256(key.encode()).digest()
+    username = key if not key.isdigit() else f"user{key[-6:]}"
+    return {
+        'id': key if key.isdigit() else str(int.from_bytes(digest[:6], 'big')),
+        'username': username,
+        'name': username.replace('_', ' ').title(),
+        'verified': digest[6] % 2 == 0,
+        'profile_image_url': f"https://pbs.twimg.com/profile_images/{digest[:4].hex()}_normal.jpg",
+        'public_metrics': {
+            'followers_count': int.from_bytes(digest[7:10], 'big') % 500000,
+            'following_count': digest[10] * 10,
+            'tweet_count': int.from_bytes(digest[11:13], 'big'),
+            'listed_count': digest[13],
+        },
+    }
+
+
+class FakeXState:
+    """Timeline, conversations and rate-limit windows shared by all requests."""
+
+    def __init__(self, config):
+        self.config = config
+        self.rng = random.Random(config['seed'])
+        self.lock = threading.Lock()
+        self.next_id = FIRST_ID
+        self.tweets = {}            # id -> tweet
+        self.timeline = []          # ids of ME's tweets, newest first
+        self.conversations = {}     # conversation id -> [reply ids], oldest first
+        self.last_generated = {}    # conversation id -> time replies were last generated
+        self.users = {ME['id']: dict(fake_user(ME['id']), **ME)}
+        self.windows = {}           # (token, family) -> [window_start, used]
+        self.stats = {'requests': 0, 'rate_limited': 0, 'replies_posted': 0}
+
+        now = time.time()
+        for i in range(config['tweets']):
+            created = now - (config['tweets'] - i) * 3600
+            tweet = self._new_tweet(ME['id'], f"{' '.join(self.rng.sample(SENTENCES, 2))} #{i}", created)
+            self.timeline.insert(0, tweet['id'])
+
+    def _new_tweet(self, author_id, text, created=None, reply_to=None):
+        self.next_id += self.rng.randint(1, 1000)
+        tweet_id = str(self.next_id)
+        tweet = {
+            'id': tweet_id,
+            'text': text,
+            'author_id': author_id,
+            'created_at': _iso(created or time.time()),
+            'conversation_id': reply_to or tweet_id,
+            'public_metrics': {
+                'like_count': self.rng.randint(0, 500),
+                'retweet_count': self.rng.randint(0, 80),
+                'reply_count': 0,
+                'quote_count': self.rng.randint(0, 10),
+                'impression_count': self.rng.randint(100, 50000),
+            },
+        }
+        if reply_to:
+            tweet['in_reply_to_user_id'] = self.tweets[reply_to]['author_id'] if reply_to in self.tweets else ME['id']
+            self.conversations.setdefault(reply_to, []).append(tweet_id)
+            if reply_to in self.tweets:
+                self.tweets[reply_to]['public_metrics']['reply_count'] += 1
+        self.tweets[tweet_id] = tweet
+        return tweet
+
+    def generate_replies(self, conversation_id):
+        """Add the replies that 'arrived' since this conversation was last looked at."""
+        now = time.time()
+        last = self.last_generated.setdefault(conversation_id, now - 60)
+        count = int((now - last) * self.config['reply_rate'] / 60)
+        if count <= 0:
+            return
+        self.last_generated[conversation_id] = now
+        for _ in range(min(count, 500)):
+            author = fake_user(f"fan_{self.rng.randint(1, 400)}")
+            self.users[author['id']] = author
+            self._new_tweet(author['id'], self.rng.choice(SENTENCES), now, reply_to=conversation_id)
+
+    def check_rate_limit(self, token, family):
+        """Returns (allowed, headers) for one request."""
+        limit = max(1, int(RATE_LIMITS.get(family, 900) * self.config['limit_scale']))
+        now = time.time()
+        window = self.windows.get((token, family))
+        if window is None or now - window[0] >= WINDOW:
+            window = self.windows[(token, family)] = [now, 0]
+        allowed = window[1] < limit
+        if allowed:
+            window[1] += 1
+        headers = {
+            'x-rate-limit-limit': str(limit),
+            'x-rate-limit-remaining': str(limit - window[1]),
+            'x-rate-limit-reset': str(int(window[0] + WINDOW)),
+        }
+        return allowed, headers
+
+
+def _family(method, path):
+    return f"{method} " + re.sub(r'/\d+(?=/|$)', '/:id', path)
+
+
+def _page(ids, params, default_size, min_size=5):
+    """Apply since_id/until_id/max_results/pagination to ids (newest first)."""
+    if params.get('since_id'):
+        ids = [i for i in ids if int(i) > int(params['since_id'])]
+    if params.get('until_id'):
+        ids = [i for i in ids if int(i) < int(params['until_id'])]
+    size = max(min_size, min(100, int(params.get('max_results', default_size))))
+    offset = int(params.get('pagination_token') or params.get('next_token') or 0)
+    page = ids[offset:offset + size]
+    meta = {'result_count': len(page)}
+    if page:
+        meta['newest_id'], meta['oldest_id'] = page[0], page[-1]
+    if offset + size < len(ids):
+        meta['next_token'] = str(offset + size)
+    return page, meta
+
+
+class FakeXHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        self._dispatch('GET')
+
+    def do_POST(self):
+        self._dispatch('POST')
+
+    def _dispatch(self, method):
+        parsed = urlparse(self.path)
+        path = parsed.path.rstrip('/')
+        params = {k: v[0] for k, v in parse_qs(parsed.query).items()}
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0) or 0))
+        token = self.headers.get('Authorization', 'app')
+        family = _family(method, path)
+
+        time.sleep(self.state.config['latency'])
+        with self.state.lock:
+            self.state.stats['requests'] += 1
+            if path.startswith('/2/oauth2/'):
+                allowed, limit_headers = True, {}
+            else:
+                allowed, limit_headers = self.state.check_rate_limit(token, family)
+            if not allowed:
+                self.state.stats['rate_limited'] += 1
+                self._send_json(429, {'title': 'Too Many Requests', 'detail': 'Too Many Requests', 'status': 429},
+                                limit_headers)
+                return
+            code, payload = self._route(method, path, params, body)
+        self._send_json(code, payload, limit_headers)
+
+    def _route(self, method, path, params, body):
+        state = self.state
+        match = re.fullmatch(r'/2/users/(\d+)/tweets', path)
+
+        if method == 'POST' and path == '/2/oauth2/token':
+            suffix = hashlib.sha256(body).hexdigest()[:12]
+            return 200, {'token_type': 'bearer', 'expires_in': 7200, 'access_token': f'fake-access-{suffix}',
+                         'refresh_token': f'fake-refresh-{suffix}', 'scope': 'tweet.read tweet.write users.read offline.access'}
+        if method == 'POST' and path == '/2/oauth2/revoke':
+            return 200, {'revoked': True}
+        if method == 'POST' and path == '/2/tweets':
+            data = json.loads(body or b'{}')
+            reply_to = (data.get('reply') or {}).get('in_reply_to_tweet_id')
+            if reply_to and reply_to not in state.tweets:
+                return 400, {'title': 'Invalid Request', 'detail': f'Tweet {reply_to} does not exist'}
+            conversation = state.tweets[reply_to]['conversation_id'] if reply_to else None
+            tweet = state._new_tweet(ME['id'], data.get('text', ''), reply_to=conversation)
+            if not reply_to:
+                state.timeline.insert(0, tweet['id'])
+            state.stats['replies_posted'] += 1 if reply_to else 0
+            return 201, {'data': {'id': tweet['id'], 'text': tweet['text']}}
+
+        if method != 'GET':
+            return 404, {'title': 'Not Found'}
+
+        if path == '/2/users/me':
+            return 200, {'data': state.users[ME['id']]}
+        if path == '/2/users/by':
+            names = [n for n in params.get('usernames', '').split(',') if n][:100]
+            users = [fake_user(n) for n in names if not n.lower().startswith('missing')]
+            errors = [{'value': n, 'detail': f'Could not find user with usernames: [{n}].', 'title': 'Not Found Error',
+                       'resource_type': 'user', 'parameter': 'usernames'} for n in names if n.lower().startswith('missing')]
+            return 200, dict({'data': users} if users else {}, **({'errors': errors} if errors else {}))
+        if match:
+            ids = state.timeline if match.group(1) == ME['id'] else []
+            page, meta = _page(ids, params, 10)
+            return 200, dict({'data': [state.tweets[i] for i in page]} if page else {}, meta=meta)
+        if path == '/2/tweets':
+            ids = [i for i in params.get('ids', '').split(',') if i][:100]
+            found = [state.tweets[i] for i in ids if i in state.tweets]
+            errors = [{'value': i, 'resource_id': i, 'resource_type': 'tweet', 'title': 'Not Found Error'}
+                      for i in ids if i not in state.tweets]
+            return 200, dict({'data': found} if found else {}, **({'errors': errors} if errors else {}))
+        if path == '/2/tweets/search/recent':
+            conversation = re.search(r'conversation_id:(\d+)', params.get('query', ''))
+            if not conversation:
+                return 400, {'title': 'Invalid Request', 'detail': 'Only conversation_id queries are supported'}
+            conversation_id = conversation.group(1)
+            if conversation_id in state.tweets:
+                state.generate_replies(conversation_id)
+            ids = list(reversed(state.conversations.get(conversation_id, [])))
+            page, meta = _page(ids, params, 10, min_size=10)
+            tweets = [state.tweets[i] for i in page]
+            authors = {t['author_id'] for t in tweets}
+            payload = {'meta': meta}
+            if tweets:
+                payload['data'] = tweets
+                payload['includes'] = {'users': [state.users[a] for a in authors if a in state.users]}
+            return 200, payload
+
+        return 404, {'title': 'Not Found', 'detail': f'Unknown endpoint {path}'}
+
+    def _send_json(self, code, data, extra_headers=None):
+        payload = json.dumps(data).encode()
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        for key, value in (extra_headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def start_server(port: int = 0, **config):
+    """Start the fake X API on a background thread.
+
+    Returns (server, base_url). server.RequestHandlerClass.state holds the
+    timeline, posted replies and stats. Call server.shutdown() to stop it.
+    """
+    merged = dict(DEFAULT_CONFIG)
+    merged.update({k: v for k, v in config.items() if v is not None})
+    handler_class = type('ConfiguredFakeXHandler', (FakeXHandler,), {'state': FakeXState(merged)})
+    server = ThreadingHTTPServer(('127.0.0.1', port), handler_class)
+    server.daemon_threads = True
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    return server, f"http://127.0.0.1:{server.server_port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a fake X API server for local testing")
+    parser.add_argument("--port", type=int, default=8766, help="Port to listen on (default: 8766)")
+    parser.add_argument("--latency", type=float, default=DEFAULT_CONFIG['latency'], help="Seconds per request")
+    parser.add_argument("--tweets", type=int, default=DEFAULT_CONFIG['tweets'], help="Tweets on the user's timeline")
+    parser.add_argument("--reply-rate", type=float, default=DEFAULT_CONFIG['reply_rate'], help="New replies per conversation per minute")
+    parser.add_argument("--limit-scale", type=float, default=DEFAULT_CONFIG['limit_scale'], help="Scale the per-window rate limits")
+    parser.add_argument("--seed", type=int, default=DEFAULT_CONFIG['seed'], help="Seed for generated data")
+    args = parser.parse_args()
+
+    server, base_url = start_server(
+        args.port,
+        latency=args.latency,
+        tweets=args.tweets,
+        reply_rate=args.reply_rate,
+        limit_scale=args.limit_scale,
+        seed=args.seed,
+    )
+    print(f"Fake X API listening on {base_url}")
+    print(f"export X_API_BASE_URL={base_url}")
+    print("Press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        stats = server.RequestHandlerClass.state.stats
+        print(f"\nServed {stats['requests']} requests ({stats['rate_limited']} rate limited, "
+              f"{stats['replies_posted']} replies posted)")
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,17 @@
 """
 Generate Images - Uses OpenAI's gpt-image-1 to generate variations of your Mutant Ape
 
-Usage: python generate_images.py [--date YYYY-MM-DD] [--regenerate]
+Usage: python generate_images.py [--date YYYY-MM-DD] [--regenerate] [--dedupe flag|regenerate|off]
+       python generate_images.py --start YYYY-MM-DD [--end YYYY-MM-DD]
+                                 [--workers 3] [--max-per-minute 5] [--max-spend 10.00]
+
+The --start/--end backfill mode collects every post missing an image across
+the date range and generates them concurrently under one shared rate and
+spend budget, with a live progress/ETA line.
+
+Each new image is checked against the perceptual-hash index of recent images
+(see image_index.py). Near-duplicates are recorded on the post as
+`similar_to`, and --dedupe regenerate retries them once.
 
 This script uses OpenAI's GPT Image model which can take your actual image
 as a reference and create variations in different styles.
@@ -12,11 +22,14 @@ Requirements: pip install openai python-dotenv
 import os
 import sys
 import json
-import base64
+import time
 import argparse
+import threading
 import requests
+from collections import deque
 from pathlib import Path
-from datetime import date
+from datetime import date, timedelta
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 from openai import OpenAI
 
@@ -28,6 +41,12 @@ if sys.platform == 'win32':
 BASE_DIR = Path(__file__).parent.parent
 load_dotenv(BASE_DIR / ".env")
 
+# Shared helpers live alongside the serverless handlers
+sys.path.insert(0, str(BASE_DIR / "api"))
+from _image_stream import stream_b64_field, CHUNK_SIZE
+
+from image_index import ImageHashIndex
+
 # Paths
 CONTENT_DIR = BASE_DIR / ".tmp" / "daily_content"
 IMAGES_DIR = BASE_DIR / ".tmp" / "images"
@@ -45,9 +64,13 @@ GM_IMAGES = [
 
 # Track which GM image to use next (round-robin)
 _gm_image_index = 0
+_gm_image_lock = threading.Lock()
 
-# Initialize OpenAI client
-client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"))
+# Approximate cost of one high quality 1024x1024 gpt-image-1 edit (USD)
+COST_PER_IMAGE = 0.17
+
+# Initialize OpenAI client (OPENAI_BASE_URL can point at fake_openai_server.py for load tests)
+client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=os.getenv("OPENAI_BASE_URL") or None)
 
 
 def get_reference_image(post_type: str) -> Path:
@@ -58,8 +81,9 @@ def get_reference_image(post_type: str) -> Path:
         # Use GM images in round-robin
         available_gm = [img for img in GM_IMAGES if img.exists()]
         if available_gm:
-            image = available_gm[_gm_image_index % len(available_gm)]
-            _gm_image_index += 1
+            with _gm_image_lock:
+                image = available_gm[_gm_image_index % len(available_gm)]
+                _gm_image_index += 1
             return image
         else:
             print("  WARNING: No GM images found, falling back to mutant ape")
@@ -89,23 +113,29 @@ def generate_image(style_prompt: str, output_path: Path, suggested_time: str = N
 
         print(f"  Generating with gpt-image-1...")
 
-        # Read the reference image
-        with open(reference_image, "rb") as image_file:
-            response = client.images.edit(
-                model="gpt-image-1",
-                image=image_file,
-                prompt=full_prompt,
-                size="1024x1024",
-                quality="high",
-            )
-
-        # Get the image data (base64)
-        image_data = response.data[0].b64_json
-
-        # Decode and save
-        image_bytes = base64.b64decode(image_data)
-        with open(output_path, 'wb') as f:
-            f.write(image_bytes)
+        # Stream the response straight to disk: the base64 payload is decoded
+        # chunk by chunk as it arrives instead of being held in memory
+        partial_path = output_path.with_suffix(output_path.suffix + ".part")
+        try:
+            with open(reference_image, "rb") as image_file:
+                with client.images.with_streaming_response.edit(
+                    model="gpt-image-1",
+                    image=image_file,
+                    prompt=full_prompt,
+                    size="1024x1024",
+                    quality="high",
+                ) as response:
+                    with open(partial_path, 'wb') as f:
+                        written = stream_b64_field(response.iter_bytes(CHUNK_SIZE), f.write)
+
+            if not written:
+                print(f"  Error: No image data in response")
+                return False
+
+            partial_path.replace(output_path)
+        finally:
+            # Left behind when the download fails part way (a no-op once renamed)
+            partial_path.unlink(missing_ok=True)
 
         print(f"  Saved to: {output_path.name}")
         return True
@@ -150,20 +180,74 @@ Keep the character friendly and cartoon-like."""
         )
 
         image_url = response.data[0].url
-        img_response = requests.get(image_url)
-        if img_response.status_code == 200:
+        with requests.get(image_url, stream=True, timeout=60) as img_response:
+            if img_response.status_code != 200:
+                return False
             with open(output_path, 'wb') as f:
-                f.write(img_response.content)
-            print(f"  Saved to: {output_path.name} (fallback)")
-            return True
-        return False
+                for chunk in img_response.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+        print(f"  Saved to: {output_path.name} (fallback)")
+        return True
 
     except Exception as e:
         print(f"  Fallback also failed: {e}")
         return False
 
 
-def process_daily_content(target_date: str, regenerate: bool = False):
+_image_index = None
+
+
+def get_image_index() -> ImageHashIndex:
+    """Load the perceptual-hash index once, picking up any images added since the last run."""
+    global _image_index
+    if _image_index is None:
+        _image_index = ImageHashIndex()
+        _image_index.update()
+    return _image_index
+
+
+def flag_near_duplicate(post: dict, image_path: Path) -> bool:
+    """Record on the post whether its image is too similar to a recent one."""
+    matches = get_image_index().find_similar(image_path)
+    if not matches:
+        post.pop('similar_to', None)
+        return False
+    distance, key = matches[0]
+    post['similar_to'] = {'image': key, 'distance': distance}
+    print(f"  Near-duplicate of {key} (distance {distance})")
+    return True
+
+
+def generate_post_image(post: dict, image_path: Path, dedupe: str = "flag", before_retry=None,
+                        retry_failed=None) -> bool:
+    """Generate a post's image and check it against recent images.
+
+    With dedupe="regenerate", a near-duplicate is regenerated once.
+    before_retry, if given, is called first and may return False to skip the retry.
+    retry_failed, if given, is called when the retry fails (e.g. to give back
+    what before_retry reserved); the first image is kept then.
+    """
+    # Pass suggested_time and post_type for reference image selection
+    success = generate_image(
+        post['image_prompt'],
+        image_path,
+        post.get('suggested_time'),
+        post.get('post_type')
+    )
+    if not success or dedupe == "off":
+        return success
+
+    if flag_near_duplicate(post, image_path) and dedupe == "regenerate":
+        if before_retry is None or before_retry():
+            print(f"  Regenerating {image_path.name} once...")
+            if generate_image(post['image_prompt'], image_path, post.get('suggested_time'), post.get('post_type')):
+                flag_near_duplicate(post, image_path)
+            elif retry_failed is not None:
+                retry_failed()
+    return True
+
+
+def process_daily_content(target_date: str, regenerate: bool = False, dedupe: str = "flag"):
     """Process daily content and generate images for each post."""
 
     content_file = CONTENT_DIR / f"{target_date}.json"
@@ -199,13 +283,7 @@ def process_daily_content(target_date: str, regenerate: bool = False):
             post['image_path'] = str(image_path.relative_to(BASE_DIR))
             continue
 
-        # Generate image (pass suggested_time and post_type for reference image selection)
-        success = generate_image(
-            post['image_prompt'],
-            image_path,
-            post.get('suggested_time'),
-            post.get('post_type')
-        )
+        success = generate_post_image(post, image_path, dedupe)
 
         if success:
             post['image_path'] = str(image_path.relative_to(BASE_DIR))
@@ -215,6 +293,8 @@ def process_daily_content(target_date: str, regenerate: bool = False):
     # Save updated content with image paths
     with open(content_file, 'w', encoding='utf-8') as f:
         json.dump(content, f, indent=2, ensure_ascii=False)
+    if dedupe != "off":
+        get_image_index().save()
 
     print("\n" + "=" * 50)
     print(f"Done! Updated {content_file}")
@@ -224,18 +304,202 @@ def process_daily_content(target_date: str, regenerate: bool = False):
     print(f"Images generated: {successful}/{len(content['posts'])}")
 
 
+class GenerationBudget:
+    """Shared rate and spend limit for concurrent image generation.
+
+    Every worker calls acquire() before starting an image. Starts are limited
+    to max_per_minute over a sliding 60s window, and no new image is started
+    once the estimated spend would exceed max_spend.
+    """
+
+    def __init__(self, max_per_minute: int, max_spend: float = None, cost_per_image: float = COST_PER_IMAGE):
+        self.max_per_minute = max_per_minute
+        self.max_spend = max_spend
+        self.cost_per_image = cost_per_image
+        self.spent = 0.0
+        self._starts = deque()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> bool:
+        """Block until an image may start. Returns False if the spend budget is exhausted."""
+        while True:
+            with self._lock:
+                if self.max_spend is not None and self.spent + self.cost_per_image > self.max_spend:
+                    return False
+                now = time.monotonic()
+                while self._starts and now - self._starts[0] >= 60:
+                    self._starts.popleft()
+                if len(self._starts) < self.max_per_minute:
+                    self._starts.append(now)
+                    self.spent += self.cost_per_image
+                    return True
+                wait = 60 - (now - self._starts[0])
+            time.sleep(wait)
+
+    def refund(self):
+        """Give back the reserved cost of an image that failed."""
+        with self._lock:
+            self.spent = max(0.0, self.spent - self.cost_per_image)
+
+
+def _format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    if seconds >= 3600:
+        return f"{seconds // 3600}h{(seconds % 3600) // 60:02d}m"
+    return f"{seconds // 60}m{seconds % 60:02d}s"
+
+
+def collect_missing_images(start_date: str, end_date: str, regenerate: bool = False):
+    """Find posts without an image across a date range.
+
+    Returns (contents, tasks): contents maps date -> (content_file, content dict),
+    tasks is a list of (date, post_number, post) still needing an image.
+    """
+    contents = {}
+    tasks = []
+    day = date.fromisoformat(start_date)
+    last = date.fromisoformat(end_date)
+    while day <= last:
+        target_date = day.isoformat()
+        day += timedelta(days=1)
+
+        content_file = CONTENT_DIR / f"{target_date}.json"
+        if not content_file.exists():
+            continue
+        with open(content_file, 'r', encoding='utf-8') as f:
+            content = json.load(f)
+        contents[target_date] = (content_file, content)
+
+        for i, post in enumerate(content['posts'], 1):
+            image_path = IMAGES_DIR / target_date / f"post_{i:02d}.png"
+            if image_path.exists() and not regenerate:
+                # Image on disk but not recorded yet
+                post['image_path'] = str(image_path.relative_to(BASE_DIR))
+                continue
+            tasks.append((target_date, i, post))
+
+    return contents, tasks
+
+
+def backfill_images(start_date: str, end_date: str, workers: int = 3, max_per_minute: int = 5,
+                    max_spend: float = None, regenerate: bool = False, dedupe: str = "flag"):
+    """Generate all missing images across a date range under one shared budget."""
+    contents, tasks = collect_missing_images(start_date, end_date, regenerate)
+
+    print(f"Backfilling images for {start_date} to {end_date}")
+    print(f"Days with content: {len(contents)}")
+    print(f"Posts missing images: {len(tasks)}")
+    print(f"Workers: {workers}, max {max_per_minute} images/min"
+          + (f", max spend ${max_spend:.2f}" if max_spend is not None else ""))
+    print(f"Estimated cost: ${len(tasks) * COST_PER_IMAGE:.2f}")
+    print("=" * 50)
+
+    if not tasks:
+        return
+
+    budget = GenerationBudget(max_per_minute, max_spend)
+    if dedupe != "off":
+        # Load before the pool starts so workers share one index
+        get_image_index()
+    save_lock = threading.Lock()
+    started_at = time.monotonic()
+    done = 0
+    succeeded = 0
+    skipped = 0
+
+    def save_content(target_date):
+        content_file, content = contents[target_date]
+        with open(content_file, 'w', encoding='utf-8') as f:
+            json.dump(content, f, indent=2, ensure_ascii=False)
+
+    def run(task):
+        target_date, number, post = task
+        if not budget.acquire():
+            return None
+        date_images_dir = IMAGES_DIR / target_date
+        date_images_dir.mkdir(parents=True, exist_ok=True)
+        image_path = date_images_dir / f"post_{number:02d}.png"
+        success = generate_post_image(post, image_path, dedupe, before_retry=budget.acquire,
+                                      retry_failed=budget.refund)
+        if not success:
+            budget.refund()
+        with save_lock:
+            post['image_path'] = str(image_path.relative_to(BASE_DIR)) if success else None
+            save_content(target_date)
+        return success
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(run, task): task for task in tasks}
+        for future in as_completed(futures):
+            target_date, number, _ = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"  Error: {e}")
+                result = False
+
+            done += 1
+            if result is None:
+                skipped += 1
+                status = "skipped (budget)"
+            elif result:
+                succeeded += 1
+                status = "ok"
+            else:
+                status = "failed"
+
+            elapsed = time.monotonic() - started_at
+            remaining = len(tasks) - done
+            eta = elapsed / done * remaining
+            print(f"[{done}/{len(tasks)}] {target_date} post_{number:02d}: {status} | "
+                  f"{done * 100 // len(tasks)}% | elapsed {_format_duration(elapsed)} | "
+                  f"ETA {_format_duration(eta)} | spent ~${budget.spent:.2f}")
+
+    if dedupe != "off":
+        get_image_index().save()
+
+    print("\n" + "=" * 50)
+    print(f"Done! Images generated: {succeeded}/{len(tasks)}")
+    if skipped:
+        print(f"Skipped {skipped} posts after reaching the ${max_spend:.2f} spend limit")
+
+
 def main():
     parser = argparse.ArgumentParser(description="Generate images for daily content")
     parser.add_argument("--date", type=str, help="Date to generate for (YYYY-MM-DD)", default=None)
     parser.add_argument("--regenerate", action="store_true", help="Regenerate all images even if they exist")
+    parser.add_argument("--dedupe", choices=["flag", "regenerate", "off"], default="flag",
+                        help="Handling of near-duplicates of recent images (default: flag)")
+    parser.add_argument("--start", type=str, help="Backfill: first date of range (YYYY-MM-DD)", default=None)
+    parser.add_argument("--end", type=str, help="Backfill: last date of range (default: today)", default=None)
+    parser.add_argument("--workers", type=int, default=3, help="Backfill: concurrent generations (default: 3)")
+    parser.add_argument("--max-per-minute", type=int, default=5, help="Backfill: max images started per minute (default: 5)")
+    parser.add_argument("--max-spend", type=float, default=None, help="Backfill: stop starting images past this spend (USD)")
     args = parser.parse_args()
 
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.max_per_minute < 1:
+        parser.error("--max-per-minute must be at least 1")
+
+    if args.start:
+        backfill_images(
+            args.start,
+            args.end or date.today().isoformat(),
+            workers=args.workers,
+            max_per_minute=args.max_per_minute,
+            max_spend=args.max_spend,
+            regenerate=args.regenerate,
+            dedupe=args.dedupe,
+        )
+        return
+
     if args.date:
         target_date = args.date
     else:
         target_date = date.today().isoformat()
 
-    process_daily_content(target_date, args.regenerate)
+    process_daily_content(target_date, args.regenerate, args.dedupe)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,247 @@
+"""
+Image Index - Perceptual-hash index for spotting near-duplicate generated images
+
+Usage: python image_index.py [--rebuild] [--date YYYY-MM-DD] [--check PATH]
+                             [--threshold 10] [--days 14]
+
+Every PNG under .tmp/images/ gets a 64-bit difference hash (dHash), which
+stays nearly identical for images that look alike even if the bytes differ.
+Hashes are stored in .tmp/images/phash_index.json and updated incrementally,
+so only new or changed files are hashed on each run.
+
+Lookups use a BK-tree over Hamming distance, which only visits the branches
+that can contain a match instead of comparing against every image.
+
+Requirements: pip install Pillow
+"""
+
+import sys
+import json
+import argparse
+import threading
+from pathlib import Path
+from datetime import date, timedelta
+
+from PIL import Image
+
+# Fix Windows console encoding for emojis
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+
+# Paths
+BASE_DIR = Path(__file__).parent.parent
+IMAGES_DIR = BASE_DIR / ".tmp" / "images"
+INDEX_FILE = IMAGES_DIR / "phash_index.json"
+
+# Hamming distance (out of 64 bits) at or below which two images count as near-duplicates
+DEFAULT_THRESHOLD = 10
+
+# How far back "recent posts" reaches when checking a new image
+DEFAULT_DAYS = 14
+
+
+def dhash(image_path: Path, hash_size: int = 8) -> int:
+    """Compute a difference hash: compares adjacent pixels of a tiny grayscale thumbnail."""
+    with Image.open(image_path) as img:
+        small = img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+        pixels = list(small.getdata())
+
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """Burkhard-Keller tree over Hamming distance.
+
+    Each node stores children keyed by their distance to it. The triangle
+    inequality means a search with radius r only needs children whose key is
+    within [d - r, d + r] of the query's distance d to the node.
+    """
+
+    def __init__(self):
+        self._root = None
+
+    def add(self, value: int, item):
+        node = (value, item, {})
+        if self._root is None:
+            self._root = node
+            return
+        current = self._root
+        while True:
+            distance = hamming(value, current[0])
+            child = current[2].get(distance)
+            if child is None:
+                current[2][distance] = node
+                return
+            current = child
+
+    def search(self, value: int, radius: int):
+        """Return [(distance, item)] for every entry within radius, closest first."""
+        if self._root is None:
+            return []
+        results = []
+        stack = [self._root]
+        while stack:
+            node_value, item, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= radius:
+                results.append((distance, item))
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        results.sort(key=lambda r: r[0])
+        return results
+
+
+class ImageHashIndex:
+    """Persistent perceptual-hash index over .tmp/images/."""
+
+    def __init__(self, index_file: Path = INDEX_FILE, images_dir: Path = IMAGES_DIR):
+        self.index_file = index_file
+        self.images_dir = images_dir
+        self.entries = {}
+        self._tree = None
+        self._lock = threading.Lock()
+        if index_file.exists():
+            with open(index_file, 'r', encoding='utf-8') as f:
+                self.entries = json.load(f).get('images', {})
+
+    def _key(self, image_path: Path):
+        """Index key (path relative to images_dir), or None for an image outside it."""
+        try:
+            return image_path.resolve().relative_to(self.images_dir.resolve()).as_posix()
+        except ValueError:
+            return None
+
+    def _tree_for(self):
+        if self._tree is None:
+            tree = BKTree()
+            for key, entry in self.entries.items():
+                tree.add(int(entry['hash'], 16), key)
+            self._tree = tree
+        return self._tree
+
+    def add(self, image_path: Path) -> int:
+        """Hash one image (if new or changed) and add it to the index."""
+        image_path = Path(image_path)
+        key = self._key(image_path)
+        if key is None:
+            raise ValueError(f"{image_path} is not under {self.images_dir}")
+        stat = image_path.stat()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry and entry['size'] == stat.st_size and entry['mtime'] == int(stat.st_mtime):
+                return int(entry['hash'], 16)
+
+        value = dhash(image_path)
+        with self._lock:
+            replaced = key in self.entries
+            self.entries[key] = {
+                'hash': f"{value:016x}",
+                'size': stat.st_size,
+                'mtime': int(stat.st_mtime),
+                'date': image_path.parent.name,
+            }
+            if replaced:
+                # BK-trees don't support removal, rebuild lazily on next lookup
+                self._tree = None
+            elif self._tree is not None:
+                self._tree.add(value, key)
+        return value
+
+    def update(self) -> int:
+        """Sync the index with the files on disk. Returns the number of images hashed."""
+        hashed = 0
+        seen = set()
+        for image_path in sorted(self.images_dir.glob("*/*.png")):
+            if image_path.name.endswith(".opt.png"):
+                continue
+            key = self._key(image_path)
+            seen.add(key)
+            before = self.entries.get(key)
+            self.add(image_path)
+            if self.entries.get(key) is not before:
+                hashed += 1
+
+        with self._lock:
+            removed = [key for key in self.entries if key not in seen]
+            for key in removed:
+                del self.entries[key]
+            if removed:
+                self._tree = None
+        return hashed
+
+    def save(self):
+        with self._lock:
+            data = {'version': 1, 'hash': 'dhash64', 'images': self.entries}
+            self.index_file.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.index_file, 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=2, sort_keys=True)
+
+    def find_similar(self, image_path: Path, threshold: int = DEFAULT_THRESHOLD, days: int = DEFAULT_DAYS):
+        """Find indexed images within `threshold` bits of image_path from the last `days` days.
+
+        Returns [(distance, key)] closest first, excluding the image itself.
+        Images outside images_dir are hashed for the lookup but not indexed.
+        """
+        image_path = Path(image_path)
+        own_key = self._key(image_path)
+        value = self.add(image_path) if own_key else dhash(image_path)
+        cutoff = (date.today() - timedelta(days=days)).isoformat() if days else ""
+
+        with self._lock:
+            matches = self._tree_for().search(value, threshold)
+            return [
+                (distance, key) for distance, key in matches
+                if key != own_key and self.entries.get(key, {}).get('date', '') >= cutoff
+            ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perceptual-hash index for generated images")
+    parser.add_argument("--rebuild", action="store_true", help="Discard the index and re-hash every image")
+    parser.add_argument("--date", type=str, help="Report near-duplicates for this date's images", default=None)
+    parser.add_argument("--check", type=str, help="Check a single image against the index", default=None)
+    parser.add_argument("--threshold", type=int, default=DEFAULT_THRESHOLD, help=f"Max Hamming distance (default: {DEFAULT_THRESHOLD})")
+    parser.add_argument("--days", type=int, default=DEFAULT_DAYS, help=f"How many days back to compare (default: {DEFAULT_DAYS}, 0 = all)")
+    args = parser.parse_args()
+
+    if args.rebuild and INDEX_FILE.exists():
+        INDEX_FILE.unlink()
+
+    index = ImageHashIndex()
+    hashed = index.update()
+    index.save()
+    print(f"Index: {len(index.entries)} images ({hashed} newly hashed)")
+
+    if args.check:
+        targets = [Path(args.check)]
+    elif args.date:
+        targets = sorted((IMAGES_DIR / args.date).glob("*.png"))
+    else:
+        return
+
+    print("=" * 50)
+    duplicates = 0
+    for image_path in targets:
+        matches = index.find_similar(image_path, args.threshold, args.days)
+        if matches:
+            duplicates += 1
+            similar = ", ".join(f"{key} ({distance})" for distance, key in matches[:3])
+            print(f"  {image_path.name}: similar to {similar}")
+        else:
+            print(f"  {image_path.name}: unique")
+
+    print(f"\nNear-duplicates: {duplicates}/{len(targets)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+"""
+Image Worker - Renders the async /api/image jobs
+
+Usage: python image_worker.py [--workers 2] [--interval 2] [--once]
+
+/api/image with "async": true queues a job (api/_image_jobs.py) instead of
+holding a serverless invocation open while gpt-image-1 renders. This worker
+claims queued jobs, downloads each job's reference image from the blob
+store, calls /images/edits and stores the result and thumbnail in the blob
+store (api/_blob_store.py), then marks the job done or failed for the
+browser's next poll.
+
+It shares its stores with the deployment through the environment: Vercel KV
+(KV_REST_API_URL / KV_REST_API_TOKEN) or, locally, the same IMAGE_JOB_DB
+file, plus BLOB_READ_WRITE_TOKEN or the same BLOB_DIR. Every poll writes a
+heartbeat; /api/image only offers async mode while it is fresh, so stopping
+the worker makes the endpoint fall back to rendering synchronously.
+
+Requirements: pip install -r api/requirements.txt python-dotenv
+"""
+
+import os
+import sys
+import time
+import argparse
+import threading
+from pathlib import Path
+
+from dotenv import load_dotenv
+
+# Fix Windows console encoding for emojis
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+
+# Paths
+BASE_DIR = Path(__file__).parent.parent
+API_DIR = BASE_DIR / "api"
+
+load_dotenv(BASE_DIR / ".env")
+
+# The api/ helpers are plain modules next to the Vercel handlers
+sys.path.insert(0, str(API_DIR))
+from _image_jobs import get_job_store, DONE, FAILED  # noqa: E402
+from _blob_store import read_blob  # noqa: E402
+from image import open_gpt_image, store_image, url_payload  # noqa: E402
+
+# Seconds to wait after a store error before trying again
+ERROR_BACKOFF = 10
+
+
+def render(api_key: str, params: dict) -> dict:
+    """Render one job. Returns the /api/image URL payload, raises on failure."""
+    image = read_blob(params['reference_url'])
+    upstream, error = open_gpt_image(api_key, params['full_prompt'], image, params['size'], params['quality'])
+    if error:
+        raise RuntimeError(error)
+    with upstream:
+        urls = store_image(upstream)
+    if urls is None:
+        raise RuntimeError('GPT Image error: no image data in response')
+    return url_payload(params['full_prompt'], *urls)
+
+
+def work_loop(api_key: str, interval: float, once: bool, stop: threading.Event):
+    """Claim and render jobs until stopped (or, with once, until the queue is empty)."""
+    store = get_job_store()
+    while not stop.is_set():
+        try:
+            store.heartbeat()
+            job = store.claim()
+        except Exception as e:
+            print(f"  Job store error: {e}")
+            stop.wait(ERROR_BACKOFF)
+            continue
+
+        if job is None:
+            if once:
+                return
+            stop.wait(interval)
+            continue
+
+        started = time.time()
+        print(f"  Rendering job {job['id']} ({job['params']['size']}, {job['params']['quality']})")
+        result, error = None, None
+        try:
+            result = render(api_key, job['params'])
+            print(f"  Job {job['id']} done in {time.time() - started:.1f}s")
+        except Exception as e:
+            error = str(e)
+            print(f"  Job {job['id']} failed: {error}")
+
+        try:
+            store.update(job['id'], FAILED if error else DONE, result=result, error=error)
+        except Exception as e:
+            print(f"  Job store error: {e}")
+            stop.wait(ERROR_BACKOFF)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Render queued async /api/image jobs")
+    parser.add_argument("--workers", type=int, default=2, help="Jobs rendered at once (default: 2)")
+    parser.add_argument("--interval", type=float, default=2, help="Seconds between polls when idle (default: 2)")
+    parser.add_argument("--once", action="store_true", help="Render what is queued, then exit")
+    args = parser.parse_args()
+
+    api_key = os.getenv("OPENAI_API_KEY")
+    if not api_key:
+        print("ERROR: OPENAI_API_KEY not configured")
+        sys.exit(1)
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+
+    print(f"Image worker running with {args.workers} worker(s)")
+    stop = threading.Event()
+    threads = [
+        threading.Thread(target=work_loop, args=(api_key, args.interval, args.once, stop), daemon=True)
+        for _ in range(args.workers)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            while thread.is_alive():
+                thread.join(0.5)
+    except KeyboardInterrupt:
+        print("Stopping")
+        stop.set()
+
+
+if __name__ == "__main__":
+    main()
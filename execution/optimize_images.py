@@ -0,0 +1,152 @@
+"""
+Optimize Images - Recompresses generated PNGs before they are committed
+
+Usage: python optimize_images.py [--date YYYY-MM-DD] [--lossy] [--colors 256] [--workers N]
+
+gpt-image-1 returns 1.5-2.6 MB PNGs. Lossless mode re-encodes them with
+maximum zlib compression and strips metadata; --lossy additionally quantizes
+to a palette (256 colors by default), which typically cuts size by 60-75%.
+Files are only replaced when the result is smaller.
+
+Original and optimized sizes are recorded on each post in
+.tmp/daily_content/YYYY-MM-DD.json.
+
+Requirements: pip install Pillow
+"""
+
+import os
+import sys
+import json
+import argparse
+from pathlib import Path
+from datetime import date
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from PIL import Image
+
+# Fix Windows console encoding for emojis
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+
+# Paths
+BASE_DIR = Path(__file__).parent.parent
+CONTENT_DIR = BASE_DIR / ".tmp" / "daily_content"
+IMAGES_DIR = BASE_DIR / ".tmp" / "images"
+
+
+def optimize_png(image_path: str, lossy: bool = False, colors: int = 256) -> dict:
+    """Recompress a single PNG in place. Runs inside a worker process."""
+    path = Path(image_path)
+    original_bytes = path.stat().st_size
+    temp_path = path.with_suffix(".opt.png")
+
+    with Image.open(path) as img:
+        img.load()
+        if lossy:
+            # Fast octree supports RGBA, so transparency survives quantization
+            img = img.quantize(colors=colors, method=Image.Quantize.FASTOCTREE)
+        img.save(temp_path, format="PNG", optimize=True, compress_level=9)
+
+    optimized_bytes = temp_path.stat().st_size
+    if optimized_bytes < original_bytes:
+        temp_path.replace(path)
+    else:
+        temp_path.unlink()
+        optimized_bytes = original_bytes
+
+    return {
+        "path": image_path,
+        "original_bytes": original_bytes,
+        "optimized_bytes": optimized_bytes,
+    }
+
+
+def optimize_daily_images(target_date: str, lossy: bool = False, colors: int = 256, workers: int = None):
+    """Optimize every image for a date and record sizes in the content JSON."""
+    date_images_dir = IMAGES_DIR / target_date
+    if not date_images_dir.exists():
+        print(f"No images found for {target_date}")
+        return
+
+    content_file = CONTENT_DIR / f"{target_date}.json"
+    content = None
+    posts_by_path = {}
+    if content_file.exists():
+        with open(content_file, 'r', encoding='utf-8') as f:
+            content = json.load(f)
+        for post in content.get('posts', []):
+            if post.get('image_path'):
+                posts_by_path[str(BASE_DIR / post['image_path'])] = post
+
+    # Skip images already optimized in this mode (or lossy, when asking for
+    # lossless) that haven't been regenerated since
+    mode_name = "lossy" if lossy else "lossless"
+    pending = []
+    for image_path in sorted(date_images_dir.glob("*.png")):
+        if image_path.name.endswith(".opt.png"):
+            continue
+        post = posts_by_path.get(str(image_path))
+        if post and post.get('image_optimized_bytes') == image_path.stat().st_size:
+            if post.get('image_optimization') in (mode_name, "lossy"):
+                continue
+        pending.append(str(image_path))
+
+    mode = f"lossy ({colors} colors)" if lossy else "lossless"
+    print(f"Optimizing images for {target_date} ({mode})")
+    print(f"Images to process: {len(pending)}")
+    print("=" * 50)
+
+    if not pending:
+        return
+
+    total_before = 0
+    total_after = 0
+    with ProcessPoolExecutor(max_workers=workers or os.cpu_count()) as pool:
+        futures = {pool.submit(optimize_png, path, lossy, colors): path for path in pending}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"  {Path(path).name}: Error: {e}")
+                continue
+
+            before = result['original_bytes']
+            after = result['optimized_bytes']
+            total_before += before
+            total_after += after
+            print(f"  {Path(path).name}: {before / 1024:.0f} KB -> {after / 1024:.0f} KB")
+
+            post = posts_by_path.get(path)
+            if post is not None:
+                # A file still matching the recorded optimized size is being
+                # re-optimized, so keep the size it had when first generated
+                if post.get('image_optimized_bytes') != before or 'image_original_bytes' not in post:
+                    post['image_original_bytes'] = before
+                post['image_optimized_bytes'] = after
+                post['image_optimization'] = mode_name
+
+    if content is not None:
+        with open(content_file, 'w', encoding='utf-8') as f:
+            json.dump(content, f, indent=2, ensure_ascii=False)
+
+    saved = total_before - total_after
+    pct = (saved / total_before * 100) if total_before else 0
+    print("\n" + "=" * 50)
+    print(f"Done! {total_before / 1024 / 1024:.1f} MB -> {total_after / 1024 / 1024:.1f} MB ({pct:.0f}% smaller)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Optimize generated images")
+    parser.add_argument("--date", type=str, help="Date to optimize (YYYY-MM-DD)", default=None)
+    parser.add_argument("--lossy", action="store_true", help="Quantize to a color palette (smaller, slight quality loss)")
+    parser.add_argument("--colors", type=int, default=256, help="Palette size for --lossy (default: 256)")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: CPU count)")
+    args = parser.parse_args()
+
+    target_date = args.date or date.today().isoformat()
+    optimize_daily_images(target_date, args.lossy, args.colors, args.workers)
+
+
+if __name__ == "__main__":
+    main()
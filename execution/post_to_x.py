@@ -7,7 +7,7 @@ import sys
 import json
 import base64
 from pathlib import Path
-from datetime import date
+from datetime import date, datetime, timezone
 
 # Fix Windows console encoding
 sys.stdout.reconfigure(encoding='utf-8', errors='replace')
@@ -26,8 +26,12 @@ ACCESS_TOKEN = os.getenv("X_ACCESS_TOKEN")
 ACCESS_TOKEN_SECRET = os.getenv("X_ACCESS_TOKEN_SECRET")
 
 
-def get_x_client():
-    """Create and return authenticated X API client."""
+def get_x_client(wait_on_rate_limit: bool = True):
+    """Create and return authenticated X API client.
+
+    With wait_on_rate_limit, tweepy reads the x-rate-limit-* headers and
+    sleeps until the window resets instead of failing with a 429.
+    """
     # OAuth 1.0a authentication for posting
     auth = tweepy.OAuth1UserHandler(
         API_KEY,
@@ -37,14 +41,15 @@ def get_x_client():
     )
 
     # API v1.1 for media upload
-    api_v1 = tweepy.API(auth)
+    api_v1 = tweepy.API(auth, wait_on_rate_limit=wait_on_rate_limit)
 
     # API v2 for posting tweets
     client = tweepy.Client(
         consumer_key=API_KEY,
         consumer_secret=API_SECRET,
         access_token=ACCESS_TOKEN,
-        access_token_secret=ACCESS_TOKEN_SECRET
+        access_token_secret=ACCESS_TOKEN_SECRET,
+        wait_on_rate_limit=wait_on_rate_limit
     )
 
     return client, api_v1
@@ -144,14 +149,24 @@ def post_from_daily_content(post_index: int = 0, target_date: str = None):
     if image_path:
         full_image_path = BASE_DIR / image_path
         if full_image_path.exists():
-            return post_with_image(text, str(full_image_path))
+            result = post_with_image(text, str(full_image_path))
         else:
             print(f"Image not found: {full_image_path}")
             print("Posting without image...")
-            return post_text_only(text)
+            result = post_text_only(text)
     else:
         print("No image for this post, posting text only...")
-        return post_text_only(text)
+        result = post_text_only(text)
+
+    if result.get('success'):
+        # Record the tweet so refresh_metrics.py can track its engagement
+        post['tweet_id'] = str(result['tweet_id'])
+        post['tweet_url'] = result['tweet_url']
+        post['posted_at'] = datetime.now(timezone.utc).isoformat(timespec='seconds')
+        with open(content_file, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, ensure_ascii=False)
+
+    return result
 
 
 def main():
@@ -0,0 +1,178 @@
+"""
+Refresh Metrics - Snapshots engagement of recently posted tweets
+
+Usage: python refresh_metrics.py [--days 7] [--ids ID,ID,...] [--workers 4] [--report]
+
+Collects the tweet ids that post_to_x.py recorded in .tmp/daily_content/*.json
+over the last --days days (plus any --ids), then fetches their public_metrics
+with GET /2/tweets?ids= in batches of 100, so 700 tracked posts cost 7 API
+calls instead of 700. Batches run in parallel; tweepy waits out any 429s.
+
+Every run appends one snapshot per tweet to .tmp/metrics/snapshots.jsonl,
+building an engagement curve per post over time. The latest metrics are also
+written back to each post as `metrics` / `metrics_updated_at`.
+
+Requirements: pip install tweepy python-dotenv
+"""
+
+import sys
+import json
+import argparse
+from pathlib import Path
+from datetime import date, datetime, timedelta, timezone
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from post_to_x import get_x_client
+
+# Fix Windows console encoding for emojis
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+
+# Paths
+BASE_DIR = Path(__file__).parent.parent
+CONTENT_DIR = BASE_DIR / ".tmp" / "daily_content"
+METRICS_DIR = BASE_DIR / ".tmp" / "metrics"
+SNAPSHOTS_FILE = METRICS_DIR / "snapshots.jsonl"
+
+# GET /2/tweets accepts up to 100 ids per call
+BATCH_SIZE = 100
+
+
+def collect_tracked_tweets(days: int = 7) -> dict:
+    """Map tweet_id -> (content file, post index) for posts from the last `days` days."""
+    cutoff = (date.today() - timedelta(days=days)).isoformat()
+    tracked = {}
+    for content_file in sorted(CONTENT_DIR.glob("*.json")):
+        if content_file.stem < cutoff:
+            continue
+        with open(content_file, 'r', encoding='utf-8') as f:
+            content = json.load(f)
+        for i, post in enumerate(content.get('posts', [])):
+            if post.get('tweet_id'):
+                tracked[str(post['tweet_id'])] = (content_file, i)
+    return tracked
+
+
+def fetch_metrics_batch(client, tweet_ids: list) -> tuple:
+    """Look up one batch of up to 100 ids. Returns ({id: metrics}, [missing ids])."""
+    response = client.get_tweets(ids=tweet_ids, tweet_fields=["public_metrics", "created_at"])
+    metrics = {str(tweet.id): dict(tweet.public_metrics or {}) for tweet in (response.data or [])}
+    missing = [str(tweet_id) for tweet_id in tweet_ids if str(tweet_id) not in metrics]
+    return metrics, missing
+
+
+def fetch_metrics(tweet_ids: list, workers: int = 4) -> tuple:
+    """Fetch public_metrics for all ids, BATCH_SIZE per call, batches in parallel."""
+    client, _ = get_x_client(wait_on_rate_limit=True)
+    batches = [tweet_ids[i:i + BATCH_SIZE] for i in range(0, len(tweet_ids), BATCH_SIZE)]
+
+    metrics, missing = {}, []
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(batches)))) as pool:
+        futures = {pool.submit(fetch_metrics_batch, client, batch): batch for batch in batches}
+        for future in as_completed(futures):
+            try:
+                batch_metrics, batch_missing = future.result()
+            except Exception as e:
+                print(f"  Batch of {len(futures[future])} failed: {e}")
+                continue
+            metrics.update(batch_metrics)
+            missing.extend(batch_missing)
+    return metrics, missing, len(batches)
+
+
+def append_snapshots(metrics: dict, taken_at: str):
+    """Append one line per tweet to the time-series file."""
+    METRICS_DIR.mkdir(parents=True, exist_ok=True)
+    with open(SNAPSHOTS_FILE, 'a', encoding='utf-8') as f:
+        for tweet_id, values in metrics.items():
+            f.write(json.dumps({'tweet_id': tweet_id, 'taken_at': taken_at, **values}) + "\n")
+
+
+def load_snapshots(tweet_ids=None) -> dict:
+    """Read the time series back as {tweet_id: [snapshot, ...]} in time order."""
+    series = {}
+    if not SNAPSHOTS_FILE.exists():
+        return series
+    wanted = set(tweet_ids) if tweet_ids else None
+    with open(SNAPSHOTS_FILE, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            snapshot = json.loads(line)
+            if wanted is None or snapshot['tweet_id'] in wanted:
+                series.setdefault(snapshot['tweet_id'], []).append(snapshot)
+    return series
+
+
+def save_latest_metrics(tracked: dict, metrics: dict, taken_at: str):
+    """Write the newest metrics back onto the posts in the daily content files."""
+    by_file = {}
+    for tweet_id, values in metrics.items():
+        if tweet_id in tracked:
+            content_file, index = tracked[tweet_id]
+            by_file.setdefault(content_file, []).append((index, values))
+
+    for content_file, updates in by_file.items():
+        with open(content_file, 'r', encoding='utf-8') as f:
+            content = json.load(f)
+        for index, values in updates:
+            content['posts'][index]['metrics'] = values
+            content['posts'][index]['metrics_updated_at'] = taken_at
+        with open(content_file, 'w', encoding='utf-8') as f:
+            json.dump(content, f, indent=2, ensure_ascii=False)
+
+
+def print_report(tweet_ids: list):
+    """Print how each tracked post's engagement moved since its first snapshot."""
+    series = load_snapshots(tweet_ids)
+    print(f"{'Tweet':<22}{'Snapshots':>10}{'Likes':>14}{'Retweets':>14}{'Impressions':>18}")
+    for tweet_id in tweet_ids:
+        snapshots = series.get(tweet_id)
+        if not snapshots:
+            continue
+        first, last = snapshots[0], snapshots[-1]
+
+        def change(key):
+            return f"{first.get(key, 0)}->{last.get(key, 0)}"
+
+        print(f"{tweet_id:<22}{len(snapshots):>10}{change('like_count'):>14}"
+              f"{change('retweet_count'):>14}{change('impression_count'):>18}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Snapshot engagement metrics for recently posted tweets")
+    parser.add_argument("--days", type=int, default=7, help="Track posts from the last N days (default: 7)")
+    parser.add_argument("--ids", type=str, default=None, help="Extra comma-separated tweet ids to track")
+    parser.add_argument("--workers", type=int, default=4, help="Parallel lookup batches (default: 4)")
+    parser.add_argument("--report", action="store_true", help="Print engagement curves instead of refreshing")
+    args = parser.parse_args()
+
+    tracked = collect_tracked_tweets(args.days)
+    tweet_ids = list(tracked)
+    if args.ids:
+        tweet_ids += [i.strip() for i in args.ids.split(",") if i.strip() and i.strip() not in tracked]
+
+    if not tweet_ids:
+        print(f"No posted tweets found in the last {args.days} days")
+        return 0
+
+    if args.report:
+        print_report(tweet_ids)
+        return 0
+
+    print(f"Refreshing metrics for {len(tweet_ids)} tweets...")
+    taken_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    metrics, missing, calls = fetch_metrics(tweet_ids, args.workers)
+
+    append_snapshots(metrics, taken_at)
+    save_latest_metrics(tracked, metrics, taken_at)
+
+    print(f"Snapshotted {len(metrics)} tweets in {calls} API calls")
+    if missing:
+        print(f"Not returned (deleted, protected or failed): {len(missing)}")
+    print(f"Time series: {SNAPSHOTS_FILE}")
+    return 0 if metrics else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,390 @@
+"""
+Reply Worker - Server-side polling loop for the reply bot
+
+Usage: python reply_worker.py [--interval 60] [--once] [--dry-run]
+                              [--settings PATH] [--post-ids ID,ID] [--fake]
+
+Watches every post in the bot's enabled_post_ids, fetches new replies with
+conversation_id search (following pagination, and only past each post's
+since_id watermark), and queues a GM reply for each new commenter. A
+scheduler sends queued replies one at a time, spaced by reply_speed, and
+max_replies_per_post / verified_only / one-reply-per-author are enforced
+before anything is queued. Runs without a browser tab open.
+
+A post's watermark only moves past a queued reply once that reply has been
+answered and logged, so replies still queued when the worker stops are
+fetched again on the next start. X API timeouts, connection failures and
+bot store errors end the current cycle; the worker logs them and backs off
+(ERROR_BACKOFF, doubling up to MAX_ERROR_BACKOFF) before trying again.
+
+Settings, watermarks, the replied-to set and the reply log are read from and
+written to the bot store (api/_bot_store.py: SQLite at BOT_STORE_DB, or Vercel
+KV when KV_REST_API_URL / KV_REST_API_TOKEN are set), under the bot account's
+user id. The dashboard (reply-bot.html) saves its settings there through
+POST /api/reply-bot?action=settings, so they apply on the next poll; the
+worker and the dashboard must share the same store and bot account.
+--settings PATH overlays a JSON file (same shape as GET /api/reply-bot).
+
+Auth: an OAuth 2.0 user token with tweet.write scope, from X_BOT_ACCESS_TOKEN
+and X_BOT_REFRESH_TOKEN. Rotated tokens are saved (encrypted with
+ENCRYPTION_KEY when set) to .tmp/reply_bot/tokens.json.
+
+--fake starts fake_x_api.py in-process and points the worker at it, with
+instant replies and a throwaway store in a temporary directory, for trying
+the whole loop offline.
+
+Requirements: pip install -r api/requirements.txt python-dotenv
+"""
+
+import os
+import sys
+import json
+import time
+import random
+import sqlite3
+import argparse
+import tempfile
+from collections import deque
+from pathlib import Path
+
+import requests
+from dotenv import load_dotenv
+
+# Fix Windows console encoding for emojis
+if sys.platform == 'win32':
+    sys.stdout.reconfigure(encoding='utf-8', errors='replace')
+
+# Paths
+BASE_DIR = Path(__file__).parent.parent
+API_DIR = BASE_DIR / "api"
+BOT_DIR = BASE_DIR / ".tmp" / "reply_bot"
+TOKENS_FILE = BOT_DIR / "tokens.json"
+
+load_dotenv(BASE_DIR / ".env")
+
+# The api/ helpers are plain modules next to the Vercel handlers
+sys.path.insert(0, str(API_DIR))
+from _x_client import x_api, RateLimited, TIMEOUT_ERRORS, CONNECTION_ERRORS  # noqa: E402
+from _session import Session, encrypt_token, decrypt_token  # noqa: E402
+from _reply_bot import (  # noqa: E402
+    fetch_replies, pick_reply, post_reply, reply_delay, max_replies, SearchError,
+)
+from _bot_store import get_bot_store, SQLiteBotStore  # noqa: E402
+
+# Seconds to wait after a failed cycle, doubled per consecutive failure
+ERROR_BACKOFF = 30
+MAX_ERROR_BACKOFF = 600
+
+# Failures that end one poll/send cycle instead of the worker: X API transport
+# errors and bot store errors (SQLite, or the KV REST API)
+CYCLE_ERRORS = TIMEOUT_ERRORS + CONNECTION_ERRORS + (requests.RequestException, sqlite3.Error)
+
+
+def load_settings(store, user_id, path: Path = None, post_ids=None) -> dict:
+    settings = store.get_settings(user_id)
+    if path and path.exists():
+        with open(path, 'r', encoding='utf-8') as f:
+            settings.update(json.load(f))
+    if post_ids:
+        settings['enabled_post_ids'] = post_ids
+        settings['enabled'] = True
+    return settings
+
+
+class ReplyScheduler:
+    """FIFO queue of replies, released one at a time, reply_delay() apart."""
+
+    def __init__(self):
+        self.queue = deque()
+        self.next_send_at = 0.0
+        self.pending = {}        # post_id -> queued replies, counted against max_replies_per_post
+        self.queued_authors = set()
+
+    def __len__(self):
+        return len(self.queue)
+
+    def is_queued(self, post_id, author_id) -> bool:
+        return f"{post_id}:{author_id}" in self.queued_authors
+
+    def add(self, item):
+        self.queue.append(item)
+        self.pending[item['post_id']] = self.pending.get(item['post_id'], 0) + 1
+        self.queued_authors.add(f"{item['post_id']}:{item['author_id']}")
+
+    def next_due(self, now: float):
+        """Pop the next reply if its turn has come."""
+        if not self.queue or now < self.next_send_at:
+            return None
+        return self.queue.popleft()
+
+    def done(self, item, delay: float):
+        self.pending[item['post_id']] -= 1
+        self.queued_authors.discard(f"{item['post_id']}:{item['author_id']}")
+        self.next_send_at = time.time() + delay
+
+    def retry_later(self, item, seconds: float):
+        self.queue.appendleft(item)
+        self.next_send_at = time.time() + seconds
+
+
+class ReplyWorker:
+    def __init__(self, session, settings_path: Path = None, post_ids=None, dry_run=False, store=None):
+        self.session = session
+        self.settings_path = settings_path
+        self.post_ids = post_ids
+        self.dry_run = dry_run
+        self.store = store or get_bot_store()
+        self.scheduler = ReplyScheduler()
+        self.settings = {}
+        self.me = None
+        self.rng = random.Random()
+
+    def _auth_get(self, path, **kwargs):
+        response = x_api.get(path, headers=self.session.auth_headers, **kwargs)
+        if response.status_code == 401 and self.session.refresh():
+            response = x_api.get(path, headers=self.session.auth_headers, **kwargs)
+        return response
+
+    def whoami(self):
+        response = self._auth_get("/2/users/me")
+        if response.status_code != 200:
+            raise RuntimeError(f"Could not resolve the bot account: status {response.status_code}")
+        self.me = response.json()['data']['id']
+        return self.me
+
+    def poll(self) -> int:
+        """Fetch new replies on every enabled post and queue responses. Returns replies queued."""
+        self.settings = load_settings(self.store, self.me, self.settings_path, self.post_ids)
+        if not self.settings.get('enabled'):
+            return 0
+
+        limit = max_replies(self.settings)
+        queued = 0
+        for post_id in self.settings.get('enabled_post_ids', []):
+            post_id = str(post_id)
+            sent = self.store.reply_count(self.me, post_id) + self.scheduler.pending.get(post_id, 0)
+            if limit is not None and sent >= limit:
+                continue
+
+            try:
+                replies, newest_id = self._fetch(post_id)
+            except SearchError as e:
+                print(f"  Post {post_id}: search failed with status {e.status_code}")
+                continue
+            except RateLimited as e:
+                print(f"  Search rate limited, resuming in {e.retry_after}s")
+                break
+
+            # Oldest first, so the earliest commenters get answered first
+            batch = []
+            for reply in reversed(replies):
+                author = reply['author']
+                if author['id'] == self.me:
+                    continue
+                if self.settings.get('verified_only') and not author.get('verified'):
+                    continue
+                if self.store.has_replied(self.me, post_id, author['id']) or self.scheduler.is_queued(post_id, author['id']):
+                    continue
+                if limit is not None and sent >= limit:
+                    break
+                text = pick_reply(self.settings, author.get('name'), self.rng)
+                if not text:
+                    break
+                batch.append({
+                    'post_id': post_id,
+                    'reply_id': reply['id'],
+                    'author_id': author['id'],
+                    'author_name': author.get('name'),
+                    'text': text,
+                    'watermark': reply['id'],
+                })
+                sent += 1
+
+            if batch:
+                # Answering the last one also covers the replies skipped after it
+                batch[-1]['watermark'] = newest_id or batch[-1]['watermark']
+                for item in batch:
+                    self.scheduler.add(item)
+                queued += len(batch)
+            elif newest_id and not self.scheduler.pending.get(post_id):
+                # Nothing to answer and nothing waiting, move past everything fetched
+                self.store.set_watermark(self.me, post_id, newest_id)
+
+        return queued
+
+    def _fetch(self, post_id):
+        since_id = self.store.get_watermark(self.me, post_id)
+        try:
+            return fetch_replies(self.session.auth_headers, post_id, since_id)
+        except SearchError as e:
+            if e.status_code == 401 and self.session.refresh():
+                return fetch_replies(self.session.auth_headers, post_id, since_id)
+            raise
+
+    def send_due(self) -> int:
+        """Send every reply whose turn has come. Returns replies sent."""
+        sent = 0
+        while True:
+            item = self.scheduler.next_due(time.time())
+            if item is None:
+                return sent
+
+            if self.dry_run:
+                print(f"  [dry run] @{item['author_name']} on {item['post_id']}: {item['text']}")
+                self._record(item, None)
+                self.scheduler.done(item, reply_delay(self.settings, self.rng))
+                sent += 1
+                continue
+
+            try:
+                response = post_reply(self.session.auth_headers, item['reply_id'], item['text'])
+                if response.status_code == 401 and self.session.refresh():
+                    response = post_reply(self.session.auth_headers, item['reply_id'], item['text'])
+            except RateLimited as e:
+                print(f"  Reply rate limited, retrying in {e.retry_after}s")
+                self.scheduler.retry_later(item, e.retry_after)
+                return sent
+            except (TIMEOUT_ERRORS + CONNECTION_ERRORS) as e:
+                print(f"  Reply failed ({e}), retrying in 30s")
+                self.scheduler.retry_later(item, 30)
+                return sent
+
+            if response.status_code == 429:
+                self.scheduler.retry_later(item, 60)
+                return sent
+            if response.status_code not in (200, 201):
+                print(f"  Reply to {item['reply_id']} failed with status {response.status_code}, skipping")
+                self.store.set_watermark(self.me, item['post_id'], item['watermark'])
+                self.scheduler.done(item, 0)
+                continue
+
+            reply_id = response.json().get('data', {}).get('id')
+            self._record(item, reply_id)
+            self.scheduler.done(item, reply_delay(self.settings, self.rng))
+            sent += 1
+            print(f"  Replied to @{item['author_name']} on {item['post_id']}: {item['text']}")
+
+    def _record(self, item, reply_id):
+        """Log a sent reply, then move the post's watermark past it."""
+        self.store.record_reply(self.me, {
+            'post_id': item['post_id'],
+            'author_id': item['author_id'],
+            'author_name': item['author_name'],
+            'reply_to_id': item['reply_id'],
+            'reply_id': reply_id,
+            'reply_text': item['text'],
+        })
+        self.store.set_watermark(self.me, item['post_id'], item['watermark'])
+
+    def run(self, interval: float, once: bool = False):
+        next_poll = 0.0
+        failures = 0
+        while True:
+            now = time.time()
+            try:
+                if self.me is None:
+                    self.whoami()
+                    print(f"Reply worker running as user {self.me}, polling every {interval:.0f}s")
+                if now >= next_poll:
+                    queued = self.poll()
+                    if queued:
+                        print(f"Queued {queued} replies ({len(self.scheduler)} waiting)")
+                    next_poll = now + interval
+                    if once and not self.scheduler:
+                        return
+
+                self.send_due()
+                failures = 0
+            except CYCLE_ERRORS as e:
+                failures += 1
+                backoff = min(ERROR_BACKOFF * 2 ** (failures - 1), MAX_ERROR_BACKOFF)
+                if once:
+                    print(f"  Cycle failed ({type(e).__name__}: {e})")
+                    return
+                print(f"  Cycle failed ({type(e).__name__}: {e}), retrying in {backoff}s")
+                time.sleep(backoff)
+                continue
+            if once and not self.scheduler:
+                return
+
+            wake_at = next_poll
+            if self.scheduler:
+                wake_at = min(wake_at, self.scheduler.next_send_at)
+            time.sleep(min(max(0.05, wake_at - time.time()), interval))
+
+
+def load_session():
+    """Build a Session from saved (rotated) tokens or the X_BOT_* env vars."""
+    access_token = os.getenv("X_BOT_ACCESS_TOKEN")
+    refresh_token = os.getenv("X_BOT_REFRESH_TOKEN")
+    if TOKENS_FILE.exists():
+        with open(TOKENS_FILE, 'r', encoding='utf-8') as f:
+            saved = json.load(f)
+        access_token = decrypt_token(saved.get('access_token')) or access_token
+        refresh_token = decrypt_token(saved.get('refresh_token')) or refresh_token
+    if not access_token and not refresh_token:
+        return None
+
+    session = Session({}, access_token, refresh_token, {})
+    original_refresh = session.refresh
+
+    def refresh_and_save():
+        if not original_refresh():
+            return False
+        TOKENS_FILE.parent.mkdir(parents=True, exist_ok=True)
+        with open(TOKENS_FILE, 'w', encoding='utf-8') as f:
+            json.dump({
+                'access_token': encrypt_token(session.access_token),
+                'refresh_token': encrypt_token(session.refresh_token),
+            }, f)
+        return True
+
+    session.refresh = refresh_and_save
+    return session
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Poll enabled posts for new replies and answer them")
+    parser.add_argument("--interval", type=float, default=60, help="Seconds between polls (default: 60)")
+    parser.add_argument("--once", action="store_true", help="Poll once, send what was queued, then exit")
+    parser.add_argument("--dry-run", action="store_true", help="Log replies instead of posting them")
+    parser.add_argument("--settings", type=str, default=None, help="JSON file overlaid on the stored settings")
+    parser.add_argument("--post-ids", type=str, default=None, help="Comma-separated post ids to watch (overrides settings)")
+    parser.add_argument("--fake", action="store_true", help="Run against an in-process fake X API")
+    args = parser.parse_args()
+
+    post_ids = [i.strip() for i in args.post_ids.split(",") if i.strip()] if args.post_ids else None
+    settings_path = Path(args.settings) if args.settings else None
+    store = None
+
+    if args.fake:
+        from fake_x_api import start_server
+        fake, base_url = start_server(reply_rate=30)
+        x_api.base_url = base_url
+        os.environ.setdefault("X_BOT_ACCESS_TOKEN", "fake-access")
+        if not post_ids:
+            post_ids = fake.RequestHandlerClass.state.timeline[:3]
+        fake_dir = tempfile.TemporaryDirectory(prefix="reply_bot_fake_")
+        settings_path = Path(fake_dir.name) / "fake_settings.json"
+        with open(settings_path, 'w', encoding='utf-8') as f:
+            json.dump({'reply_speed': 'instant', 'verified_only': False}, f)
+        store = SQLiteBotStore(str(Path(fake_dir.name) / "fake_store.sqlite3"))
+        print(f"Using fake X API at {base_url}, watching {', '.join(post_ids)}")
+
+    session = Session({}, "fake-access", None, {}) if args.fake else load_session()
+    if session is None:
+        print("No bot credentials: set X_BOT_ACCESS_TOKEN and X_BOT_REFRESH_TOKEN (or use --fake)")
+        return 1
+
+    worker = ReplyWorker(session, settings_path, post_ids, args.dry_run, store)
+    try:
+        worker.run(args.interval, args.once)
+    except KeyboardInterrupt:
+        print("\nStopping")
+    if worker.me:
+        print(f"Replies sent so far: {worker.store.replies_sent(worker.me)}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())